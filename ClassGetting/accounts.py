@@ -0,0 +1,47 @@
+import json
+import os
+
+ACCOUNTS_FILE = "accounts.json"
+
+def load_accounts(path=ACCOUNTS_FILE):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return []
+
+def save_account(username, password):
+    accounts = load_accounts()
+    # 简单去重
+    accounts = [acc for acc in accounts if acc["username"] != username]
+    accounts.insert(0, {"username": username, "password": password})
+    with open(ACCOUNTS_FILE, "w", encoding="utf-8") as f:
+        json.dump(accounts, f, ensure_ascii=False, indent=2)
+
+def get_password(username):
+    accounts = load_accounts()
+    for acc in accounts:
+        if acc["username"] == username:
+            return acc["password"]
+    return ""
+
+# 保存的登录会话，只有 cookie，不含密码，下次启动时可以跳过 jaccount 登录
+SESSIONS_DIR = "sessions"
+
+def session_file(username):
+    return os.path.join(SESSIONS_DIR, f"{username}.json")
+
+def save_cookies(username, cookies):
+    os.makedirs(SESSIONS_DIR, exist_ok=True)
+    with open(session_file(username), "w", encoding="utf-8") as f:
+        json.dump(cookies, f)
+    # 旧版本把 cookie 和密码一起 pickle 在 .session 文件里
+    legacy = os.path.join(SESSIONS_DIR, f"{username}.session")
+    if os.path.exists(legacy):
+        os.remove(legacy)
+
+def load_cookies(username):
+    path = session_file(username)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
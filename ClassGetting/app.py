@@ -1,107 +1,405 @@
+import logging
 import sys
-import time
-from threading import Thread
-from typing import Optional, List
+from datetime import datetime
+from typing import Dict, Optional, List, Tuple
 
+import httpx
 import pysjtu
 from PyQt5 import QtWidgets
-from PyQt5.QtCore import QThread, pyqtSignal
-from pysjtu.exceptions import LoginException, FullCapacityException, SelectionNotAvailableException
+from PyQt5.QtCore import QObject, pyqtSignal
+from pysjtu.exceptions import LoginException, SelectionNotAvailableException
 from pysjtu.models import SelectionSector, SelectionClass
 
-from ui import LoginDialog, CourseSelectionWindow
+import engine
+from accounts import get_password, load_cookies, save_cookies
+from schedule_cache import ScheduleIndex, selection_term
+from scheduler import GrabScheduler, GroupJob, SelectJob, SwitchJob
+from burst import BurstPlan, ClockSync
+from catalog import CatalogCache, round_key
+from hotpath import HotPath
+from journal import JobJournal, journal_path
+from logs import setup_logging
+from metrics import METRICS, MetricsExporter
+from poller import fresh_classes
+from search import SectorIndex
+from session_monitor import ManagedSession, SessionMonitor
+from tasks import Task, TaskRunner
+from timetable import timetable_of
+from ui import LoginDialog, CourseSelectionWindow, StatsPanel
+
+log = logging.getLogger(__name__)
+
+# 同时在途的选课请求上限
+GRAB_CONCURRENCY = 4
+# 每个账号每秒最多发出的请求数，所有任务共用
+REQUEST_BUDGET = 5
+# 热路径模式：登录后预先建立长连接并保持预热
+HOT_PATH = True
+# 日志级别和定期写出的指标文件（.json 结尾写 JSON，否则写 Prometheus 文本格式）
+LOG_LEVEL = "INFO"
+METRICS_FILE = "metrics.prom"
+# 同一门课勾选了多个班级时，选上后是否继续等待更靠前（先勾选）的班级并换过去
+UPGRADE_GROUPS = False
+# 登录时先尝试沿用上次保存的会话，cookie 仍然有效时不必重新登录
+RESUME_SESSION = True
+# 会话登录超过这么久（秒）就在后台换上新会话；是否另外保持一个已登录的备用会话，失效时直接换上
+SESSION_MAX_AGE = 20 * 60
+STANDBY_SESSION = False
+# 退出时等待后台任务和正在换班的任务收尾的最长时间（秒）
+SHUTDOWN_TIMEOUT = 3
+
+
+class SchedulerBridge(QObject):
+    """把调度线程里的任务结果转发回 GUI 线程"""
+    signal = pyqtSignal(SelectionClass)
 
 
 class App:
     def __init__(self):
-        self.daemon_map: dict = dict()
-        self.app = QtWidgets.QApplication(sys.argv)
+        # run.py 为了尽快显示登录窗口，会先创建好 QApplication
+        self.app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+        self.bridge = SchedulerBridge()
+        self.scheduler = GrabScheduler(concurrency=GRAB_CONCURRENCY, on_finish=self.bridge.signal.emit,
+                                       request_budget=REQUEST_BUDGET)
         self.cli: Optional[pysjtu.Client] = None
+        self.tasks = TaskRunner()
+        self.hot_path: Optional[HotPath] = None
+        self.session_monitor: Optional[SessionMonitor] = None
+        self.logging_box: Optional[QtWidgets.QMessageBox] = None
+        self.stats_panel: Optional[StatsPanel] = None
+        self.exporter = MetricsExporter(METRICS, METRICS_FILE)
         self.selection_window: Optional[CourseSelectionWindow] = None
+        self.sectors: List[SelectionSector] = []
         self.sector: Optional[SelectionSector] = None
         self.selected_courses: List[SelectionClass] = []
+        # internal_course_id -> 勾选的候选班级（按勾选顺序排名）/ 勾选时已选着的同一门课的班级
+        self.candidates: Dict[str, List[SelectionClass]] = dict()
+        self.old_classes: Dict[str, object] = dict()
+        # internal_course_id -> 从任务日志恢复的候选组是否继续换到更靠前的班级，没有记录的按 UPGRADE_GROUPS
+        self.upgrades: Dict[str, bool] = dict()
+        # 任务日志，以及上次退出时还没结束、等分区加载后恢复的任务
+        self.journal: Optional[JobJournal] = None
+        self.pending_jobs: Dict[str, dict] = dict()
         self.keyword: str = ""
+        # 最近一次取到的课表，用于在搜索结果中隐藏时间冲突的班级
+        self.schedule: Optional[ScheduleIndex] = None
+        self.hide_conflicts = False
+        # 分区名 -> 搜索索引
+        self.indexes: Dict[str, SectorIndex] = dict()
+        self.catalog: Optional[CatalogCache] = None
+        # 分区名 -> 从目录缓存恢复、还没建索引的班级
+        self.cached_classes: Dict[str, List[SelectionClass]] = dict()
+        # quit() 在事件循环开始前被调用时（例如第一次登录就取消），run() 不再进入事件循环
+        self.quitting = False
 
-    @staticmethod
-    def quit():
-        sys.exit(0)
+    def quit(self):
+        """结束事件循环，由 run() 统一收尾退出；调用方在调用后应立即返回"""
+        self.quitting = True
+        self.app.quit()
 
     def handle_login(self):
         login_dialog = LoginDialog()
-        while True:
-            if login_dialog.exec_() == QtWidgets.QDialog.Accepted:
-                username, password = login_dialog.get_username_password()
-                print('用户名:', username)
-                #print('密码:', password)
-                # 显示“正在登录...”窗口
-                logging_box = QtWidgets.QMessageBox(self.selection_window)
-                logging_box.setWindowTitle("提示")
-                logging_box.setText("正在登录...")
-                logging_box.setStandardButtons(QtWidgets.QMessageBox.NoButton)
-                logging_box.show()
-                QtWidgets.QApplication.processEvents()  # 立即刷新界面
-                try:
-                    self.cli = pysjtu.create_client(username=username, password=password)
-                    print('登录成功！')
-                    print(f"已成功登录为{self.cli.student_id}。")
-                    # 登录成功弹窗
-                    QtWidgets.QMessageBox.information(
-                        self.selection_window,
-                        "登录成功！",
-                        f"已成功登录为{self.cli.student_id}。"
-                    )
-                    return
-                except LoginException:
-                    print('用户名或密码错误！')
-                    QtWidgets.QMessageBox.warning(
-                        self.selection_window,
-                        "提示",
-                        "用户名或密码错误！"
-                    )
-                except Exception as e:
-                    print(e)
-            else:
-                print('登录已取消！')
-                self.quit()
+        if login_dialog.exec_() != QtWidgets.QDialog.Accepted:
+            log.info('登录已取消！')
+            self.quit()
+            return
+        self.start_login(*login_dialog.get_username_password())
 
-    def fetch_sectors(self):
+    def start_login(self, username: str, password: str):
+        log.info('用户名: %s', username)
+        # 显示“正在登录...”窗口，登录本身在后台线程进行
+        self.logging_box = QtWidgets.QMessageBox(self.selection_window)
+        self.logging_box.setWindowTitle("提示")
+        self.logging_box.setText("正在登录...")
+        self.logging_box.setStandardButtons(QtWidgets.QMessageBox.NoButton)
+        self.logging_box.show()
+        self.tasks.run(lambda task: self.login(username, password),
+                       on_done=self.on_login, on_error=self.on_login_failed, group="login")
+
+    @staticmethod
+    def login(username: str, password: str) -> pysjtu.Client:
+        cli = App.resume_session(username, password) if RESUME_SESSION else None
+        if cli is None:
+            # 连接池按并发任务数建立
+            cli = engine.login(username, password, GRAB_CONCURRENCY)
+        log.info("已成功登录为%s。", cli.student_id)
+        App.save_session(cli)
+        return cli
+
+    @staticmethod
+    def save_session(cli: pysjtu.Client):
+        """只保存 cookie，密码不落盘"""
+        if not RESUME_SESSION:
+            return
+        cookies = [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+                   for c in cli._session._client.cookies.jar]
         try:
-            sectors = [sector.name for sector in self.cli.course_selection_sectors]
-            self.selection_window.add_sectors(sectors)
-            self.sector = self.cli.course_selection_sectors[0]
-        except SelectionNotAvailableException:
-            print("对不起，当前不属于选课阶段。")
+            save_cookies(cli._session._username, cookies)
+        except OSError as e:
+            log.warning("保存登录会话失败：%s", e)
+
+    @staticmethod
+    def resume_session(username: str, password: str) -> Optional[pysjtu.Client]:
+        """
+        用保存的 cookie 登录：cookie 有效时只需校验一次，失效时 pysjtu 用这次输入的密码重新登录。
+        记住了密码的账号，输入的密码和记住的不同时不使用；任何失败都返回 None，改为正常登录
+        """
+        saved = get_password(username)
+        if saved and saved != password:
+            return None
+        try:
+            conf = load_cookies(username)
+            if not conf:
+                return None
+            cookies = httpx.Cookies()
+            for cookie in conf:
+                cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"])
+            session = ManagedSession(**HotPath.client_options(GRAB_CONCURRENCY))
+            session.loads({"username": username, "password": password, "cookies": cookies})
+            cli = pysjtu.Client(session=session)
+            cli.student_id
+        except Exception as e:
+            log.info("沿用保存的会话失败，重新登录：%r", e)
+            return None
+        log.info("沿用了保存的登录会话")
+        return cli
+
+    def on_login(self, cli: pysjtu.Client):
+        self.logging_box.close()
+        self.cli = cli
+        log.info('登录成功！')
+        if HOT_PATH:
+            self.start_hot_path()
+        self.handle_selection()
+        # 不再弹出需要点击的登录成功提示，免得挡住选课窗口，学号显示在标题栏
+        self.selection_window.setWindowTitle(f"抢课助手 - {self.cli.student_id}")
+
+    def start_hot_path(self):
+        self.hot_path = HotPath(self.cli, pool_size=GRAB_CONCURRENCY)
+
+        def prepare(task: Task):
+            task.progress("正在预热连接...")
+            self.hot_path.prepare()
+
+        self.tasks.run(prepare, on_done=lambda _: self.hot_path.start_keepalive(), group="hot_path")
+
+    def on_login_failed(self, e: Exception):
+        self.logging_box.close()
+        if isinstance(e, LoginException):
+            log.warning('用户名或密码错误！')
+            QtWidgets.QMessageBox.warning(
+                self.selection_window,
+                "提示",
+                "用户名或密码错误！"
+            )
+        else:
+            log.error('登录失败：%r', e)
+        self.handle_login()
+
+    def fetch_sectors(self):
+        self.selection_window.set_status("正在加载分区...")
+        # 先用磁盘上的目录缓存填充界面，网络加载的分区到达后再校对
+        self.catalog = CatalogCache(self.cli.student_id)
+        self.tasks.run(lambda task: self.catalog.load(self.cli), on_done=self.on_catalog_loaded, group="catalog")
+        self.tasks.run(lambda task: self.load_sectors(),
+                       on_done=self.on_sectors_loaded, on_error=self.on_sectors_failed, group="sectors")
+
+    def on_catalog_loaded(self, catalog):
+        if catalog is None or self.sectors:
+            # 没有缓存，或网络上的分区已经先到了
+            return
+        log.info("从目录缓存恢复了 %d 个分区", len(catalog.sectors))
+        self.cached_classes = catalog.classes
+        self.show_sectors(catalog.sectors)
+
+    def show_sectors(self, sectors: List[SelectionSector]):
+        self.sectors = sectors
+        self.indexes.clear()
+        self.selection_window.clear_sectors()
+        # 程序填充分区列表不经过 change_sector，不会终止已有的抢课任务
+        self.selection_window.add_sectors([sector.name for sector in sectors])
+        if sectors:
+            self.load_sector(sectors[0])
+        self.restore_jobs()
+
+    def restore_jobs(self):
+        pending, self.pending_jobs = self.pending_jobs, dict()
+        if pending:
+            self.tasks.run(lambda task: self.resolve_jobs(pending), on_done=self.on_jobs_resolved, group="restore")
+
+    def resolve_jobs(self, pending: Dict[str, dict]) -> List[Tuple[List[SelectionClass], object, Optional[bool]]]:
+        """按任务日志找回候选班级和已选的同一门课的班级。优先用目录缓存，没有缓存的分区才请求班级列表"""
+        sectors = {sector.name: sector for sector in self.sectors}
+        loaded: Dict[str, Dict[str, SelectionClass]] = dict()
+        jobs = []
+        for key, entry in pending.items():
+            spec = entry["spec"]
+            sector = sectors.get(spec["sector"])
+            if sector is None:
+                log.warning("找不到任务 %s 的分区 %s，不再恢复", key, spec["sector"])
+                continue
+            if sector.name not in loaded:
+                index = self.indexes.get(sector.name)
+                classes = self.cached_classes.get(sector.name) or (index.classes if index else sector.classes)
+                loaded[sector.name] = {klass.class_id: klass for klass in classes}
+            candidates = [loaded[sector.name][class_id] for class_id in spec["class_ids"]
+                          if class_id in loaded[sector.name]]
+            if not candidates:
+                log.warning("任务 %s 的班级已不存在，不再恢复", key)
+                continue
+            log.info("恢复任务 %s（已尝试 %d 次）", key, entry["attempts"])
+            jobs.append((candidates, self.get_selected_class_of_same_course(candidates[0]), spec.get("upgrade")))
+        return jobs
+
+    def on_jobs_resolved(self, jobs: List[Tuple[List[SelectionClass], object, Optional[bool]]]):
+        for candidates, old_class, upgrade in jobs:
+            course_id = candidates[0].internal_course_id
+            self.candidates[course_id] = candidates
+            self.old_classes[course_id] = old_class
+            if upgrade is not None:
+                self.upgrades[course_id] = upgrade
+            for klass in candidates:
+                self.selection_window.restore_selected_item(klass)
+            self.submit_course(candidates[0])
+        self.selection_window.set_status(f"已恢复 {len(jobs)} 个未完成的抢课任务")
+
+    def load_sectors(self) -> List[SelectionSector]:
+        with METRICS.timer("sector_fetch_seconds"):
+            sectors = self.cli.course_selection_sectors
+        # 先于各分区的班级写入，save_classes 才能找到对应的分区
+        self.catalog.save_sectors(sectors)
+        return sectors
+
+    def on_sectors_loaded(self, sectors: List[SelectionSector]):
+        if self.sectors and self.same_sectors(self.sectors, sectors):
+            # 缓存仍然有效，继续用缓存的对象，只在后台刷新已选人数
+            if self.sector is not None and self.sector.name in self.indexes:
+                self.refresh_capacity(self.sector)
+        else:
+            if self.sectors:
+                log.info("选课轮次或分区已变化，丢弃目录缓存")
+            self.cached_classes = dict()
+            self.show_sectors(sectors)
+        # 提前把课表取进缓存，之后勾选课程时不必等待
+        self.refresh_schedule()
+
+    def refresh_schedule(self):
+        year, semester = selection_term(self.sector)
+        self.tasks.run(lambda task: self.scheduler.schedule_cache.get(year, semester),
+                       on_done=self.on_schedule_loaded, group="schedule")
+
+    def on_schedule_loaded(self, schedule: ScheduleIndex):
+        self.schedule = schedule
+        if self.hide_conflicts:
+            self.fetch_search_results()
+
+    def set_conflict_filter(self, checked: bool):
+        self.hide_conflicts = checked
+        if checked and self.schedule is None:
+            self.refresh_schedule()
+        self.fetch_search_results()
+
+    def on_sectors_failed(self, e: Exception):
+        if isinstance(e, SelectionNotAvailableException):
+            log.warning("对不起，当前不属于选课阶段。")
             QtWidgets.QMessageBox.warning(
                 self.selection_window,
                 "提示",
                 "对不起，当前不属于选课阶段。"
             )
             self.quit()
+            return
+        log.error("加载分区失败：%r", e)
+        self.selection_window.set_status("加载分区失败")
 
-    #def fetch_sectors(self):
-    #    sectors = [sector.name for sector in self.cli.course_selection_sectors]
-    #    self.selection_window.add_sectors(sectors)
-    #    self.sector = self.cli.course_selection_sectors[0]
-        
     @staticmethod
-    def meet_keyword(klass: SelectionClass, keyword: str) -> bool:
-        return keyword in klass.name or keyword in klass.class_name
+    def same_sectors(cached: List[SelectionSector], sectors: List[SelectionSector]) -> bool:
+        return (round_key(cached[0]) == round_key(sectors[0])
+                and [(s.name, s.xkkz_id) for s in cached] == [(s.name, s.xkkz_id) for s in sectors])
+
+    def load_index(self, task: Task, sector: SelectionSector) -> SectorIndex:
+        classes = self.cached_classes.get(sector.name)
+        if classes is None:
+            task.progress(f"正在加载 {sector.name} 的班级列表...")
+            with METRICS.timer("class_list_fetch_seconds", sector=sector.name):
+                classes = sector.classes
+            task.token.raise_if_cancelled()
+        task.progress(f"正在建立 {sector.name} 的索引...")
+        index = SectorIndex(classes, token=task.token)
+        if sector.name not in self.cached_classes:
+            # 建索引时懒加载字段都已取到，顺便写入目录缓存
+            self.catalog.save_classes(sector, classes)
+        return index
+
+    def on_index_loaded(self, sector: SelectionSector, index: SectorIndex):
+        self.indexes[sector.name] = index
+        self.selection_window.set_status(f"{sector.name}：共 {len(index.classes)} 个班级")
+        if self.cached_classes.pop(sector.name, None) is not None:
+            self.refresh_capacity(sector)
+        if self.sector is sector:
+            self.fetch_search_results()
+
+    def refresh_capacity(self, sector: SelectionSector):
+        """
+        缓存里的已选人数是上次保存时的，后台重新拉取班级列表只取回这一项，
+        回到 GUI 线程再写进索引里的班级对象，界面的模型也在读它们
+        """
+        def refresh(task: Task) -> Dict[str, int]:
+            with METRICS.timer("class_list_fetch_seconds", sector=sector.name):
+                classes = self.scheduler.request_blocking(fresh_classes, self.cli, sector)
+            return {klass.class_id: klass.students_registered for klass in classes}
+
+        def on_refreshed(fresh: Dict[str, int]):
+            index = self.indexes.get(sector.name)
+            if index is None:
+                # 刷新期间分区被重新加载了
+                return
+            for klass in index.classes:
+                klass.students_registered = fresh.get(klass.class_id, klass.students_registered)
+            # 有新开的班级时缓存已经过时
+            if fresh.keys() - {klass.class_id for klass in index.classes}:
+                log.info("%s 有新增的班级，重新加载", sector.name)
+                del self.indexes[sector.name]
+                if self.sector is sector:
+                    # 只重建索引，正在进行的抢课任务不受影响
+                    self.load_sector(sector)
+                return
+            if self.sector is sector:
+                self.selection_window.refresh_capacity()
+            classes = index.classes
+            self.tasks.run(lambda task: self.catalog.save_classes(sector, classes))
+
+        self.tasks.run(refresh, on_done=on_refreshed, group="capacity")
 
     def fetch_search_results(self):
-        if len(self.keyword) == 0:
-            results = self.sector.classes
-        else:
-            results = list(filter(lambda klass: self.meet_keyword(klass, self.keyword), self.sector.classes))
-        self.selection_window.set_search_results(results)
+        if self.sector is None:
+            return
+        index = self.indexes.get(self.sector.name)
+        if index is None:
+            # 索引还没加载好，加载完成后会自动刷新结果
+            return
+        schedule = self.schedule.timetable if self.hide_conflicts and self.schedule is not None else None
+        self.selection_window.set_search_results(index.search(self.keyword, schedule))
 
     def change_sector(self, sector: str):
-        self.sector = next(filter(lambda s: s.name == sector, self.cli.course_selection_sectors))
-        print(self.sector)
+        """用户在下拉框中切换分区"""
         self.clear_selection()
-        self.fetch_search_results()
+        self.load_sector(next(filter(lambda s: s.name == sector, self.sectors)))
+
+    def load_sector(self, sector: SelectionSector):
+        self.sector = sector
+        log.debug("切换到分区 %s", self.sector.name)
+        if self.sector.name in self.indexes:
+            self.tasks.cancel("index")
+            self.fetch_search_results()
+            return
+        self.selection_window.set_search_results([])
+        # 同一时间只保留当前分区的加载任务，快速切换时旧的加载会被取消
+        target = self.sector
+        self.tasks.run(lambda task: self.load_index(task, target),
+                       on_done=lambda index: self.on_index_loaded(target, index), group="index")
 
     def search(self, keyword: str):
-        print(keyword)
         self.keyword = keyword
         self.fetch_search_results()
         
@@ -110,144 +408,136 @@ class App:
         检查当前课表中是否已选同一课程的其他班级
         返回已选班级对象，否则返回 None
         """
-        # 获取当前学年和学期（请根据实际情况传参）
-        year = 2025
-        semester = 0
         try:
-            schedule = self.cli.schedule(year, semester)
+            return engine.selected_class_of_same_course(self.scheduler.schedule_cache, course)
         except Exception as e:
-            print("获取课表失败：", e)
+            log.warning("获取课表失败：%r", e)
             return None
-
-        for klass in schedule:
-            # pysjtu 的 schedule 返回的对象字段名可能和 SelectionClass 不完全一致，请根据实际字段名调整
-            if hasattr(klass, "name") and hasattr(klass, "class_id"):
-                if klass.name == course.name and klass.class_id != course.class_name:
-                    return klass
-        return None
     
-    class SwitchClassDaemon(QThread):
-        signal = pyqtSignal(SelectionClass)
-
-        def __init__(self, old_class: SelectionClass, new_class: SelectionClass, app_ref):
-            super().__init__()
-            self.old_class = old_class
-            self.new_class = new_class
-            self.app_ref = app_ref
-
-        def run(self):
-            while True:
-                time.sleep(1)
-                try:
-                    year = 2025
-                    semester = 0
-                    try:
-                        schedule = self.app_ref.cli.schedule(year, semester)
-                        # 判断是否还选着 old_class
-                        has_old = any(
-                            hasattr(k, "course_id") and hasattr(k, "class_id") and
-                            k.course_id == self.old_class.course_id and k.class_id == self.old_class.class_id
-                            for k in schedule
-                        )
-                        # sector.classes 里找 SelectionClass 实例
-                        old_class = next((k for k in self.app_ref.sector.classes
-                                          if k.class_id == self.old_class.class_id), self.old_class)
-                        new_class = next((k for k in self.app_ref.sector.classes
-                                          if k.class_id == self.new_class.class_id), self.new_class)
-                    except Exception as e:
-                        print("刷新课表失败：", e)
-                        old_class = self.old_class
-                        new_class = self.new_class
-                        has_old = True  # 保守处理
-
-                    if new_class.students_registered < new_class.students_planned:
-                        print(f"{new_class.name} {new_class.class_name} 有余量，尝试切换")
-                        # 只有还选着 old_class 时才退课
-                        if has_old:
-                            try:
-                                old_class.drop()
-                                print("退课成功")
-                            except Exception as e:
-                                print("退课失败", e)
-                                time.sleep(1)
-                                continue
-                            time.sleep(1)  # 退课后等一会再选新班级
-                        try:
-                            new_class.register()
-                            print("切换成功")
-                            break
-                        except Exception as e:
-                            print("切换失败，尝试恢复原班级", e)
-                            # 恢复原班级
-                            try:
-                                old_class.register()
-                                print("恢复原班级成功")
-                            except Exception as e2:
-                                print("恢复原班级失败", e2)
-                            time.sleep(1)
-                    else:
-                        print(f"{new_class.name} {new_class.class_name} 仍无余量，继续监听")
-                except Exception as e:
-                    print("监听或切换时异常", e)
-            self.signal.emit(self.new_class)
-        
-    class SelectDaemon(QThread):
-        signal = pyqtSignal(SelectionClass)
-
-        def __init__(self, course: SelectionClass):
-            self.course = course
-            super().__init__()
-
-        def run(self) -> None:
-            while not self.course.is_registered():
-                time.sleep(1)
-                try:
-                    print(f"Trying to register {self.course.name}...")
-                    self.course.register()  # or klass.drop()
-                    print("Succeed, quit")
-                    break
-                except FullCapacityException:
-                    print(f"Failed, retry to register {self.course.name}")
-                    pass  # retry
-                except Exception as e:
-                    print(e)  # or handle other exceptions
-            print(f"{self.course.name} 的抢课守护线程退出")
-            self.signal.emit(self.course)
-
-    #def on_select_course(self, course: SelectionClass):
-    #    daemon = App.SelectDaemon(course)
-    #    daemon.signal.connect(self.selection_window.finish_select)
-    #    self.daemon_map[course.name] = daemon
-    #    daemon.start()
+    def find_conflicts(self, course: SelectionClass) -> List[str]:
+        """与课表中其他课程时间冲突时返回这些课程名，课表取不到时不拦"""
+        try:
+            schedule = self.scheduler.schedule_cache.get(*selection_term(course.sector))
+        except Exception as e:
+            log.warning("获取课表失败：%r", e)
+            return []
+        conflicts = schedule.timetable.conflicts(timetable_of(course).mask, course.internal_course_id)
+        return [schedule.by_class_id[class_id].name for class_id in conflicts]
+
+    @staticmethod
+    def select_group(course: SelectionClass) -> str:
+        return f"select-{course.class_id}"
+
     def on_select_course(self, course: SelectionClass):
-        old_class = self.get_selected_class_of_same_course(course)
-        if old_class is None:
+        # 查课表可能要请求服务器，放到后台执行；查完之前取消勾选时 on_remove_course 会取消这个任务
+        self.tasks.run(lambda task: (self.get_selected_class_of_same_course(course), self.find_conflicts(course)),
+                       on_done=lambda result: self.start_grab(course, *result), group=self.select_group(course))
+
+    def start_grab(self, course: SelectionClass, old_class, conflicts: List[str] = ()):
+        if conflicts:
+            # 冲突的选课请求一定会被服务器拒绝，不提交任务
+            log.warning("%s 与已选的 %s 时间冲突", course.name, "、".join(conflicts))
+            self.selection_window.fail_select(course, f"与{'、'.join(conflicts)}时间冲突")
+            return
+        candidates = self.candidates.setdefault(course.internal_course_id, [])
+        if all(klass.class_id != course.class_id for klass in candidates):
+            candidates.append(course)
+        self.old_classes[course.internal_course_id] = old_class
+        self.submit_course(course)
+
+    @staticmethod
+    def course_key(course: SelectionClass) -> str:
+        return f"{course.name}-{course.internal_course_id}"
+
+    def submit_course(self, course: SelectionClass):
+        """同一门课只保留一个任务，候选班级变化时按新的候选替换旧任务，候选都去掉了就取消"""
+        key = self.course_key(course)
+        course_id = course.internal_course_id
+        candidates = self.candidates.get(course_id)
+        if not candidates:
+            self.upgrades.pop(course_id, None)
+            self.scheduler.cancel(key)
+            return
+        old_class = self.old_classes.get(course_id)
+        if len(candidates) > 1:
+            # 候选组：共用一次轮询，只向排名最高的有空位班级发请求
+            job = GroupJob(candidates, old_class, upgrade=self.upgrades.get(course_id, UPGRADE_GROUPS))
+        elif old_class is None:
             # 直接抢课
-            daemon = App.SelectDaemon(course)
-            daemon.signal.connect(self.selection_window.finish_select)
-            self.daemon_map[course.name] = daemon
-            daemon.start()
+            job = SelectJob(candidates[0])
         else:
-            # 切换班级守护线程
-            switch_daemon = App.SwitchClassDaemon(old_class, course, self)
-            switch_daemon.signal.connect(self.selection_window.finish_select)
-            key = f"{course.name}-{course.class_id}-switch"
-            self.daemon_map[key] = switch_daemon
-            switch_daemon.start()
+            # 切换班级
+            job = SwitchJob(old_class, candidates[0])
+        # 直接替换，不在任务日志里记一次取消，已尝试的次数接着算
+        self.scheduler.submit(key, job, replace=True)
+
+    def on_grab_finished(self, course: SelectionClass):
+        for klass in self.candidates.pop(course.internal_course_id, []):
+            if klass.class_id != course.class_id:
+                self.selection_window.fail_select(klass, "已选上同一门课的其他班级")
+        self.old_classes.pop(course.internal_course_id, None)
+        self.upgrades.pop(course.internal_course_id, None)
+        # 选上后课表变了，重新取课表供冲突过滤使用
+        self.refresh_schedule()
             
     def clear_selection(self):
-        #self.selection_window.clear_selection() #清空已选课程列表
-        #for course in self.daemon_map:     #终止抢课进程
-        #    self.daemon_map[course].quit()
-        pass
+        """用户切换分区时终止所有抢课任务、清空已选课程列表。程序重新加载分区或索引时不调用，以免丢掉恢复的任务"""
+        self.scheduler.cancel_all()
+        self.candidates.clear()
+        self.old_classes.clear()
+        self.upgrades.clear()
+        self.selection_window.clear_selection()
 
     def on_remove_course(self, course: SelectionClass):
-        key = f"{course.name}-{course.class_id}"
-        if key in self.daemon_map:
-            self.daemon_map[key].quit()
-            del self.daemon_map[key]
-        else:
-            print(f"未找到 key={key} 的抢课线程")
+        group = self.select_group(course)
+        if group in self.tasks.groups:
+            # 还在查课表、没提交任务：取消后 start_grab 不会再被调用
+            self.tasks.cancel(group)
+            return
+        candidates = self.candidates.get(course.internal_course_id)
+        if candidates is None:
+            log.warning("未找到 %s 的抢课任务", course.name)
+            return
+        candidates[:] = [klass for klass in candidates if klass.class_id != course.class_id]
+        if not candidates:
+            del self.candidates[course.internal_course_id]
+        self.submit_course(course)
+
+    def set_open_time(self, text: str):
+        text = text.strip()
+        if not text:
+            self.scheduler.burst = None
+            self.selection_window.set_status("未设置开放时间，勾选后立即抢课")
+            return
+        try:
+            open_at = datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            QtWidgets.QMessageBox.warning(self.selection_window, "提示", "开放时间格式应为 2025-06-20 12:00:00")
+            return
+
+        def sync(task: Task) -> ClockSync:
+            task.progress("正在校准服务器时间...")
+            return engine.sync_clock(self.cli)
+
+        def on_synced(clock: ClockSync):
+            self.scheduler.burst = BurstPlan.from_sync(open_at, clock)
+            self.selection_window.set_status(f"服务器时间偏差 {clock.offset * 1000:.0f}±{clock.error * 1000:.0f}ms，"
+                                             f"将在 {text} 集中抢课")
+
+        self.tasks.run(sync, on_done=on_synced, group="clock")
+
+    def show_stats(self):
+        if self.stats_panel is None:
+            self.stats_panel = StatsPanel(METRICS, self.selection_window)
+        self.stats_panel.show()
+        self.stats_panel.raise_()
+
+    def export_capacity(self):
+        path = f"capacity-{datetime.now():%Y%m%d-%H%M%S}.csv"
+        self.tasks.run(lambda task: self.scheduler.poller.recorder.export(path),
+                       on_done=lambda _: self.selection_window.set_status(f"余量记录已导出到 {path}"),
+                       on_error=lambda e: self.selection_window.set_status(f"导出余量记录失败：{e}"),
+                       group="export")
 
     def handle_selection(self):
         self.selection_window = CourseSelectionWindow()
@@ -255,10 +545,47 @@ class App:
         self.selection_window.add_search_handler(self.search)
         self.selection_window.set_on_select_course_handler(self.on_select_course)
         self.selection_window.set_on_remove_course_handler(self.on_remove_course)
+        self.selection_window.add_open_time_handler(self.set_open_time)
+        self.selection_window.add_stats_handler(self.show_stats)
+        self.selection_window.add_conflict_filter_handler(self.set_conflict_filter)
+        self.selection_window.add_export_handler(self.export_capacity)
+        self.selection_window.set_sparkline_handler(self.scheduler.poller.recorder.sparkline)
+        self.bridge.signal.connect(self.selection_window.finish_select)
+        self.bridge.signal.connect(self.on_grab_finished)
+        self.tasks.progress.connect(self.selection_window.set_status)
+        self.scheduler.cli = self.cli
+        # 会话失效时只重新登录一次，重新登录后保存新的 cookie，下次启动可以直接沿用
+        self.session_monitor = SessionMonitor(self.cli._session, max_age=SESSION_MAX_AGE, standby=STANDBY_SESSION,
+                                              on_renew=lambda: self.save_session(self.cli))
+        self.session_monitor.start()
+        self.scheduler.session = self.session_monitor
+        self.journal = JobJournal(journal_path(self.cli.student_id))
+        self.pending_jobs = self.journal.replay()
+        self.scheduler.journal = self.journal
+        self.scheduler.start()
         self.fetch_sectors()
         self.selection_window.show()
 
-    def run(self):
-        self.handle_login()
-        self.handle_selection()
-        sys.exit(self.app.exec_())
+    def run(self, credentials: Optional[Tuple[str, str]] = None):
+        """credentials 为 run.py 中已经在登录窗口输入好的用户名和密码"""
+        setup_logging(LOG_LEVEL)
+        self.exporter.start()
+        if credentials is None:
+            self.handle_login()
+        else:
+            self.start_login(*credentials)
+        code = self.app.exec_() if not self.quitting else 0
+        self.shutdown()
+        sys.exit(code)
+
+    def shutdown(self):
+        """所有退出路径都经过这里：等后台任务、正在换班的任务收尾，写完任务日志和指标"""
+        self.tasks.shutdown(SHUTDOWN_TIMEOUT)
+        if self.hot_path is not None:
+            self.hot_path.stop()
+        self.scheduler.shutdown(SHUTDOWN_TIMEOUT)
+        if self.session_monitor is not None:
+            self.session_monitor.stop()
+        if self.journal is not None:
+            self.journal.close()
+        self.exporter.stop()
@@ -0,0 +1,444 @@
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from types import SimpleNamespace
+from typing import List, Optional
+
+import pysjtu
+from pysjtu import consts
+
+from burst import BurstPlan, ClockSync
+from fake_server import FakeSelectionServer, create_client, _path
+from hotpath import HotPath
+from logs import setup_logging
+from metrics import METRICS
+from ratelimit import AdaptiveInterval
+from scheduler import GrabScheduler, SelectJob, SwitchJob
+from search import SectorIndex
+from session_monitor import ManagedSession, SessionMonitor
+
+COURSE_NAMES = ["高等数学", "线性代数", "大学英语", "大学物理", "程序设计", "数据结构", "概率统计", "中国近现代史纲要",
+                "体育", "思想道德与法治", "大学化学", "工程制图"]
+TEACHERS = ["张老师", "王老师", "李老师", "赵老师", "陈老师", "刘老师"]
+
+
+def percentiles(samples: List[float]) -> str:
+    if not samples:
+        return "n=0"
+    if len(samples) == 1:
+        return f"n=1 {samples[0] * 1000:.1f}ms"
+    cuts = quantiles(samples, n=100)
+    return f"n={len(samples)} p50={cuts[49] * 1000:.1f}ms p99={cuts[98] * 1000:.1f}ms"
+
+
+def metric_total(name: str, **labels) -> float:
+    """METRICS 中计数器 name 在带有 labels 的所有标签组合上的总和"""
+    wanted = {(k, str(v)) for k, v in labels.items()}
+    return sum(value for (metric, metric_labels), value in METRICS.counters.items()
+               if metric == name and wanted <= set(metric_labels))
+
+
+def register_burst(cli: pysjtu.Client, jobs: int) -> List[float]:
+    """jobs 个任务同时各选一个班级，返回每次 register 的耗时"""
+    def register(i: int) -> float:
+        klass = SimpleNamespace(register_id=f"class-{i}", internal_course_id=f"kcourse-{i}")
+        start = time.perf_counter()
+        cli._class_register(klass)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(register, range(jobs)))
+
+
+def bench_hotpath(jobs: int, connect_delay: float, latency: float):
+    """对比冷启动的客户端和预热过连接池的客户端在开放瞬间的选课耗时"""
+    for mode in ("cold", "hot"):
+        server = FakeSelectionServer(connect_delay=connect_delay, latency=latency).start()
+        for i in range(jobs):
+            server.add_class(f"class-{i}", planned=1, course_id=f"course-{i}")
+        if mode == "cold":
+            cli = create_client(server)
+        else:
+            cli = create_client(server, **HotPath.client_options(jobs))
+            hot_path = HotPath(cli, pool_size=jobs)
+            hot_path.prepare()
+        cli.student_id  # 学号请求不计入
+        connections = server.connections
+        path = _path(consts.SELECTION_REGISTER)
+        reused = metric_total("http_requests_total", path=path, connection="reused")
+        samples = register_burst(cli, jobs)
+        print(f"[hotpath] {mode:4} jobs={jobs} {percentiles(samples)} "
+              f"new_connections={server.connections - connections}")
+        if mode == "hot":
+            # 只有装了 HotPath 钩子的客户端才有这些指标
+            reused = metric_total("http_requests_total", path=path, connection="reused") - reused
+            dns = next(row for row in METRICS.summary() if row["name"] == "dns_resolve_seconds")
+            print(f"[hotpath] hot  dns_resolve={dns['p50'] * 1000:.1f}ms reused_connections={reused:.0f}/{jobs}")
+        server.stop()
+
+
+def bench_burst(jobs: int, latency: float, lead: Optional[float], budget: float):
+    """服务器时钟有随机偏差，测量开放后第一条选课请求到达服务器的延迟"""
+    clock_offset = random.uniform(-3, 3)
+    server = FakeSelectionServer(latency=latency, clock_offset=clock_offset).start()
+    cli = create_client(server)
+    hot_path = HotPath(cli, pool_size=jobs)
+    hot_path.prepare()
+
+    sync = ClockSync(lambda: cli._session._client.head("/").headers["Date"])
+    start = time.perf_counter()
+    offset = sync.sync()
+    print(f"[burst] clock offset real={clock_offset * 1000:.1f}ms estimated={offset * 1000:.1f}ms "
+          f"±{sync.error * 1000:.1f}ms samples={sync.samples} took={time.perf_counter() - start:.1f}s")
+
+    server.open_at = server.now() + 2
+    finished = []
+    scheduler = GrabScheduler(concurrency=jobs, on_finish=finished.append, request_budget=budget)
+    scheduler.cli = cli
+    scheduler.burst = BurstPlan.from_sync(server.open_at, sync)
+    if lead is not None:
+        scheduler.burst.lead = lead
+    scheduler.start()
+    for i in range(jobs):
+        server.add_class(f"class-{i}", planned=1, course_id=f"course-{i}")
+        # 没有分区和上课时间：不写任务日志，冲突检查按不冲突处理
+        course = SimpleNamespace(name=f"class-{i}", class_id=f"class-{i}", register_id=f"class-{i}",
+                                 internal_course_id=f"kcourse-{i}", sector=None, time=None)
+        course.register = lambda c=course: cli._class_register(c)
+        scheduler.submit(course.name, SelectJob(course))
+    while len(finished) < jobs and server.now() < server.open_at + 10:
+        time.sleep(0.05)
+    scheduler.shutdown()
+    server.stop()
+
+    log = server.register_log
+    early = [t for t, _, _ in log if t < server.open_at]
+    late = [t for t, _, _ in log if t >= server.open_at]
+    seats = dict()
+    for t, register_id, flag in log:
+        if flag == "1":
+            seats.setdefault(register_id, t)
+    seated = list(seats.values())
+    print(f"[burst] jobs={jobs} lead={scheduler.burst.lead * 1000:.0f}ms requests={len(log)} early={len(early)} "
+          f"seated={len(seated)}/{jobs}")
+    if late:
+        print(f"[burst] first request after open: +{(min(late) - server.open_at) * 1000:.1f}ms, "
+              f"last seat: +{(max(seated) - server.open_at) * 1000:.1f}ms")
+
+
+def bench_switch(jobs: int, latency: float, budget: float, duration: float, poll: float, drop_rate: float,
+                 reaction: float):
+    """
+    jobs 个换班任务，原班级和新班级都满员，其他同学按 drop_rate 退课、reaction 秒内抢走空位。
+    统计换班成功率和每次切换中两个班级都没选上的空窗
+    """
+    server = FakeSelectionServer(latency=latency).start()
+    pairs = []
+    for i in range(jobs):
+        course_id = f"course-{i}"
+        server.add_class(f"old-{i}", planned=30, registered=30, course_id=course_id, weekday=1)
+        server.add_class(f"new-{i}", planned=30, registered=30, course_id=course_id, weekday=3)
+        server.enroll(f"old-{i}")
+        pairs.append((f"old-{i}", f"new-{i}"))
+    server.compete([class_id for pair in pairs for class_id in pair], drop_rate, reaction)
+
+    cli = create_client(server, **HotPath.client_options(jobs))
+    HotPath(cli, pool_size=jobs).prepare()
+    classes = {klass.class_id: klass for sector in cli.course_selection_sectors for klass in sector.classes}
+
+    finished = []
+    scheduler = GrabScheduler(concurrency=jobs, on_finish=finished.append, poll_interval=poll,
+                              request_budget=budget)
+    scheduler.cli = cli
+    scheduler.start()
+    for old, new in pairs:
+        job = SwitchJob(classes[old], classes[new])
+        job.pacing = AdaptiveInterval(fast=poll, base=poll, slow=poll)
+        scheduler.submit(new, job)
+    deadline = time.monotonic() + duration
+    while len(finished) < jobs and time.monotonic() < deadline:
+        time.sleep(0.05)
+    scheduler.shutdown()
+    server.stop()
+
+    drops = len(server.drop_log)
+    switched = sum(new in server.registered for _, new in pairs)
+    lost = sum(old not in server.registered and new not in server.registered for old, new in pairs)
+    print(f"[switch] jobs={jobs} drop_rate={drop_rate}/s reaction={reaction * 1000:.0f}ms "
+          f"switched={switched}/{jobs} attempts={drops} "
+          f"success_rate={switched / drops if drops else 0:.0%} lost_both={lost}")
+    print(f"[switch] seat-less gap {percentiles(list(scheduler.switch_gaps))}")
+
+
+def watch_gui_thread(done, deadline: float, tick: float = 0.01) -> List[float]:
+    """
+    在主线程模拟 GUI 事件循环：每 tick 秒醒来一次，记录实际醒来比预期晚了多少，
+    即后台线程抢 GIL 造成的界面卡顿
+    """
+    stalls = []
+    while not done() and time.monotonic() < deadline:
+        start = time.perf_counter()
+        time.sleep(tick)
+        stalls.append(max(0.0, time.perf_counter() - start - tick))
+    return stalls
+
+
+def bench_e2e(levels: List[int], latency: float, budget: float, duration: float, poll: float, drop_rate: float,
+              reaction: float, error_rate: float):
+    """
+    端到端：jobs 个满员班级，其他同学按 drop_rate 退课、reaction 秒内抢走空位，服务器按 error_rate 返回 503。
+    统计抢到座位的耗时、每个座位花费的请求数、选课请求耗时、GUI 线程卡顿和内存峰值
+    """
+    for jobs in levels:
+        server = FakeSelectionServer(latency=latency).start()
+        for i in range(jobs):
+            server.add_class(f"class-{i}", planned=30, registered=30, course_id=f"course-{i}")
+        server.compete(list(server.classes), drop_rate, reaction)
+        concurrency = min(jobs, 8)
+        cli = create_client(server, **HotPath.client_options(concurrency))
+        hot_path = HotPath(cli, pool_size=concurrency)
+        hot_path.prepare()
+        courses = [klass for sector in cli.course_selection_sectors for klass in sector.classes]
+
+        # 登录、拉取班级列表等准备步骤不注入错误
+        server.error_rate = error_rate
+        tracemalloc.start()
+        requests = server.requests
+        seated = []
+        start = time.perf_counter()
+        scheduler = GrabScheduler(concurrency=concurrency, on_finish=lambda _: seated.append(time.perf_counter() - start),
+                                  poll_interval=poll, request_budget=budget)
+        scheduler.cli = cli
+        scheduler.start()
+        for course in courses:
+            job = SelectJob(course)
+            job.pacing = AdaptiveInterval(fast=poll, base=poll, slow=poll)
+            scheduler.submit(course.class_id, job)
+        stalls = watch_gui_thread(lambda: len(seated) >= jobs, time.monotonic() + duration)
+        scheduler.shutdown()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        requests = server.requests - requests
+        server.stop()
+
+        register = list(hot_path.latencies.get(_path(consts.SELECTION_REGISTER), []))
+        print(f"[e2e] jobs={jobs} seated={len(seated)}/{jobs} requests={requests} errors={server.errors} "
+              f"requests/seat={requests / len(seated) if seated else float('inf'):.1f} "
+              f"peak_memory={peak / 2 ** 20:.1f}MiB")
+        print(f"[e2e]   time-to-seat {percentiles(seated)}")
+        print(f"[e2e]   register latency {percentiles(register)}")
+        print(f"[e2e]   gui stall {percentiles(stalls)} max={max(stalls, default=0) * 1000:.1f}ms")
+
+
+def bench_search(classes: int, latency: float):
+    """搜索路径：拉取 classes 个班级、建立索引，以及模拟逐字输入时每次按键的搜索耗时"""
+    server = FakeSelectionServer(latency=latency).start()
+    for i in range(classes):
+        # 每门课 5 个班级
+        course = i // 5
+        server.add_class(f"class-{i}", planned=30, registered=random.randint(0, 30),
+                         name=f"{COURSE_NAMES[course % len(COURSE_NAMES)]}{course // len(COURSE_NAMES) or ''}",
+                         course_id=f"course-{course}", teacher=random.choice(TEACHERS),
+                         weekday=random.randint(0, 6), periods=random.choice([(1, 2), (3, 4), (5, 6), (7, 8)]))
+    cli = create_client(server, **HotPath.client_options(8))
+    sector = cli.course_selection_sectors[0]
+
+    start = time.perf_counter()
+    courses = sector.classes
+    fetched = time.perf_counter()
+    index = SectorIndex(courses)
+    built = time.perf_counter()
+    server.stop()
+    # 建索引时会访问班级的懒加载字段（时间、教师），每门课一个请求
+    print(f"[search] classes={classes} fetch={(fetched - start) * 1000:.0f}ms "
+          f"index={(built - fetched) * 1000:.0f}ms requests={server.requests}")
+
+    samples = []
+    for query in ("高等数学", "数据结构 周三", "张老师 第3节", "星期五 体育", "思想道德与法治"):
+        for n in range(1, len(query) + 1):
+            begin = time.perf_counter()
+            index.search(query[:n])
+            samples.append(time.perf_counter() - begin)
+    print(f"[search] keystroke {percentiles(samples)}")
+
+
+# 在子进程中按 run.py 的流程启动，输出各阶段相对进程启动的时刻。
+# 登录换成直连本地模拟服务（模拟服务没有 jaccount），其余与实际启动相同
+STARTUP_PROBE = """
+import sys, time
+launched, url, typing, mode = float(sys.argv[1]), sys.argv[2], float(sys.argv[3]), sys.argv[4]
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import QTimer
+import run
+if mode == "legacy":
+    # 原来的启动方式：先导入全部模块，再显示登录窗口
+    import app
+qt = QtWidgets.QApplication(sys.argv[:1])
+loader = run.start_preload()
+dialog = run.LoginDialog()
+dialog.username_combo.setEditText("student")
+dialog.password_input.setText("password")
+def shown():
+    print("first_window", time.time() - launched, flush=True)
+    # 模拟输入账号密码的时间
+    QTimer.singleShot(int(typing * 1000), dialog.accept)
+QTimer.singleShot(0, shown)
+dialog.exec_()
+accepted = time.time()
+loader.join()
+import app, pysjtu
+app.App.login = staticmethod(lambda username, password: pysjtu.Client(pysjtu.Session(
+    base_url=url, **app.HotPath.client_options(app.GRAB_CONCURRENCY))))
+instance = app.App()
+def poll():
+    if instance.sector is not None and instance.sector.name in instance.indexes:
+        print("ready_after_login", time.time() - accepted, flush=True)
+        instance.app.quit()
+timer = QTimer()
+timer.timeout.connect(poll)
+timer.start(2)
+instance.run(dialog.get_username_password())
+"""
+
+
+def bench_session(jobs: int, latency: float, budget: float, poll: float, login_time: float):
+    """
+    会话在抢课中途失效：对比 pysjtu 自带的续期（每个发现过期的线程各自登录）和 SessionMonitor
+    （只登录一次 / 换上备用会话）。失效的同时放出一个空位，记录多久选上、登录了几次、浪费了多少请求
+    """
+    for mode in ("pysjtu", "monitor", "standby"):
+        server = FakeSelectionServer(latency=latency).start()
+        for i in range(jobs):
+            server.add_class(f"class-{i}", planned=30, registered=30, course_id=f"course-{i}")
+
+        def login() -> pysjtu.Session:
+            time.sleep(login_time)  # jAccount 登录和识别验证码
+            fresh = pysjtu.Session(base_url=server.url)
+            fresh.get(consts.HOME_URL, validate_session=False)
+            return fresh
+
+        class InlineSession(pysjtu.Session):
+            def login(self, username: str, password: str):
+                self._client.cookies = login()._client.cookies
+
+        options = HotPath.client_options(jobs)
+        if mode == "pysjtu":
+            session = InlineSession(base_url=server.url, **options)
+            session._username, session._password = "user", "password"
+        else:
+            session = ManagedSession(base_url=server.url, **options)
+        cli = pysjtu.Client(session)
+        classes = cli.course_selection_sectors[0].classes
+        monitor = None
+        if mode != "pysjtu":
+            monitor = SessionMonitor(session, login_func=login, standby=mode == "standby")
+            monitor.check()
+        scheduler = GrabScheduler(concurrency=jobs, request_budget=budget, poll_interval=poll)
+        scheduler.cli, scheduler.session = cli, monitor
+        scheduler.start()
+        for klass in classes:
+            scheduler.submit(klass.class_id, SelectJob(klass))
+        time.sleep(poll * 5)
+        logins, requests = server.logins, server.requests
+        server.expire_sessions([session._client.cookies["JSESSIONID"]])
+        expired = server.now()
+        server.classes["class-0"].registered = 29
+        while not server.registered and server.now() - expired < login_time * jobs + 5:
+            time.sleep(0.01)
+        seated = server.register_log[-1][0] - expired if server.registered else float("nan")
+        print(f"[session] {mode:7} jobs={jobs} seated_after={seated * 1000:.0f}ms "
+              f"logins={server.logins - logins} requests={server.requests - requests}")
+        scheduler.shutdown()
+        if monitor is not None:
+            monitor.stop()
+        server.stop()
+
+
+def bench_startup(runs: int, classes: int, latency: float, typing: float):
+    """
+    启动路径：进程启动到登录窗口出现（first_window），以及点击登录到当前分区可以搜索、勾选（ready_after_login）。
+    legacy 为先导入全部模块的旧流程；fast 在输入账号密码时后台导入；fast+catalog 另外已有目录缓存
+    """
+    server = FakeSelectionServer(latency=latency).start()
+    for i in range(classes):
+        course = i // 5
+        server.add_class(f"class-{i}", planned=30, registered=random.randint(0, 30),
+                         name=f"{COURSE_NAMES[course % len(COURSE_NAMES)]}{course // len(COURSE_NAMES) or ''}",
+                         course_id=f"course-{course}", teacher=random.choice(TEACHERS))
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen",
+               PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                        os.environ.get("PYTHONPATH")])))
+    for mode in ("legacy", "fast", "fast+catalog"):
+        samples = {"first_window": [], "ready_after_login": []}
+        with tempfile.TemporaryDirectory() as workdir:
+            # 目录缓存、账号、指标文件都写在临时目录里
+            if mode == "fast+catalog":
+                subprocess.run([sys.executable, "-c", STARTUP_PROBE, str(time.time()), server.url, "0", "fast"],
+                               cwd=workdir, env=env, capture_output=True, check=True)
+            for _ in range(runs):
+                result = subprocess.run([sys.executable, "-c", STARTUP_PROBE, str(time.time()), server.url,
+                                         str(typing), mode.split("+")[0]],
+                                        cwd=workdir, env=env, capture_output=True, text=True, timeout=120)
+                for line in result.stdout.splitlines():
+                    name, _, value = line.partition(" ")
+                    if name in samples:
+                        samples[name].append(float(value))
+                if not any(line.startswith("ready_after_login") for line in result.stdout.splitlines()):
+                    print(result.stderr[-2000:])
+                if mode != "fast+catalog":
+                    # 每次都从没有目录缓存开始
+                    shutil.rmtree(os.path.join(workdir, "catalog"), ignore_errors=True)
+        print(f"[startup] {mode:<12} first_window {percentiles(samples['first_window'])}  "
+              f"ready_after_login {percentiles(samples['ready_after_login'])}")
+    server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于本地模拟选课服务的基准测试")
+    parser.add_argument("suite", choices=["hotpath", "burst", "switch", "e2e", "search", "startup", "session"])
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--connect-delay", type=float, default=0.05, help="模拟的建连耗时（秒）")
+    parser.add_argument("--latency", type=float, default=0.005, help="模拟的服务端处理耗时（秒）")
+    parser.add_argument("--budget", type=float, default=100, help="每秒请求预算")
+    parser.add_argument("--lead", type=float, help="集中抢课提前量（秒），默认取校准时间时测得的单程耗时")
+    parser.add_argument("--duration", type=float, default=20, help="换班测试的最长时长（秒）")
+    parser.add_argument("--poll", type=float, default=0.2, help="换班测试的余量轮询间隔（秒）")
+    parser.add_argument("--drop-rate", type=float, default=0.5, help="每个班级其他同学每秒退课人数")
+    parser.add_argument("--reaction", type=float, default=0.3, help="空位被其他同学抢走的平均耗时（秒）")
+    parser.add_argument("--levels", default="1,10,50,100", help="端到端测试的并发任务数，逗号分隔")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="服务器返回 503 的概率")
+    parser.add_argument("--classes", type=int, default=3000, help="搜索测试的班级数")
+    parser.add_argument("--runs", type=int, default=5, help="启动测试每种方式的次数")
+    parser.add_argument("--typing", type=float, default=1, help="启动测试中模拟输入账号密码的时间（秒）")
+    parser.add_argument("--login-time", type=float, default=1.5, help="会话测试中模拟的一次登录耗时（秒）")
+    parser.add_argument("--verbose", action="store_true", help="显示抢课任务的日志")
+    args = parser.parse_args()
+    setup_logging("INFO" if args.verbose else "WARNING")
+    if args.suite == "hotpath":
+        bench_hotpath(args.jobs, args.connect_delay, args.latency)
+    elif args.suite == "burst":
+        bench_burst(args.jobs, args.latency, args.lead, args.budget)
+    elif args.suite == "switch":
+        bench_switch(args.jobs, args.latency, args.budget, args.duration, args.poll, args.drop_rate,
+                     args.reaction)
+    elif args.suite == "e2e":
+        bench_e2e([int(level) for level in args.levels.split(",")], args.latency, args.budget, args.duration,
+                  args.poll, args.drop_rate, args.reaction, args.error_rate)
+    elif args.suite == "search":
+        bench_search(args.classes, args.latency)
+    elif args.suite == "startup":
+        bench_startup(args.runs, args.classes, args.latency, args.typing)
+    elif args.suite == "session":
+        bench_session(args.jobs, args.latency, args.budget, args.poll, args.login_time)
+
+
+if __name__ == '__main__':
+    main()
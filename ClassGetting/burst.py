@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Callable, Tuple
+
+from pysjtu.exceptions import FullCapacityException, RegistrationException, SelectionNotAvailableException
+
+from ratelimit import TokenBucket
+
+log = logging.getLogger(__name__)
+
+
+class ClockSync:
+    """
+    根据响应头里的 Date 估计服务器时钟与本机的偏差 offset = 服务器时间 - 本机时间。
+    假定服务器在请求往返的中点生成 Date；集中抢课时按同样的假定估计请求到达服务器的时刻，两处的偏差互相抵消。
+    Date 只精确到秒，所以把探测请求安排在预计的整秒跳变附近，每次探测把偏差区间缩小一半，
+    剩下的区间半宽 error 就是 Date 取整带来的误差
+    """
+
+    def __init__(self, probe: Callable[[], str]):
+        # probe 发出一个轻量请求并返回响应头中的 Date
+        self.probe = probe
+        self.low = -math.inf
+        self.high = math.inf
+        self.samples = 0
+        # 探测请求的最短往返耗时
+        self.rtt = math.inf
+
+    @property
+    def offset(self) -> float:
+        return (self.low + self.high) / 2
+
+    @property
+    def error(self) -> float:
+        return (self.high - self.low) / 2
+
+    def sample(self) -> Tuple[float, float]:
+        sent = time.time()
+        server = parsedate_to_datetime(self.probe()).timestamp()
+        received = time.time()
+        self.rtt = min(self.rtt, received - sent)
+        # Date 是截断到秒的：往返中点时服务器的真实时间落在 [server, server + 1)
+        middle = (sent + received) / 2
+        low, high = server - middle, server + 1 - middle
+        if max(self.low, low) > min(self.high, high):
+            # 网络抖动让前后两次探测互相矛盾，以最新一次为准
+            self.low, self.high = low, high
+        else:
+            self.low, self.high = max(self.low, low), min(self.high, high)
+        self.samples += 1
+        return self.low, self.high
+
+    def sync(self, precision: float = 0.01, max_samples: int = 12) -> float:
+        self.sample()
+        while self.error > precision and self.samples < max_samples:
+            # 让下一次探测的往返中点正好落在按当前估计的下一个整秒跳变处
+            guess = self.offset
+            boundary = math.floor(time.time() + guess) + 1
+            delay = boundary - guess - self.rtt / 2 - time.time()
+            if delay < 0.05:
+                delay += 1
+            time.sleep(delay)
+            self.sample()
+        return self.offset
+
+
+@dataclass
+class BurstPlan:
+    """
+    选课开放时刻的集中抢课计划。第一个请求预计在开放后 error 秒内到达服务器，宁晚勿早：
+    开放前到达的请求只会被拒绝
+
+    :param open_at: 开放时刻（服务器时钟的 Unix 时间戳）
+    :param clock_offset: 服务器时钟与本机的偏差及其误差，见 ClockSync
+    :param lead: 提前多少秒发出请求，抵消请求到达服务器的单程耗时
+    :param count: 集中发送的请求数
+    :param spacing: 集中发送时两次请求的间隔
+    :param backoff: 集中发送结束后的首次重试间隔，之后按 factor 指数增长到 max_backoff
+    """
+    open_at: float
+    clock_offset: float = 0
+    error: float = 0
+    lead: float = 0
+    count: int = 10
+    spacing: float = 0.05
+    backoff: float = 0.2
+    factor: float = 2
+    max_backoff: float = 5
+
+    @classmethod
+    def from_sync(cls, open_at: float, sync: ClockSync, **kwargs) -> "BurstPlan":
+        """按校准结果制定计划：单程耗时取最短往返的一半"""
+        return cls(open_at, clock_offset=sync.offset, error=sync.error, lead=sync.rtt / 2, **kwargs)
+
+    def local_open_at(self) -> float:
+        return self.open_at - self.clock_offset
+
+    def first_send_at(self) -> float:
+        """第一个请求的发出时刻（本机时钟），按偏差的误差往后推，保证不早于开放时刻到达"""
+        return self.local_open_at() - self.lead + self.error
+
+
+async def sleep_until(local_time: float):
+    delay = local_time - time.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def fire_burst(scheduler, register: Callable[[], None], plan: BurstPlan, job=None) -> bool:
+    """
+    空闲等待到 first_send_at，然后以 spacing 的间隔集中发出 count 次 register，
+    全部落空后按指数退避继续尝试，直到间隔达到 max_backoff。选上返回 True。
+    这些请求用计划自己的预算，不和其他请求共用账号的限流器，否则几个任务的集中请求会在开放时刻排队、被摊开
+    """
+    budget = TokenBucket(1 / plan.spacing, capacity=plan.count)
+    await sleep_until(plan.first_send_at())
+
+    succeeded = asyncio.Event()
+
+    async def attempt() -> bool:
+        try:
+            await scheduler.measured("register_seconds", job, register, limiter=budget)
+        except (FullCapacityException, SelectionNotAvailableException, RegistrationException):
+            return False
+        except Exception as e:
+            log.warning("集中抢课请求失败：%r", e)
+            return False
+        succeeded.set()
+        return True
+
+    attempts = []
+    for _ in range(plan.count):
+        if succeeded.is_set():
+            break
+        attempts.append(asyncio.ensure_future(attempt()))
+        await asyncio.sleep(plan.spacing)
+    if any(await asyncio.gather(*attempts)):
+        return True
+
+    delay = plan.backoff
+    while delay <= plan.max_backoff:
+        await asyncio.sleep(delay)
+        if await attempt():
+            return True
+        delay *= plan.factor
+    return False
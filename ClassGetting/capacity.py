@@ -0,0 +1,132 @@
+import csv
+import time
+from array import array
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, List, Optional, Tuple
+
+# 每个班级保留的观测条数，按 1 秒一次轮询约 17 分钟
+HISTORY_SIZE = 1024
+# 计算退课频率的时间窗口（秒），以及至少要观测多久才给出频率
+DROP_WINDOW = 600
+MIN_SPAN = 30
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+class CapacityHistory:
+    """
+    一个班级的余量观测，定长环形缓冲区：时间存相对于记录器启动的秒数（float32），
+    已选人数和容量各存 uint16，每条观测 8 字节，写满后覆盖最旧的。
+    退课（已选人数减少）另外按 (时间, 人数) 记一份，算频率时不用扫描整个缓冲区
+    """
+    __slots__ = ("times", "registered", "planned", "start", "size", "first", "drops")
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.times = array("f", bytes(4 * size))
+        self.registered = array("H", bytes(2 * size))
+        self.planned = array("H", bytes(2 * size))
+        self.start = 0
+        self.size = 0
+        # 第一条观测的时间，以及最近的退课
+        self.first: Optional[float] = None
+        self.drops: Deque[Tuple[float, int]] = deque(maxlen=size)
+
+    def append(self, t: float, registered: int, planned: int):
+        capacity = len(self.times)
+        if self.size:
+            last = self.registered[(self.start + self.size - 1) % capacity]
+            if registered < last:
+                self.drops.append((t, last - registered))
+        else:
+            self.first = t
+        i = (self.start + self.size) % capacity
+        self.times[i] = t
+        self.registered[i] = min(registered, 0xFFFF)
+        self.planned[i] = min(planned, 0xFFFF)
+        if self.size < capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % capacity
+
+    def samples(self, since: float = float("-inf")) -> List[Tuple[float, int, int]]:
+        """按时间顺序返回 since 之后的 (时间, 已选人数, 容量)"""
+        capacity = len(self.times)
+        result = []
+        for k in range(self.size):
+            i = (self.start + k) % capacity
+            if self.times[i] >= since:
+                result.append((self.times[i], self.registered[i], self.planned[i]))
+        return result
+
+
+class CapacityRecorder:
+    """
+    记录轮询看到的每一次余量观测，按班级保存在环形缓冲区里。
+    由此算出各班级的退课频率（已选人数每减少 1 算一次退课），用来调整轮询间隔，
+    也提供余量走势的迷你图和导出
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.size = size
+        # 记录器启动时的墙上时间和单调时钟，缓冲区里存的是相对启动的秒数
+        self.epoch = time.time()
+        self.origin = time.monotonic()
+        self.histories: Dict[str, CapacityHistory] = dict()
+        self._lock = Lock()
+
+    def now(self) -> float:
+        return time.monotonic() - self.origin
+
+    def record(self, class_id: str, registered: int, planned: int, t: Optional[float] = None):
+        with self._lock:
+            history = self.histories.get(class_id)
+            if history is None:
+                history = self.histories[class_id] = CapacityHistory(self.size)
+            history.append(self.now() if t is None else t, registered, planned)
+
+    def samples(self, class_id: str, since: float = float("-inf")) -> List[Tuple[float, int, int]]:
+        with self._lock:
+            history = self.histories.get(class_id)
+            return history.samples(since) if history is not None else []
+
+    def drop_rate(self, class_id: str, window: float = DROP_WINDOW) -> Optional[float]:
+        """最近 window 秒内每秒的退课次数；观测不足 MIN_SPAN 秒时返回 None"""
+        now = self.now()
+        with self._lock:
+            history = self.histories.get(class_id)
+            if history is None or history.first is None:
+                return None
+            span = now - max(history.first, now - window)
+            if span < MIN_SPAN:
+                return None
+            drops = 0
+            for t, n in reversed(history.drops):
+                if t < now - window:
+                    break
+                drops += n
+        return drops / span
+
+    def sparkline(self, class_id: str, width: int = 16) -> str:
+        """
+        最近的余量走势，每个字符取一段观测中余量最多的一次：满员为最低的 ▁，
+        有余量时至少 ▂，按记录中出现过的最大余量缩放
+        """
+        samples = self.samples(class_id)
+        if not samples:
+            return ""
+        step = max(1, -(-len(samples) // width))
+        free = [max(max(0, p - r) for _, r, p in samples[k:k + step]) for k in range(0, len(samples), step)]
+        top = max(free) or 1
+        levels = len(SPARK_CHARS) - 1
+        return "".join(SPARK_CHARS[max(1, round(n * levels / top)) if n else 0] for n in free)
+
+    def export(self, path: str):
+        """写出 CSV：class_id, 时间戳（秒）, 已选人数, 容量"""
+        with self._lock:
+            rows = [(class_id, history.samples()) for class_id, history in self.histories.items()]
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["class_id", "timestamp", "students_registered", "students_planned"])
+            for class_id, samples in rows:
+                for t, registered, planned in samples:
+                    writer.writerow([class_id, f"{self.epoch + t:.3f}", registered, planned])
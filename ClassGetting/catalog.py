@@ -0,0 +1,165 @@
+import gzip
+import json
+import logging
+import os
+from functools import partial
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import pysjtu
+from pysjtu.models import SelectionClass, SelectionSector, SelectionSharedInfo
+from pysjtu.models.selection import LessonTime
+
+log = logging.getLogger(__name__)
+
+# 缓存格式变化时加一，旧文件会被忽略
+CATALOG_VERSION = 2
+CATALOG_DIR = "catalog"
+# 一个选课轮次内不会变化的班级字段，按这个顺序存成一行。
+# 选课、退课用的 register_id 是服务器动态生成的，不缓存，第一次用到时由懒加载取回
+STATIC_FIELDS = ("name", "credit", "course_id", "internal_course_id", "class_name", "class_id",
+                 "teachers", "locations", "time", "course_type", "remark", "students_planned")
+# 易变字段跟在静态字段后面，保存的是上次看到的值，启动后由后台刷新
+VOLATILE_FIELDS = ("students_registered",)
+
+
+def round_key(sector: SelectionSector) -> Tuple[int, int]:
+    info = sector.shared_info
+    return info.selection_year, info.selection_term
+
+
+def _dump_week(week) -> list:
+    return [[w.start, w.stop, w.step] if isinstance(w, range) else w for w in week]
+
+
+def _load_week(week: list) -> list:
+    return [range(*w) if isinstance(w, list) else w for w in week]
+
+
+def _dump_class(klass: SelectionClass) -> list:
+    row = [getattr(klass, field) for field in STATIC_FIELDS + VOLATILE_FIELDS]
+    time_index = STATIC_FIELDS.index("time")
+    row[time_index] = [[t.weekday, _dump_week(t.week), [[r.start, r.stop] for r in t.time]]
+                       for t in row[time_index] or []]
+    return row
+
+
+def bind_sector(cli: pysjtu.Client, sector: SelectionSector):
+    # 与 pysjtu 的 course_selection_sectors 做的绑定一致
+    sector._func_classes = partial(cli._get_selection_classes, sector=sector)
+
+
+def bind_class(cli: pysjtu.Client, klass: SelectionClass):
+    # 与 pysjtu 的 _get_selection_classes 做的绑定一致
+    klass._load_func = partial(cli._fetch_selection_class, klass)
+    klass.is_registered = partial(cli._class_is_registered, klass)
+    klass.register = partial(cli._class_register, klass)
+    klass.drop = partial(cli._class_drop, klass)
+
+
+def _load_class(cli: pysjtu.Client, sector: SelectionSector, row: list) -> SelectionClass:
+    fields = dict(zip(STATIC_FIELDS + VOLATILE_FIELDS, row))
+    fields["teachers"] = [tuple(teacher) for teacher in fields["teachers"]]
+    fields["time"] = [LessonTime(weekday=weekday, week=_load_week(week), time=[range(*r) for r in periods])
+                      for weekday, week, periods in fields["time"]]
+    klass = SelectionClass(sector=sector, **fields)
+    bind_class(cli, klass)
+    return klass
+
+
+class Catalog:
+    """从缓存恢复的某个选课轮次的分区和班级"""
+
+    def __init__(self, round: Tuple[int, int], sectors: List[SelectionSector],
+                 classes: Dict[str, List[SelectionClass]]):
+        self.round = round
+        self.sectors = sectors
+        self.classes = classes
+
+
+class CatalogCache:
+    """
+    按学号保存在磁盘上的选课目录缓存（gzip 压缩的 JSON），记录选课轮次，
+    保存分区参数和班级的静态字段。启动时先用它填充界面，已选人数等易变字段再由后台刷新
+    """
+
+    def __init__(self, student_id, directory: str = CATALOG_DIR):
+        self.path = os.path.join(directory, f"{student_id}.json.gz")
+        self._lock = Lock()
+        self._data: Optional[dict] = None
+
+    def _read(self) -> dict:
+        if self._data is None:
+            self._data = {"version": CATALOG_VERSION, "round": None, "shared_info": None, "sectors": dict()}
+            try:
+                with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == CATALOG_VERSION:
+                    self._data = data
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                log.warning("读取目录缓存失败：%r", e)
+        return self._data
+
+    def load(self, cli: pysjtu.Client) -> Optional[Catalog]:
+        with self._lock:
+            data = self._read()
+            if not data["sectors"]:
+                return None
+            try:
+                shared_info = SelectionSharedInfo.Schema().load(data["shared_info"])
+                sectors, classes = [], dict()
+                for name, entry in data["sectors"].items():
+                    sector: SelectionSector = SelectionSector.Schema().load(entry["params"])
+                    sector.name, sector.course_type_code, sector.xkkz_id, sector.shared_info = \
+                        name, entry["course_type_code"], entry["xkkz_id"], shared_info
+                    bind_sector(cli, sector)
+                    sectors.append(sector)
+                    if entry["classes"] is not None:
+                        classes[name] = [_load_class(cli, sector, row) for row in entry["classes"]]
+            except Exception as e:
+                log.warning("目录缓存已损坏，忽略：%r", e)
+                return None
+        return Catalog(tuple(data["round"]), sectors, classes)
+
+    def save_sectors(self, sectors: List[SelectionSector]):
+        """保存分区参数；轮次变化时丢弃旧的班级"""
+        if not sectors:
+            return
+        with self._lock:
+            data = self._read()
+            current = list(round_key(sectors[0]))
+            if data["round"] != current:
+                data["sectors"] = dict()
+            data["round"] = current
+            data["shared_info"] = SelectionSharedInfo.Schema().dump(sectors[0].shared_info)
+            old = data["sectors"]
+            data["sectors"] = {sector.name: {"params": SelectionSector.Schema().dump(sector),
+                                             "xkkz_id": sector.xkkz_id,
+                                             "course_type_code": sector.course_type_code,
+                                             "classes": old.get(sector.name, {}).get("classes")}
+                               for sector in sectors}
+            self._write(data)
+
+    def save_classes(self, sector: SelectionSector, classes: List[SelectionClass]):
+        """保存一个分区的班级，会访问懒加载字段，需要在后台线程调用"""
+        rows = [_dump_class(klass) for klass in classes]
+        with self._lock:
+            data = self._read()
+            entry = data["sectors"].get(sector.name)
+            if entry is None or data["round"] != list(round_key(sector)):
+                return
+            entry["classes"] = rows
+            self._write(data)
+
+    def _write(self, data: dict):
+        # 缓存写不进去只影响下次启动的速度
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("写入目录缓存失败：%s", e)
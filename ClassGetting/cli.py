@@ -0,0 +1,47 @@
+import argparse
+from datetime import datetime
+
+from accounts import ACCOUNTS_FILE, load_accounts
+from engine import Engine, load_jobs, run_in_processes
+from logs import setup_logging
+from metrics import METRICS, MetricsExporter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无界面的多账号抢课")
+    parser.add_argument("jobs", help="任务文件，JSON 列表，每项为 {account, sector, class_id, mode: select|switch, "
+                                     "candidates: [备选 class_id], upgrade}")
+    parser.add_argument("--accounts", default=ACCOUNTS_FILE, help="账号文件")
+    parser.add_argument("--processes", type=int, default=1, help="按账号分到多少个进程中运行")
+    parser.add_argument("--concurrency", type=int, default=2, help="每个账号同时在途的请求上限")
+    parser.add_argument("--budget", type=float, default=5, help="每个账号每秒最多发出的请求数")
+    parser.add_argument("--open-at", help="选课开放时间，格式为 2025-06-20 12:00:00，到点集中抢课")
+    parser.add_argument("--timeout", type=float, help="最长运行时间（秒），默认一直运行到全部选上")
+    parser.add_argument("--no-hot-path", action="store_true", help="不预热连接")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--metrics", help="定期写出指标的文件，.json 结尾写 JSON，否则写 Prometheus 文本格式")
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    accounts = {account["username"]: account["password"] for account in load_accounts(args.accounts)}
+    jobs = load_jobs(args.jobs)
+    open_at = datetime.strptime(args.open_at, "%Y-%m-%d %H:%M:%S").timestamp() if args.open_at else None
+    options = dict(concurrency=args.concurrency, request_budget=args.budget, open_at=open_at,
+                   hot_path=not args.no_hot_path)
+    if args.processes > 1:
+        results = run_in_processes(accounts, jobs, args.processes, args.timeout, args.log_level, args.metrics,
+                                   **options)
+    else:
+        exporter = MetricsExporter(METRICS, args.metrics).start() if args.metrics else None
+        try:
+            results = Engine(accounts, jobs, **options).run(args.timeout)
+        finally:
+            if exporter is not None:
+                exporter.stop()
+
+    for username, class_ids in results.items():
+        print(f"{username}：选上 {len(class_ids)} 个班级 {', '.join(class_ids)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, List, Optional
+
+import pysjtu
+from pysjtu.models import ScheduleCourse, SelectionClass, SelectionSector, SelectionSharedInfo
+
+from burst import BurstPlan, ClockSync
+from hotpath import HotPath
+from logs import setup_logging
+from metrics import METRICS, MetricsExporter
+from schedule_cache import ScheduleCache, selection_term
+from scheduler import GrabScheduler, GroupJob, SelectJob, SwitchJob
+from session_monitor import ManagedSession, SessionMonitor
+
+log = logging.getLogger(__name__)
+
+MODES = ("select", "switch")
+
+
+@dataclass
+class JobSpec:
+    """
+    任务文件中的一条：为 account 在 sector 分区抢 class_id 班级。
+    mode=switch 时从课表中找到已选的同一门课的班级，换到 class_id。
+    candidates 为同一门课排在 class_id 之后的备选班级，有备选时作为候选组抢其中有空位的最靠前的一个，
+    upgrade=True 时选上后继续等更靠前的班级。同一账号的同一门课只能有一条
+    """
+    account: str
+    sector: str
+    class_id: str
+    mode: str = "select"
+    candidates: List[str] = field(default_factory=list)
+    upgrade: bool = False
+
+    @staticmethod
+    def key_of(course: SelectionClass) -> str:
+        """任务按课程区分，不按班级：同一门课的两个任务会重复选课、互相退课"""
+        return f"{course.sector.name}-{course.internal_course_id}"
+
+
+def load_jobs(path: str) -> List[JobSpec]:
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    jobs = []
+    for i, item in enumerate(raw):
+        try:
+            job = JobSpec(**item)
+        except TypeError as e:
+            raise ValueError(f"任务文件第 {i + 1} 条格式错误：{e}")
+        if job.mode not in MODES:
+            raise ValueError(f"任务文件第 {i + 1} 条的 mode 应为 {'/'.join(MODES)}，而不是 {job.mode}")
+        if not isinstance(job.candidates, list):
+            raise ValueError(f"任务文件第 {i + 1} 条的 candidates 应为 class_id 的列表")
+        jobs.append(job)
+    return jobs
+
+
+def login(username: str, password: str, concurrency: int) -> pysjtu.Client:
+    with METRICS.timer("login_seconds"):
+        cli = pysjtu.Client(session=ManagedSession(username=username, password=password,
+                                                   **HotPath.client_options(concurrency)))
+        # 学号也要请求一次，登录阶段一并取好
+        cli.student_id
+    return cli
+
+
+def sync_clock(cli: pysjtu.Client) -> ClockSync:
+    """按响应头里的 Date 校准服务器时钟"""
+    clock = ClockSync(lambda: cli._session._client.head("/").headers["Date"])
+    clock.sync()
+    return clock
+
+
+def selected_class_of_same_course(schedule_cache: ScheduleCache, course: SelectionClass):
+    """课表中已选的同一门课的其他班级，没有时返回 None。课表取不到时抛出异常"""
+    schedule = schedule_cache.get(*selection_term(course.sector))
+    # schedule 中的 course_id 对应 SelectionClass 的 internal_course_id
+    for klass in schedule.same_course(course.name, course.internal_course_id):
+        if klass.class_id != course.class_id:
+            return klass
+    return None
+
+
+def build_schemas():
+    """
+    marshmallow_dataclass 在第一次访问 Model.Schema 时才生成 schema，多个线程同时生成会出错，
+    并行登录前先在当前线程把要用到的都生成好
+    """
+    for model in (SelectionSharedInfo, SelectionSector, SelectionClass, ScheduleCourse):
+        model.Schema
+
+
+class AccountSession:
+    """
+    一个账号的全部抢课状态：登录得到的客户端、独立的调度器（限流按账号计算）和热路径。
+    不依赖 PyQt，可以在无界面的服务器上运行
+    """
+
+    def __init__(self, username: str, password: str, concurrency: int = 2, request_budget: float = 5,
+                 login_func: Callable[[str, str, int], pysjtu.Client] = login):
+        self.username = username
+        self.password = password
+        self.concurrency = concurrency
+        self.login_func = login_func
+        self.cli: Optional[pysjtu.Client] = None
+        self.hot_path: Optional[HotPath] = None
+        self.session_monitor: Optional[SessionMonitor] = None
+        self.finished: List[SelectionClass] = []
+        self.scheduler = GrabScheduler(concurrency=concurrency, on_finish=self.finished.append,
+                                       request_budget=request_budget)
+        self.sectors: Dict[str, SelectionSector] = dict()
+        # 分区名 -> class_id -> 班级
+        self.classes: Dict[str, Dict[str, SelectionClass]] = dict()
+        # 已提交任务的 key
+        self.keys = set()
+        # 每个账号一个 logger，日志里带上账号
+        self.log = log.getChild(username)
+
+    def login(self, hot_path: bool = True):
+        self.cli = self.login_func(self.username, self.password, self.concurrency)
+        self.log.info("已成功登录为%s。", self.cli.student_id)
+        if hot_path:
+            self.hot_path = HotPath(self.cli, pool_size=self.concurrency)
+            self.hot_path.prepare()
+            self.hot_path.start_keepalive()
+        with METRICS.timer("sector_fetch_seconds"):
+            self.sectors = {sector.name: sector for sector in self.cli.course_selection_sectors}
+        self.session_monitor = SessionMonitor(self.cli._session)
+        self.session_monitor.start()
+        self.scheduler.session = self.session_monitor
+        self.scheduler.cli = self.cli
+        self.scheduler.start()
+
+    def sync_clock(self, open_at: float):
+        clock = sync_clock(self.cli)
+        self.scheduler.burst = BurstPlan.from_sync(open_at, clock)
+        self.log.info("服务器时间偏差 %.0f±%.0fms", clock.offset * 1000, clock.error * 1000)
+
+    def find_class(self, sector_name: str, class_id: str) -> SelectionClass:
+        if sector_name not in self.sectors:
+            raise KeyError(f"找不到分区 {sector_name}")
+        if sector_name not in self.classes:
+            sector = self.sectors[sector_name]
+            with METRICS.timer("class_list_fetch_seconds", sector=sector_name):
+                self.classes[sector_name] = {klass.class_id: klass for klass in sector.classes}
+        if class_id not in self.classes[sector_name]:
+            raise KeyError(f"{sector_name} 中找不到班级 {class_id}")
+        return self.classes[sector_name][class_id]
+
+    def submit(self, job: JobSpec):
+        course = self.find_class(job.sector, job.class_id)
+        key = job.key_of(course)
+        if key in self.keys:
+            raise ValueError(f"{course.name} 已经有任务了，同一门课的其他班级请写在 candidates 里")
+        old_class = selected_class_of_same_course(self.scheduler.schedule_cache, course) \
+            if job.mode == "switch" else None
+        if job.mode == "switch" and old_class is None:
+            self.log.warning("课表中没有 %s 的其他班级，改为直接抢课", course.name)
+        if job.candidates:
+            candidates = [course] + [self.find_class(job.sector, class_id) for class_id in job.candidates]
+            self.scheduler.submit(key, GroupJob(candidates, old_class, upgrade=job.upgrade))
+        elif old_class is None:
+            self.scheduler.submit(key, SelectJob(course))
+        else:
+            self.scheduler.submit(key, SwitchJob(old_class, course))
+        self.keys.add(key)
+        self.log.info("已提交 %s 任务：%s %s", job.mode, course.name, course.class_name)
+
+    def stop(self):
+        if self.hot_path is not None:
+            self.hot_path.stop()
+        self.scheduler.shutdown()
+        if self.session_monitor is not None:
+            self.session_monitor.stop()
+
+
+class Engine:
+    """
+    无界面的多账号抢课引擎：并行登录所有账号，每个账号一个调度器，
+    所有账号的任务在同一进程内并发执行
+    """
+
+    def __init__(self, accounts: Dict[str, str], jobs: List[JobSpec], concurrency: int = 2,
+                 request_budget: float = 5, open_at: Optional[float] = None, hot_path: bool = True,
+                 login_func: Callable[[str, str, int], pysjtu.Client] = login):
+        self.jobs = jobs
+        self.open_at = open_at
+        self.hot_path = hot_path
+        self.sessions: Dict[str, AccountSession] = dict()
+        for username in dict.fromkeys(job.account for job in jobs):
+            if username not in accounts:
+                log.warning("账号文件中没有 %s，跳过它的任务", username)
+                continue
+            self.sessions[username] = AccountSession(username, accounts[username], concurrency, request_budget,
+                                                     login_func)
+
+    def _prepare(self, session: AccountSession) -> bool:
+        try:
+            session.login(self.hot_path)
+            if self.open_at is not None:
+                session.sync_clock(self.open_at)
+        except Exception as e:
+            session.log.error("登录失败：%r", e)
+            return False
+        for job in self.jobs:
+            if job.account != session.username:
+                continue
+            try:
+                session.submit(job)
+            except Exception as e:
+                session.log.error("提交任务失败：%s", e)
+        return True
+
+    def start(self) -> List[AccountSession]:
+        """并行登录所有账号并提交各自的任务，返回登录成功的账号"""
+        sessions = list(self.sessions.values())
+        if not sessions:
+            return []
+        build_schemas()
+        with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            return [session for session, ok in zip(sessions, executor.map(self._prepare, sessions)) if ok]
+
+    def run(self, timeout: Optional[float] = None) -> Dict[str, List[str]]:
+        """运行到所有任务结束或超时，返回每个账号选上的 class_id"""
+        ready = self.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            for session in ready:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not session.scheduler.join(remaining):
+                    session.log.warning("超时，未完成的任务：%s", session.scheduler.pending())
+        except KeyboardInterrupt:
+            log.warning("已中断")
+        finally:
+            for session in self.sessions.values():
+                session.stop()
+        return {username: [klass.class_id for klass in session.finished]
+                for username, session in self.sessions.items()}
+
+
+def metrics_path(path: str, worker: int) -> str:
+    """多进程时每个进程写自己的指标文件：metrics.prom -> metrics-1.prom"""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{worker}{ext}"
+
+
+def _run_engine(accounts: Dict[str, str], jobs: List[dict], timeout: Optional[float], options: dict,
+                log_level: str, metrics: Optional[str]) -> Dict[str, List[str]]:
+    # 进程池的入口，参数都要能被 pickle；日志和指标在每个进程里各自设置
+    setup_logging(log_level)
+    exporter = MetricsExporter(METRICS, metrics).start() if metrics else None
+    try:
+        return Engine(accounts, [JobSpec(**job) for job in jobs], **options).run(timeout)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+
+
+def run_in_processes(accounts: Dict[str, str], jobs: List[JobSpec], processes: int, timeout: Optional[float] = None,
+                     log_level: str = "INFO", metrics: Optional[str] = None, **options) -> Dict[str, List[str]]:
+    """按账号把任务分到 processes 个进程中运行，同一账号的任务总在同一个进程里"""
+    usernames = list(dict.fromkeys(job.account for job in jobs))
+    groups = [usernames[i::processes] for i in range(processes)]
+    results = dict()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_run_engine,
+                                   {name: accounts[name] for name in group if name in accounts},
+                                   [asdict(job) for job in jobs if job.account in group], timeout, options,
+                                   log_level, metrics_path(metrics, i) if metrics else None)
+                   for i, group in enumerate(groups) if group]
+        for future in futures:
+            results.update(future.result())
+    return results
@@ -0,0 +1,330 @@
+import json
+import random
+import time
+from dataclasses import dataclass
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import pysjtu
+from pysjtu import consts
+
+STUDENT_ID = 520000000000
+WEEKDAY_NAMES = {0: "日", 1: "一", 2: "二", 3: "三", 4: "四", 5: "五", 6: "六"}
+SHARED_INFO = {"xqh_id": "1", "zyh_id": "1234", "njdm_id": "2023", "bh_id": "F2303001", "xkxnm": "2025",
+               "xkxqm": "3", "xszxzt": "1", "ccdm": "3", "xslbdm": "421", "xbm": "1", "zyfx_id": "wfx",
+               "xsbj": "0"}
+LOGIN_PAGE = "/xtgl/login_slogin.html"
+SESSION_COOKIE = "JSESSIONID"
+SECTOR_INFO = {"rwlx": "1", "xkly": "0", "tykczgxdcs": "10", "bklx_id": "0", "txbsfrl": "0", "kkbk": "0",
+               "sfkknj": "0", "sfkkzy": "0", "sfznkx": "0", "zdkxms": "0"}
+
+
+def _path(url: str) -> str:
+    return url.split("?")[0]
+
+
+def _hidden_inputs(fields: Dict[str, str]) -> str:
+    return "\n".join(f'<input type="hidden" id="{k}" value="{v}"/>' for k, v in fields.items())
+
+
+def create_client(server: "FakeSelectionServer", **kwargs) -> pysjtu.Client:
+    """连到本地模拟服务的 pysjtu 客户端，不需要登录"""
+    return pysjtu.Client(pysjtu.Session(base_url=server.url, **kwargs))
+
+
+@dataclass
+class FakeClass:
+    class_id: str
+    name: str
+    course_id: str
+    planned: int
+    registered: int = 0
+    sector: str = "通识课"
+    teacher: str = "张老师"
+    weekday: int = 1
+    periods: Tuple[int, int] = (1, 2)
+    weeks: str = "1-16周"
+
+    @property
+    def internal_course_id(self) -> str:
+        return f"k{self.course_id}"
+
+    @property
+    def class_name(self) -> str:
+        return f"({self.class_id})-{self.course_id}"
+
+    @property
+    def time(self) -> str:
+        return f"星期{WEEKDAY_NAMES[self.weekday]}第{self.periods[0]}-{self.periods[1]}节{{{self.weeks}}}"
+
+
+class FakeSelectionServer(ThreadingHTTPServer):
+    """
+    本地模拟的选课服务，实现了 pysjtu 选课用到的全部接口（分区、课程、班级、选课、退课、课表），
+    真实的 pysjtu.Client 可以直接连上来，用来在不碰真实教务系统的情况下做基准测试。
+    还可以用 compete 模拟其他同学在同一批班级上退课、抢课
+
+    :param connect_delay: 每个新连接的建立耗时，模拟 TCP + TLS 握手
+    :param latency: 每个请求的处理耗时
+    :param clock_offset: 服务器时钟比本机快多少秒，体现在响应头的 Date 上
+    :param open_at: 选课开放时刻（服务器时钟），之前的选课请求都会被拒绝
+    :param error_rate: POST 请求以这个概率返回 503，模拟高峰期服务器过载
+
+    不带会话 cookie 的请求视为刚登录，会分到一个新会话；expire_sessions 让会话失效，
+    之后带着旧 cookie 的请求会像教务系统一样被重定向到登录页
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, connect_delay: float = 0, latency: float = 0, clock_offset: float = 0,
+                 open_at: Optional[float] = None, error_rate: float = 0):
+        super().__init__(("127.0.0.1", port), FakeSelectionHandler)
+        self.connect_delay = connect_delay
+        self.latency = latency
+        self.clock_offset = clock_offset
+        self.open_at = open_at
+        self.error_rate = error_rate
+        self.lock = Lock()
+        self.classes: Dict[str, FakeClass] = dict()
+        # 本账号已选的 class_id
+        self.registered = set()
+        # (服务器时间, class_id, flag) 每次选课请求一条
+        self.register_log: List[Tuple[float, str, str]] = []
+        # (服务器时间, class_id) 每次退课请求一条
+        self.drop_log: List[Tuple[float, str]] = []
+        # (服务器时间, 路径, 表单) 每个请求一条
+        self.request_log: List[Tuple[float, str, Dict[str, str]]] = []
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        # 有效的会话 id，以及一共发出过多少个会话（即登录次数）
+        self.sessions = set()
+        self.logins = 0
+        self._thread: Optional[Thread] = None
+        self._stop = Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def add_class(self, class_id: str, planned: int, registered: int = 0, name: Optional[str] = None,
+                  course_id: Optional[str] = None, **kwargs) -> FakeClass:
+        course_id = course_id or f"CS{len(self.classes):04d}"
+        klass = FakeClass(class_id, name or f"课程{course_id}", course_id, planned, registered, **kwargs)
+        with self.lock:
+            self.classes[class_id] = klass
+        return klass
+
+    def enroll(self, class_id: str):
+        """让本账号直接占上某个班级的一个名额"""
+        with self.lock:
+            klass = self.classes[class_id]
+            if class_id not in self.registered:
+                self.registered.add(class_id)
+                klass.registered = min(klass.planned, klass.registered + 1)
+
+    def start(self):
+        self._thread = Thread(target=self.serve_forever, name="fake-selection-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.shutdown()
+        self.server_close()
+
+    def new_session(self) -> str:
+        with self.lock:
+            self.logins += 1
+            session_id = f"fake{self.logins}"
+            self.sessions.add(session_id)
+        return session_id
+
+    def expire_sessions(self, session_ids: Optional[Iterable[str]] = None):
+        """让指定的会话失效，默认全部"""
+        with self.lock:
+            if session_ids is None:
+                self.sessions.clear()
+            else:
+                self.sessions.difference_update(session_ids)
+
+    def now(self) -> float:
+        return time.time() + self.clock_offset
+
+    def compete(self, class_ids: Iterable[str], drop_rate: float, reaction: float, tick: float = 0.005):
+        """
+        模拟其他同学：每个班级里平均每秒有 drop_rate 个人退课，
+        空出来的名额平均 reaction 秒后被别人抢走
+        """
+        class_ids = list(class_ids)
+
+        def loop():
+            while not self._stop.wait(tick):
+                with self.lock:
+                    for class_id in class_ids:
+                        klass = self.classes[class_id]
+                        others = klass.registered - (class_id in self.registered)
+                        if others > 0 and random.random() < drop_rate * tick:
+                            klass.registered -= 1
+                        elif klass.registered < klass.planned and random.random() < tick / reaction:
+                            klass.registered += 1
+
+        Thread(target=loop, name="fake-competitors", daemon=True).start()
+
+    def register(self, class_id: str) -> dict:
+        with self.lock:
+            result = self._register(class_id)
+            self.register_log.append((self.now(), class_id, result["flag"]))
+            return result
+
+    def _register(self, class_id: str) -> dict:
+        if self.open_at is not None and self.now() < self.open_at:
+            return {"flag": "0", "msg": "选课尚未开放"}
+        klass = self.classes.get(class_id)
+        if klass is None:
+            return {"flag": "0", "msg": "教学班不存在"}
+        if class_id in self.registered:
+            return {"flag": "1"}
+        if klass.registered >= klass.planned:
+            return {"flag": "-1"}
+        klass.registered += 1
+        self.registered.add(class_id)
+        return {"flag": "1"}
+
+    def drop(self, class_id: str) -> str:
+        with self.lock:
+            self.drop_log.append((self.now(), class_id))
+            if class_id in self.registered:
+                self.registered.discard(class_id)
+                self.classes[class_id].registered -= 1
+            return "1"
+
+    def is_registered(self, class_id: str) -> str:
+        with self.lock:
+            return "1" if class_id in self.registered else "0"
+
+    def sectors_page(self) -> str:
+        with self.lock:
+            names = sorted({klass.sector for klass in self.classes.values()})
+        # 分区的 xkkz_id 直接用分区名
+        links = "\n".join(f"<a onclick=\"queryCourse(this,'10','{name}')\">{name}</a>" for name in names)
+        return f"{_hidden_inputs(SHARED_INFO)}\n{links}"
+
+    def courses(self, sector: str) -> dict:
+        with self.lock:
+            return {"tmpList": [{"kcmc": k.name, "xf": "2.0", "kch": k.course_id, "kch_id": k.internal_course_id,
+                                 "jxbmc": k.class_name, "jxb_id": k.class_id, "yxzrs": str(k.registered)}
+                                for k in self.classes.values() if k.sector == sector]}
+
+    def course_classes(self, sector: str, internal_course_id: str) -> list:
+        with self.lock:
+            return [{"jxb_id": k.class_id, "do_jxb_id": k.class_id, "jsxx": f"T{k.class_id}/{k.teacher}/教授",
+                     "jxdd": "东上院101", "sksj": k.time, "kcxzmc": "通识", "jxbrl": str(k.planned)}
+                    for k in self.classes.values()
+                    if k.sector == sector and k.internal_course_id == internal_course_id]
+
+    def schedule(self) -> dict:
+        with self.lock:
+            return {"kbList": [{"kcmc": k.name, "kch_id": k.internal_course_id, "jxbmc": k.class_name,
+                                "jxb_id": k.class_id, "xqj": str(k.weekday), "zcd": k.weeks,
+                                "jcs": f"{k.periods[0]}-{k.periods[1]}"}
+                               for k in (self.classes[class_id] for class_id in self.registered)]}
+
+
+class FakeSelectionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: FakeSelectionServer
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.connect_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def date_time_string(self, timestamp=None):
+        return super().date_time_string(self.server.now() if timestamp is None else timestamp)
+
+    def _reply(self, body, content_type: str = "application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(200)
+        self._send_session_cookie()
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _reply_html(self, html: str):
+        self._reply(html.encode(), "text/html; charset=utf-8")
+
+    def _send_session_cookie(self):
+        if self.new_session is not None:
+            self.send_header("Set-Cookie", f"{SESSION_COOKIE}={self.new_session}; Path=/")
+
+    def _session_valid(self) -> bool:
+        cookies = SimpleCookie(self.headers.get("Cookie", ""))
+        if SESSION_COOKIE not in cookies:
+            self.new_session = self.server.new_session()
+            return True
+        with self.server.lock:
+            return cookies[SESSION_COOKIE].value in self.server.sessions
+
+    def _handle(self, form: Dict[str, str]):
+        server = self.server
+        # 本次请求新分配的会话，随响应的 Set-Cookie 发回
+        self.new_session: Optional[str] = None
+        path = _path(self.path)
+        with server.lock:
+            server.requests += 1
+            server.request_log.append((server.now(), path, form))
+            failed = self.command == "POST" and random.random() < server.error_rate
+            server.errors += failed
+        time.sleep(server.latency)
+        if path != LOGIN_PAGE and not self._session_valid():
+            self.send_response(302)
+            self.send_header("Location", LOGIN_PAGE)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif failed:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif path == _path(consts.SELECTION_REGISTER):
+            self._reply(server.register(form.get("jxb_ids", "")))
+        elif path == _path(consts.SELECTION_DROP):
+            self._reply(server.drop(form.get("jxb_ids", "")))
+        elif path == _path(consts.SELECTION_IS_REGISTERED):
+            self._reply(server.is_registered(form.get("jxb_id", "")))
+        elif path == _path(consts.SELECTION_QUERY_COURSES):
+            self._reply(server.courses(form.get("xkkz_id", "")))
+        elif path == _path(consts.SELECTION_QUERY_CLASSES):
+            self._reply(server.course_classes(form.get("xkkz_id", ""), form.get("kch_id", "")))
+        elif path == _path(consts.SELECTION_ALL_SECTORS_PARAM_URL):
+            self._reply_html(server.sectors_page())
+        elif path == _path(consts.SELECTION_SECTOR_PARAM_URL):
+            self._reply_html(_hidden_inputs(SECTOR_INFO))
+        elif path == _path(consts.SCHEDULE_URL):
+            self._reply(server.schedule())
+        elif path == LOGIN_PAGE:
+            self._reply_html("<title>登录</title>")
+        elif path == _path(consts.HOME_URL):
+            self._reply_html(f'<input id="sessionUserKey" value="{STUDENT_ID}"/>')
+        else:
+            self._reply(b"", "text/html")
+
+    def do_HEAD(self):
+        self._handle(dict())
+
+    def do_GET(self):
+        self._handle(dict())
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        self._handle(form)
@@ -0,0 +1,113 @@
+import logging
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+from typing import Deque, Dict, Optional
+
+import httpx
+
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+
+class HotPath:
+    """
+    选课热路径：在选课开放前预先解析 DNS、建立长连接，
+    连接池大小与并发任务数一致，并定期发送轻量请求保持连接。
+    每个请求的耗时、是否复用了连接、新建连接和 DNS 解析的耗时都记到 METRICS
+    """
+
+    def __init__(self, cli, pool_size: int = 4, keepalive_interval: float = 15, warm_url: str = "/"):
+        self.cli = cli
+        self.pool_size = pool_size
+        self.keepalive_interval = keepalive_interval
+        self.warm_url = warm_url
+        # 接口路径 -> 最近的请求耗时（秒）
+        self.latencies: Dict[str, Deque[float]] = dict()
+        self._stop = Event()
+        self._keepalive: Optional[Thread] = None
+        self._install_hooks()
+
+    @staticmethod
+    def client_options(pool_size: int) -> dict:
+        """传给 pysjtu.create_client 的连接池参数，登录时就按并发任务数建好连接池"""
+        return {"limits": httpx.Limits(max_connections=pool_size * 2, max_keepalive_connections=pool_size,
+                                       keepalive_expiry=60)}
+
+    @property
+    def client(self) -> httpx.Client:
+        return self.cli._session._client
+
+    def _install_hooks(self):
+        hooks = self.client.event_hooks
+        if self._on_request not in hooks["request"]:
+            hooks["request"].append(self._on_request)
+            hooks["response"].append(self._on_response)
+            self.client.event_hooks = hooks
+
+    @staticmethod
+    def _on_request(request: httpx.Request):
+        request.extensions["hot_path_start"] = time.perf_counter()
+        # httpcore 的 trace 回调：连接池里没有可复用的连接时会先建立新连接
+        connect = request.extensions["hot_path_connect"] = dict()
+        previous = request.extensions.get("trace")
+
+        def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.started":
+                connect["started"] = time.perf_counter()
+            elif event == "connection.connect_tcp.complete" and "started" in connect:
+                METRICS.observe("http_connect_seconds", time.perf_counter() - connect["started"])
+            if previous is not None:
+                previous(event, info)
+
+        request.extensions["trace"] = trace
+
+    def _on_response(self, response: httpx.Response):
+        extensions = response.request.extensions
+        start = extensions.get("hot_path_start")
+        if start is not None:
+            # 从发出请求到收到响应头的耗时
+            path = response.request.url.path
+            elapsed = time.perf_counter() - start
+            self.latencies.setdefault(path, deque(maxlen=1000)).append(elapsed)
+            METRICS.observe("http_request_seconds", elapsed, path=path)
+            connection = "new" if "started" in extensions.get("hot_path_connect", ()) else "reused"
+            METRICS.inc("http_requests_total", path=path, connection=connection)
+
+    def resolve(self):
+        url = self.client.base_url
+        with METRICS.timer("dns_resolve_seconds"):
+            socket.getaddrinfo(url.host, url.port or (443 if url.scheme == "https" else 80),
+                               proto=socket.IPPROTO_TCP)
+
+    def warm(self):
+        """同时发出 pool_size 个轻量请求，让连接池里保持 pool_size 条可复用的连接"""
+        def ping(_):
+            try:
+                self.client.head(self.warm_url, follow_redirects=False)
+            except httpx.HTTPError as e:
+                log.warning("预热连接失败：%r", e)
+
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            list(executor.map(ping, range(self.pool_size)))
+
+    def prepare(self):
+        self.resolve()
+        self.warm()
+
+    def start_keepalive(self):
+        if self._keepalive is not None and self._keepalive.is_alive():
+            return
+        self._stop.clear()
+        self._keepalive = Thread(target=self._keepalive_loop, name="hot-path-keepalive", daemon=True)
+        self._keepalive.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive_interval):
+            self.warm()
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import time
+import zlib
+from threading import Lock
+from typing import Dict, Optional
+
+log = logging.getLogger(__name__)
+
+JOURNAL_DIR = "journal"
+
+
+def journal_path(student_id, directory: str = JOURNAL_DIR) -> str:
+    return os.path.join(directory, f"{student_id}.jsonl")
+
+
+def _encode(record: dict) -> bytes:
+    payload = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    # 每行带上 CRC，写到一半的行在回放时能被识别并跳过
+    return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n".encode("utf-8")
+
+
+def _decode(line: bytes) -> Optional[dict]:
+    try:
+        crc, payload = line.rstrip(b"\n").split(b" ", 1)
+        if int(crc, 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+class JobJournal:
+    """
+    只追加的抢课任务日志，每个事件一行：提交（目标班级、方式）、每次选课/退课尝试的结果、结束和取消。
+    提交、结束、取消会 fsync；尝试只 flush，进程崩溃不会丢，断电时最多丢最后几次尝试的记录。
+    启动时回放得到未结束的任务，并把日志压缩成只剩这些任务
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        self._file = None
+
+    def replay(self) -> Dict[str, dict]:
+        """返回未结束的任务：key -> {"spec": 提交时的描述, "attempts": 尝试次数, "results": 各结果的次数}"""
+        pending: Dict[str, dict] = dict()
+        skipped = 0
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    record = _decode(line)
+                    if record is None:
+                        skipped += 1
+                        continue
+                    self._apply(pending, record)
+        except FileNotFoundError:
+            pass
+        if skipped:
+            log.warning("任务日志中有 %d 行损坏，已跳过", skipped)
+        self._compact(pending)
+        return pending
+
+    @staticmethod
+    def _apply(pending: Dict[str, dict], record: dict):
+        key, event = record.get("key"), record.get("event")
+        if event == "submit":
+            # 候选班级变化时同一个 key 会重新提交，尝试次数接着算
+            previous = pending.get(key, {"attempts": record.get("attempts", 0),
+                                         "results": record.get("results", dict())})
+            pending[key] = {"spec": record["spec"], "attempts": previous["attempts"],
+                            "results": previous["results"]}
+        elif event == "attempt" and key in pending:
+            entry = pending[key]
+            entry["attempts"] += 1
+            entry["results"][record["result"]] = entry["results"].get(record["result"], 0) + 1
+        elif event in ("finish", "cancel"):
+            pending.pop(key, None)
+
+    def _compact(self, pending: Dict[str, dict]):
+        with self._lock:
+            self._close()
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp = f"{self.path}.tmp"
+                with open(tmp, "wb") as f:
+                    for key, entry in pending.items():
+                        f.write(_encode({"event": "submit", "key": key, "time": time.time(), **entry}))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except OSError as e:
+                log.warning("压缩任务日志失败：%s", e)
+
+    def submit(self, key: str, spec: dict):
+        self._append({"event": "submit", "key": key, "time": time.time(), "spec": spec}, sync=True)
+
+    def attempt(self, key: str, action: str, result: str):
+        self._append({"event": "attempt", "key": key, "time": time.time(), "action": action, "result": result})
+
+    def finish(self, key: str, outcome: str, class_id: Optional[str] = None):
+        self._append({"event": "finish", "key": key, "time": time.time(), "outcome": outcome,
+                      "class_id": class_id}, sync=True)
+
+    def cancel(self, key: str):
+        self._append({"event": "cancel", "key": key, "time": time.time()}, sync=True)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _append(self, record: dict, sync: bool = False):
+        data = _encode(record)
+        with self._lock:
+            try:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, "ab")
+                self._file.write(data)
+                self._file.flush()
+                if sync:
+                    os.fsync(self._file.fileno())
+            except OSError as e:
+                # 写日志失败不影响抢课本身
+                log.warning("写入任务日志失败：%s", e)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
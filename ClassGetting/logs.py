@@ -0,0 +1,69 @@
+import atexit
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+_listener: Optional[QueueListener] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    同一个 logger 的同一条日志模板每 period 秒最多放行 burst 条，其余丢弃，
+    下一个窗口放行的第一条注明省略了多少条。按模板计数，所以 "%s" 参数不同的日志算同一条
+    """
+
+    def __init__(self, burst: int = 5, period: float = 1):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        # (logger 名, 模板) -> [窗口开始时间, 窗口内已放行条数, 已丢弃条数]
+        self.windows: Dict[Tuple[str, str], list] = dict()
+        self._lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self.windows.setdefault(key, [now, 0, 0])
+            if now - window[0] >= self.period:
+                dropped = window[2]
+                window[:] = [now, 0, 0]
+                if dropped:
+                    record.msg = f"{record.msg}（省略了 {dropped} 条相同日志）"
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+def setup_logging(level="INFO", burst: int = 5, period: float = 1) -> QueueListener:
+    """
+    日志先经限流再放进队列，由后台线程写到 stdout，热循环里记日志不会阻塞在输出上。
+    重复调用只调整级别
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    # httpx 每个请求都记一条 INFO，热循环里太多
+    logging.getLogger("httpx").setLevel(max(root.level, logging.WARNING))
+    if _listener is not None:
+        return _listener
+
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.addFilter(RateLimitFilter(burst, period))
+    root.addHandler(handler)
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT, datefmt="%H:%M:%S"))
+    _listener = QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
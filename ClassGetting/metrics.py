@@ -0,0 +1,182 @@
+import bisect
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# 耗时直方图的桶上界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """按桶线性插值估计分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if BUCKETS[i] != float("inf") else max(low * 2, self.sum / self.count)
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-2]
+
+
+class Metrics:
+    """
+    线程安全的计数器和耗时直方图。每个指标按标签（任务、结果/错误类型等）分开统计，
+    可以导出成 Prometheus 文本格式或 JSON
+    """
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = dict()
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = dict()
+        self._lock = Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """记录代码块的耗时，标签 result 为 ok 或异常的类型名"""
+        start = time.perf_counter()
+        result = "ok"
+        try:
+            yield
+        except BaseException as e:
+            result = type(e).__name__
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, result=result, **labels)
+
+    def summary(self, drop: Tuple[str, ...] = ("job",)) -> List[dict]:
+        """去掉 drop 中的标签后合并，用于界面上的统计面板"""
+        merged: Dict[Tuple[str, Labels], Histogram] = dict()
+        with self._lock:
+            for (name, labels), histogram in self.histograms.items():
+                key = (name, tuple(label for label in labels if label[0] not in drop))
+                merged.setdefault(key, Histogram()).merge(histogram)
+            counters: Dict[Tuple[str, Labels], float] = dict()
+            for (name, labels), value in self.counters.items():
+                key = (name, tuple(label for label in labels if label[0] not in drop))
+                counters[key] = counters.get(key, 0) + value
+        rows = [{"name": name, "labels": dict(labels), "count": h.count, "p50": h.quantile(0.5),
+                 "p99": h.quantile(0.99), "sum": h.sum} for (name, labels), h in sorted(merged.items())]
+        rows += [{"name": name, "labels": dict(labels), "count": value}
+                 for (name, labels), value in sorted(counters.items())]
+        return rows
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> str:
+        with self._lock:
+            data = {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self.counters.items()],
+                "histograms": [{"name": name, "labels": dict(labels), "buckets": list(h.counts),
+                                "sum": h.sum, "count": h.count}
+                               for (name, labels), h in self.histograms.items()],
+            }
+        data["bounds"] = [str(bound) for bound in BUCKETS]
+        return json.dumps(data, ensure_ascii=False, indent=1)
+
+    def write(self, path: str):
+        """按扩展名写成 JSON 或 Prometheus 文本，先写临时文件再替换，读的一方不会读到一半"""
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+class MetricsExporter:
+    """后台线程每 interval 秒把指标写到 path，停止时再写一次"""
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = 5):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self):
+        self._thread = Thread(target=self._loop, name="metrics-exporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._export()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._export()
+
+    def _export(self):
+        try:
+            self.metrics.write(self.path)
+        except OSError as e:
+            log.warning("写入指标文件失败：%s", e)
+
+
+# 整个进程共用的指标
+METRICS = Metrics()
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pysjtu.models import SelectionClass, SelectionSector
+
+from capacity import CapacityRecorder
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+
+def fresh_classes(cli, sector: SelectionSector) -> List[SelectionClass]:
+    """
+    拉取分区最新的班级列表。pysjtu 用 lru_cache 缓存了分区的班级列表，又没有公开的清除方法，
+    需要清掉才能拿到最新的已选人数；对 pysjtu 私有属性的依赖只放在这里
+    """
+    cli._get_selection_classes.cache_clear()
+    return sector.classes
+
+
+class CapacityPoller:
+    """
+    共享的余量轮询器：每个 tick 对每个有任务在等待的分区只拉取一次班级列表，
+    和上一次的快照比较 students_registered/students_planned，
+    只唤醒所等班级出现余量的任务。每次观测都记到 recorder 里
+    """
+
+    def __init__(self, scheduler, interval: float = 1):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.sectors: Dict[str, SelectionSector] = dict()
+        # class_id -> 所属分区名 / 正在等待余量的任务
+        self.class_sector: Dict[str, str] = dict()
+        self.waiters: Dict[str, List[asyncio.Future]] = dict()
+        # class_id -> (students_registered, students_planned)
+        self.snapshot: Dict[str, Tuple[int, int]] = dict()
+        # class_id -> 上次观察到余量变化的时间（time.monotonic）
+        self.last_change: Dict[str, float] = dict()
+        # 每个等待者希望的轮询间隔，每个 tick 重新计算，取最小值作为下一次 tick 的间隔
+        self.intervals: Dict[asyncio.Future, Callable[[], float]] = dict()
+        # class_id -> 最近一次拉取到的班级对象 / 拉取时间（time.monotonic）
+        self.latest: Dict[str, SelectionClass] = dict()
+        self.updated: Dict[str, float] = dict()
+        self.recorder = CapacityRecorder()
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait_for_seat(self, klass: SelectionClass,
+                            interval: Optional[Callable[[], float]] = None) -> SelectionClass:
+        """等到 klass 有余量为止，返回最新一次拉取到的班级对象；interval() 返回该任务此刻希望的轮询间隔"""
+        return (await self.wait_for_any([klass], interval))[0]
+
+    async def wait_for_any(self, classes: List[SelectionClass],
+                           interval: Optional[Callable[[], float]] = None) -> List[SelectionClass]:
+        """
+        等到 classes 中任一班级有余量，按 classes 的顺序返回此刻有余量的班级（最新拉取到的对象）。
+        所有班级共用同一个等待者，同一分区的班级在同一次拉取中刷新。
+        interval 在等待期间每个 tick 调用一次，任务可以随余量的变化加快或放慢轮询
+        """
+        future = self.scheduler.loop.create_future()
+        self.intervals[future] = interval if interval is not None else lambda: self.interval
+        for klass in classes:
+            self.sectors.setdefault(klass.sector.name, klass.sector)
+            self.class_sector[klass.class_id] = klass.sector.name
+            self.waiters.setdefault(klass.class_id, []).append(future)
+        if self._task is None or self._task.done():
+            self._task = self.scheduler.loop.create_task(self._run())
+        try:
+            woken = await future
+        finally:
+            self.intervals.pop(future, None)
+            for klass in classes:
+                waiters = self.waiters.get(klass.class_id, [])
+                if future in waiters:
+                    waiters.remove(future)
+                if not waiters:
+                    self.waiters.pop(klass.class_id, None)
+        seats = [self.latest.get(klass.class_id, klass) for klass in classes if self.has_seat(klass.class_id)]
+        # 唤醒后到这里之间快照可能又被刷新，至少返回唤醒时有余量的班级
+        return seats or [woken]
+
+    def has_seat(self, class_id: str) -> bool:
+        registered, planned = self.snapshot.get(class_id, (0, 0))
+        return registered < planned
+
+    async def check(self, klass: SelectionClass, max_age: float = 0.2) -> Optional[SelectionClass]:
+        """
+        确认 klass 此刻还有余量：快照超过 max_age 秒就单独重新拉取一次。
+        有余量时返回最新的班级对象，否则返回 None
+        """
+        class_id = klass.class_id
+        if time.monotonic() - self.updated.get(class_id, 0) > max_age:
+            self.sectors.setdefault(klass.sector.name, klass.sector)
+            self.class_sector[class_id] = klass.sector.name
+            await self._refresh(klass.sector, [class_id])
+        return self.latest.get(class_id, klass) if self.has_seat(class_id) else None
+
+    async def _run(self):
+        while self.waiters:
+            for name in {self.class_sector[class_id] for class_id in self.waiters}:
+                await self._refresh(self.sectors[name])
+            await asyncio.sleep(self.next_interval())
+
+    def next_interval(self) -> float:
+        return min((interval() for interval in self.intervals.values()), default=self.interval)
+
+    def _fetch(self, sector: SelectionSector, watched: List[str]):
+        with METRICS.timer("class_list_fetch_seconds", sector=sector.name):
+            classes = {klass.class_id: klass for klass in fresh_classes(self.scheduler.cli, sector)}
+        # students_planned 是懒加载字段，放在工作线程里访问
+        counts = {class_id: (classes[class_id].students_registered, classes[class_id].students_planned)
+                  for class_id in watched if class_id in classes}
+        return classes, counts
+
+    async def _refresh(self, sector: SelectionSector, watched: Optional[List[str]] = None):
+        if watched is None:
+            watched = [class_id for class_id in self.waiters if self.class_sector[class_id] == sector.name]
+        try:
+            classes, counts = await self.scheduler.request(self._fetch, sector, watched)
+        except Exception as e:
+            log.warning("刷新余量失败：%r", e)
+            return
+        self.latest.update(classes)
+        now = time.monotonic()
+        for class_id, (registered, planned) in counts.items():
+            self.updated[class_id] = now
+            self.recorder.record(class_id, registered, planned)
+            previous = self.snapshot.get(class_id)
+            self.snapshot[class_id] = (registered, planned)
+            if previous is not None and previous != (registered, planned):
+                self.last_change[class_id] = now
+                log.info("%s %s 余量变化：%d/%d -> %d/%d", classes[class_id].name, classes[class_id].class_name,
+                         previous[0], previous[1], registered, planned)
+            if registered < planned:
+                for future in self.waiters.get(class_id, []):
+                    if not future.done():
+                        future.set_result(classes[class_id])
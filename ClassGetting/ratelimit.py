@@ -0,0 +1,82 @@
+import asyncio
+import random
+import time
+from threading import Lock
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    令牌桶限流：同一账号的所有任务共用，每秒最多 rate 个请求，允许 capacity 个的突发。
+    令牌可以预支成负数，排在后面的请求按预支顺序等待，先到先得
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate * 2)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self) -> float:
+        """预支一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_blocking(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AdaptiveInterval:
+    """
+    单个任务的自适应轮询间隔：
+    班级余量最近在变动时用 fast，长时间满员时放慢到 slow，其余时间用 base；
+    知道班级的历史退课频率时，按频率取间隔，使两次轮询之间平均出现 target 个空位（限制在 fast 到 slow 之间）；
+    请求出错时按带抖动的指数退避等待
+    """
+
+    def __init__(self, fast: float = 0.5, base: float = 1, slow: float = 5, moving: float = 10,
+                 quiet: float = 60, max_backoff: float = 30, target: float = 0.1):
+        self.fast = fast
+        self.base = base
+        self.slow = slow
+        # 距上次余量变化不到 moving 秒算“在变动”，超过 quiet 秒算“长时间满员”
+        self.moving = moving
+        self.quiet = quiet
+        self.max_backoff = max_backoff
+        self.target = target
+        self.started = time.monotonic()
+        self.errors = 0
+
+    def poll_interval(self, last_change: Optional[float], drop_rate: Optional[float] = None,
+                      now: Optional[float] = None) -> float:
+        """drop_rate 为每秒退课次数，观测不足时为 None；now 默认取 time.monotonic()"""
+        if now is None:
+            now = time.monotonic()
+        if last_change is not None and now - last_change < self.moving:
+            return self.fast
+        if drop_rate:
+            return min(self.slow, max(self.fast, self.target / drop_rate))
+        if now - (last_change or self.started) >= self.quiet:
+            return self.slow
+        return self.base
+
+    def on_success(self):
+        self.errors = 0
+
+    def on_error(self) -> float:
+        """返回出错后应等待的秒数"""
+        self.errors += 1
+        delay = min(self.max_backoff, self.base * 2 ** self.errors)
+        return delay * random.uniform(0.5, 1)
@@ -1,5 +1,37 @@
-from app import App
+import sys
+from threading import Thread
+
+from PyQt5 import QtWidgets
+
+# 这里只导入 PyQt5 和登录窗口，pysjtu 等较重的模块在用户输入账号密码时于后台导入
+from ui import LoginDialog
+
+
+def preload():
+    import app
+    from engine import build_schemas
+    # 顺便生成 pysjtu 模型的 schema，省掉第一次解析时的开销
+    build_schemas()
+
+
+def start_preload() -> Thread:
+    loader = Thread(target=preload, name="preload", daemon=True)
+    loader.start()
+    return loader
+
+
+def main():
+    qt = QtWidgets.QApplication(sys.argv)
+    loader = start_preload()
+    login_dialog = LoginDialog()
+    if login_dialog.exec_() != QtWidgets.QDialog.Accepted:
+        sys.exit(0)
+    credentials = login_dialog.get_username_password()
+    loader.join()
+    # 已在后台导入完成，这里直接取用
+    from app import App
+    App().run(credentials)
+
 
 if __name__ == '__main__':
-    app = App()
-    app.run()
+    main()
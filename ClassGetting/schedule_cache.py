@@ -0,0 +1,109 @@
+import time
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pysjtu import consts
+from pysjtu.models import SelectionSector
+
+from timetable import ScheduleTimetable
+
+
+def selection_term(sector: Optional[SelectionSector]) -> Tuple[int, int]:
+    """
+    当前选课轮次对应的 (学年, 学期)，即 cli.schedule 的参数。
+    分区里记录的是教务系统的学期代码（3/12/16），需要换成 pysjtu 的下标
+    """
+    if sector is not None and sector.shared_info is not None:
+        info = sector.shared_info
+        if info.selection_term in consts.TERMS:
+            return info.selection_year, consts.TERMS.index(info.selection_term)
+    # 拿不到分区信息时按日期推算：8 月以后是新学年第一学期，2~7 月是第二学期
+    today = time.localtime()
+    if today.tm_mon >= 8:
+        return today.tm_year, 0
+    if today.tm_mon >= 2:
+        return today.tm_year - 1, 1
+    return today.tm_year - 1, 0
+
+
+class ScheduleIndex:
+    """课表及其按 class_id / course_id / 课程名 建立的索引，以及用于判断时间冲突的位掩码"""
+
+    def __init__(self, courses):
+        self.courses = list(courses)
+        self.by_class_id: Dict[str, object] = dict()
+        self.by_course_id: Dict[str, List] = dict()
+        self.by_name: Dict[str, List] = dict()
+        for course in self.courses:
+            # 同一个班级每个上课时段各占一条，只保留第一条
+            self.by_class_id.setdefault(course.class_id, course)
+        for course in self.by_class_id.values():
+            self.by_course_id.setdefault(course.course_id, []).append(course)
+            self.by_name.setdefault(course.name, []).append(course)
+        self.timetable = ScheduleTimetable(self.courses)
+
+    def __iter__(self):
+        return iter(self.courses)
+
+    def has_class(self, class_id: str) -> bool:
+        return class_id in self.by_class_id
+
+    def same_course(self, name: str, internal_course_id: Optional[str] = None) -> List:
+        """已选的同一门课的班级，schedule 中的 course_id 对应选课的 internal_course_id"""
+        if internal_course_id is not None and internal_course_id in self.by_course_id:
+            return self.by_course_id[internal_course_id]
+        return self.by_name.get(name, [])
+
+
+class ScheduleCache:
+    """
+    按 (学年, 学期) 缓存课表，超过 ttl 秒重新拉取。
+    多个线程同时读取时共用同一次请求；本程序选课/退课成功后调用 invalidate 使缓存失效
+    """
+
+    def __init__(self, fetch: Callable[[int, int], object], ttl: float = 5):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries: Dict[Tuple[int, int], Tuple[float, ScheduleIndex]] = dict()
+        self._inflight: Dict[Tuple[int, int], Future] = dict()
+        self._generation = 0
+
+    def get(self, year: int, term: int) -> ScheduleIndex:
+        key = (year, term)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                return entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            generation = self._generation
+        if not owner:
+            return future.result()
+
+        try:
+            index = ScheduleIndex(self.fetch(year, term))
+        except BaseException as e:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            # 拉取期间发生过选课/退课，结果可能已经过期，不写入缓存
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic(), index)
+        future.set_result(index)
+        return index
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._inflight.clear()
@@ -0,0 +1,631 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from threading import Thread
+from typing import Callable, Deque, Dict, List, Optional
+
+from pysjtu.exceptions import FullCapacityException, TimeConflictException
+from pysjtu.models import SelectionClass
+
+from burst import BurstPlan, fire_burst, sleep_until
+from journal import JobJournal
+from metrics import METRICS
+from poller import CapacityPoller
+from ratelimit import AdaptiveInterval, TokenBucket
+from schedule_cache import ScheduleCache, selection_term
+from session_monitor import SessionMonitor
+from timetable import timetable_of
+
+log = logging.getLogger(__name__)
+
+# 重试也不会成功的选课错误，遇到时不再选这个班级。其他 RegistrationException（如“选课尚未开放”）按出错退避后重试
+PERMANENT_ERRORS = (TimeConflictException,)
+
+
+class GrabJob:
+    """
+    抢课任务基类。run() 在调度器的事件循环中执行，
+    所有会发请求的 pysjtu 调用都要通过 scheduler.request 经限流后交给有界线程池，
+    成功时返回目标班级，放弃时返回 None。
+
+    取消是协作式的：cancel() 在等待余量、退避等待和查询时立即打断任务；
+    选课、退课请求以及换班的退课到选回整个过程在 critical() 中执行，期间的取消推迟到离开临界区时生效，
+    不会出现已经退课、却来不及选回的情况
+    """
+    interval: float = 1
+
+    def __init__(self):
+        # 提交给调度器时设置：key 标识课程，同一门课重新提交时不变，用作日志和指标的标签；id 每次提交都不同
+        self.key: Optional[str] = None
+        self.id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+        # 在换班中临时创建的子任务把临界区记在所属的任务上
+        self.owner: GrabJob = self
+        self._critical = 0
+        self.pacing = AdaptiveInterval(fast=self.interval / 2, base=self.interval, slow=self.interval * 5)
+
+    def cancel(self):
+        """只能在调度线程中调用"""
+        self.cancelled = True
+        if not self._critical and self.task is not None:
+            self.task.cancel()
+
+    @contextmanager
+    def critical(self):
+        owner = self.owner
+        owner._critical += 1
+        try:
+            yield
+        finally:
+            owner._critical -= 1
+            if owner.cancelled and not owner._critical and owner.task is not None:
+                # 推迟的取消在下一次等待时生效
+                owner.task.cancel()
+
+    def poll_interval(self, scheduler: "GrabScheduler", klass: SelectionClass) -> float:
+        poller = scheduler.poller
+        return self.pacing.poll_interval(poller.last_change.get(klass.class_id),
+                                         poller.recorder.drop_rate(klass.class_id))
+
+    async def wait_for_seat(self, scheduler: "GrabScheduler", klass: SelectionClass) -> SelectionClass:
+        return await scheduler.poller.wait_for_seat(klass, lambda: self.poll_interval(scheduler, klass))
+
+    async def has_conflict(self, scheduler: "GrabScheduler", klass: SelectionClass) -> bool:
+        """
+        选课前对照课表检查时间冲突：冲突的请求服务器一定会拒绝，不必发出。
+        同一门课的已选班级不算冲突，课表取不到时不拦
+        """
+        def conflicts():
+            schedule = scheduler.schedule_cache.get(*selection_term(klass.sector))
+            class_ids = schedule.timetable.conflicts(timetable_of(klass).mask, klass.internal_course_id)
+            return [schedule.by_class_id[class_id].name for class_id in class_ids]
+
+        try:
+            names = await scheduler.call(conflicts)
+        except Exception as e:
+            log.warning("检查时间冲突时获取课表失败：%r", e)
+            return False
+        if names:
+            METRICS.inc("conflict_skipped_total", job=self.key)
+            log.warning("%s %s 与已选的 %s 时间冲突，放弃", klass.name, klass.class_name, "、".join(names))
+        return bool(names)
+
+    def spec(self) -> Optional[dict]:
+        """写进任务日志的描述（方式、分区、目标班级），重启后据此恢复任务；返回 None 的任务不记录"""
+        return None
+
+    @staticmethod
+    def sector_name(klass) -> Optional[str]:
+        """恢复任务要按分区找回班级；不是从分区取到的班级（如基准测试里手工构造的）没有分区，不记录"""
+        sector = getattr(klass, "sector", None)
+        return sector.name if sector is not None else None
+
+    async def run(self, scheduler: "GrabScheduler") -> Optional[SelectionClass]:
+        raise NotImplementedError
+
+
+class SelectJob(GrabJob):
+    def __init__(self, course: SelectionClass):
+        super().__init__()
+        self.course = course
+
+    def spec(self) -> Optional[dict]:
+        sector = self.sector_name(self.course)
+        if sector is None:
+            return None
+        return {"mode": "select", "sector": sector, "class_ids": [self.course.class_id]}
+
+    async def run(self, scheduler: "GrabScheduler") -> Optional[SelectionClass]:
+        if await self.has_conflict(scheduler, self.course):
+            return None
+        burst = scheduler.burst
+        if burst is not None and time.time() < burst.local_open_at():
+            # 还没到开放时间：空闲等待，到点集中发请求
+            log.info("%s 等待选课开放", self.course.name)
+            if await fire_burst(scheduler, self.course.register, burst, job=self):
+                scheduler.schedule_cache.invalidate()
+                log.info("%s 开放时抢课成功", self.course.name)
+                return self.course
+        else:
+            try:
+                registered = await scheduler.request(self.course.is_registered)
+            except Exception as e:
+                # 查询失败不影响抢课，按未选处理
+                log.warning("查询选课状态失败：%r", e)
+                registered = False
+            if registered:
+                log.info("%s 已选上", self.course.name)
+                return self.course
+        while True:
+            # 由共享的余量轮询器在出现空位时唤醒
+            course = await self.wait_for_seat(scheduler, self.course)
+            try:
+                log.debug("尝试选 %s", course.name)
+                await scheduler.measured("register_seconds", self, course.register)
+                scheduler.schedule_cache.invalidate()
+                log.info("%s 选课成功", course.name)
+                break
+            except FullCapacityException:
+                # 空位被别人抢走，回到轮询
+                self.pacing.on_success()
+                log.info("%s 的空位被抢走，继续等待", course.name)
+            except PERMANENT_ERRORS as e:
+                log.warning("选 %s 失败，不再尝试：%r", course.name, e)
+                return None
+            except Exception as e:
+                log.warning("选 %s 失败：%r", course.name, e)
+                await asyncio.sleep(self.pacing.on_error())
+        log.debug("%s 的抢课任务退出", self.course.name)
+        return self.course
+
+
+class SwitchJob(GrabJob):
+    """
+    换班任务：新班级出现空位时，退课前再确认一次余量，退掉原班级后立即选新班级，
+    新班级失败就马上选回原班级。每次切换中两个班级都没选上的时长记在 gaps 里
+    """
+    # 退课前余量快照的最长有效期
+    max_age: float = 0.2
+    # 退课后选新班级 / 选回原班级的最多尝试次数，重试之间不等待，只受限流约束
+    register_attempts: int = 3
+    restore_attempts: int = 3
+
+    def __init__(self, old_class, new_class: SelectionClass):
+        super().__init__()
+        self.old_class = old_class
+        self.new_class = new_class
+        self.gaps: List[float] = []
+        # 最近一次选新班级失败是否只是因为空位被抢走；选新班级遇到 PERMANENT_ERRORS 时记下这个错误，任务放弃
+        self.seat_taken = False
+        self.rejected: Optional[Exception] = None
+
+    def spec(self) -> Optional[dict]:
+        sector = self.sector_name(self.new_class)
+        if sector is None:
+            return None
+        # 原班级在恢复时按课表重新确定
+        return {"mode": "switch", "sector": sector, "class_ids": [self.new_class.class_id],
+                "old_class_id": self.old_class.class_id}
+
+    async def run(self, scheduler: "GrabScheduler") -> Optional[SelectionClass]:
+        if await self.has_conflict(scheduler, self.new_class):
+            return None
+        while True:
+            # 由共享的余量轮询器在新班级出现空位时唤醒
+            new_class = await self.wait_for_seat(scheduler, self.new_class)
+            try:
+                if await self.attempt(scheduler, new_class):
+                    break
+            except Exception as e:
+                log.warning("监听或切换时异常：%r", e)
+                await asyncio.sleep(self.pacing.on_error())
+            if self.rejected is not None:
+                log.warning("%s %s 无法选上，放弃换班", self.new_class.name, self.new_class.class_name)
+                return None
+        return self.new_class
+
+    async def attempt(self, scheduler: "GrabScheduler", new_class: SelectionClass) -> bool:
+        """新班级有空位时做一次切换，换上新班级时返回 True"""
+        year, semester = selection_term(self.new_class.sector)
+        try:
+            schedule = await scheduler.call(scheduler.schedule_cache.get, year, semester)
+            # 判断是否还选着 old_class
+            has_old = schedule.has_class(self.old_class.class_id)
+            # 退课要用 SelectionClass 实例
+            old_class = scheduler.poller.latest.get(self.old_class.class_id, self.old_class)
+        except Exception as e:
+            log.warning("刷新课表失败：%r", e)
+            old_class = self.old_class
+            has_old = True  # 保守处理
+
+        if not has_old:
+            if await self._register(scheduler, new_class):
+                log.info("选上新班级 %s", new_class.class_name)
+                return True
+            return False
+
+        # 读课表可能花了一些时间，退课前确认空位还在
+        new_class = await scheduler.poller.check(new_class, self.max_age)
+        if new_class is None:
+            log.info("%s 的空位已被抢走，继续等待", self.new_class.name)
+            return False
+
+        log.info("%s %s 有余量，尝试切换", new_class.name, new_class.class_name)
+        start = time.perf_counter()
+        # 从发出退课请求起，到选上新班级或选回原班级为止都不响应取消
+        with self.critical():
+            try:
+                await scheduler.measured("drop_seconds", self, old_class.drop)
+            except Exception as e:
+                log.warning("退课失败：%r", e)
+            else:
+                scheduler.schedule_cache.invalidate()
+                if await self._register(scheduler, new_class):
+                    self.pacing.on_success()
+                    self._record_gap(scheduler, start, "switched")
+                    return True
+                log.warning("切换失败，尝试恢复原班级")
+                if await self._restore(scheduler, old_class):
+                    self._record_gap(scheduler, start, "restored")
+                    if self.seat_taken:
+                        # 空位被别人抢走、原班级已经选回，是正常的竞争：按平常的轮询间隔继续等
+                        self.pacing.on_success()
+                        return False
+                else:
+                    METRICS.inc("switch_lost_total", job=self.key)
+                    log.error("恢复原班级 %s 失败，请手动处理", old_class.class_name)
+        # 退课失败、选新班级出错或没能选回原班级才退避
+        await asyncio.sleep(self.pacing.on_error())
+        return False
+
+    async def _register(self, scheduler: "GrabScheduler", new_class: SelectionClass) -> bool:
+        self.seat_taken = False
+        for _ in range(self.register_attempts):
+            try:
+                await scheduler.measured("register_seconds", self, new_class.register)
+            except FullCapacityException:
+                log.debug("新班级已满，立即重试")
+                self.seat_taken = True
+                continue
+            except PERMANENT_ERRORS as e:
+                log.warning("选新班级失败，不再尝试：%r", e)
+                self.seat_taken = False
+                self.rejected = e
+                return False
+            except Exception as e:
+                log.warning("选新班级请求失败：%r", e)
+                self.seat_taken = False
+                continue
+            scheduler.schedule_cache.invalidate()
+            return True
+        return False
+
+    async def _restore(self, scheduler: "GrabScheduler", old_class) -> bool:
+        for _ in range(self.restore_attempts):
+            try:
+                await scheduler.measured("register_seconds", self, old_class.register)
+            except FullCapacityException:
+                log.warning("原班级的空位已被别人选走")
+                continue
+            except Exception as e:
+                log.warning("恢复原班级失败：%r", e)
+                continue
+            scheduler.schedule_cache.invalidate()
+            return True
+        return False
+
+    def _record_gap(self, scheduler: "GrabScheduler", start: float, outcome: str):
+        gap = time.perf_counter() - start
+        self.gaps.append(gap)
+        scheduler.switch_gaps.append(gap)
+        METRICS.observe("switch_gap_seconds", gap, job=self.key, outcome=outcome)
+        log.info("%s，无班级空窗 %.1fms", "切换成功" if outcome == "switched" else "已恢复原班级", gap * 1000)
+
+
+class GroupJob(GrabJob):
+    """
+    候选组任务：同一门课可以接受的几个班级，按偏好从高到低排列。
+    所有候选共用一次余量轮询，有空位时只向排名最高的有空位班级发一次选课请求，选上后其余候选不再等待。
+    已选着这门课的其他班级（old_class）时走换班流程；upgrade=True 时选上后继续等更靠前的候选，
+    出现空位就换过去，直到选上第一候选
+    """
+
+    def __init__(self, candidates: List[SelectionClass], old_class=None, upgrade: bool = False):
+        super().__init__()
+        self.candidates = list(candidates)
+        self.old_class = old_class
+        self.upgrade = upgrade
+        self.held: Optional[SelectionClass] = None
+
+    def spec(self) -> Optional[dict]:
+        sector = self.sector_name(self.candidates[0])
+        if sector is None:
+            return None
+        return {"mode": "group", "sector": sector, "class_ids": [klass.class_id for klass in self.candidates],
+                "upgrade": self.upgrade}
+
+    async def run(self, scheduler: "GrabScheduler") -> Optional[SelectionClass]:
+        self.candidates = [klass for klass in self.candidates if not await self.has_conflict(scheduler, klass)]
+        await self._sync_held(scheduler)
+        burst = scheduler.burst
+        if burst is not None and self.candidates and time.time() < burst.local_open_at():
+            if self.held is None and self.old_class is None:
+                # 和 SelectJob 一样空闲等到开放时刻，向排名第一的候选集中发请求；没选上再按余量轮询
+                first = self.candidates[0]
+                log.info("候选组 %s 等待选课开放", self.key)
+                if await fire_burst(scheduler, first.register, burst, job=self):
+                    scheduler.schedule_cache.invalidate()
+                    log.info("%s %s 开放时抢课成功", first.name, first.class_name)
+                    self.held = first
+            else:
+                # 开放前不能换班
+                await sleep_until(burst.local_open_at())
+        while self.candidates:
+            if self.held is not None:
+                rank = self.candidates.index(self.held)
+                if rank == 0 or not self.upgrade:
+                    return self.held
+                targets = self.candidates[:rank]
+            else:
+                targets = self.candidates
+            seats = await scheduler.poller.wait_for_any(
+                targets, lambda: min(self.poll_interval(scheduler, klass) for klass in targets))
+            # 按排名取有空位的第一个，只发一个请求；seats 里是轮询器最新拉取到的对象
+            best = seats[0]
+            try:
+                if self.held is None and self.old_class is None:
+                    if await self._register(scheduler, best):
+                        self.held = self._candidate(best)
+                else:
+                    switch = SwitchJob(self.held or self.old_class, best)
+                    switch.key, switch.owner = self.key, self
+                    switch.pacing = self.pacing
+                    if await switch.attempt(scheduler, best):
+                        self.old_class = None
+                        self.held = self._candidate(best)
+                    elif switch.rejected is not None:
+                        self._discard(best)
+                await self._sync_held(scheduler)
+            except Exception as e:
+                log.warning("候选组 %s 异常：%r", self.key, e)
+                await asyncio.sleep(self.pacing.on_error())
+        log.warning("候选组 %s 没有可选的班级了", self.key)
+        return None
+
+    def _candidate(self, klass: SelectionClass) -> SelectionClass:
+        """轮询器返回的是最新拉取到的对象，换回候选列表里的那个，held 总是候选之一"""
+        return next(candidate for candidate in self.candidates if candidate.class_id == klass.class_id)
+
+    async def _register(self, scheduler: "GrabScheduler", klass: SelectionClass) -> bool:
+        try:
+            await scheduler.measured("register_seconds", self, klass.register)
+        except FullCapacityException:
+            self.pacing.on_success()
+            log.info("%s %s 的空位被抢走，继续等待", klass.name, klass.class_name)
+            return False
+        except PERMANENT_ERRORS as e:
+            log.warning("选 %s %s 失败，不再尝试：%r", klass.name, klass.class_name, e)
+            self._discard(klass)
+            return False
+        except Exception as e:
+            # 选课尚未开放、请求失败等，候选保留，退避后重试
+            log.warning("选 %s %s 失败：%r", klass.name, klass.class_name, e)
+            await asyncio.sleep(self.pacing.on_error())
+            return False
+        self.pacing.on_success()
+        scheduler.schedule_cache.invalidate()
+        log.info("%s %s 选课成功", klass.name, klass.class_name)
+        return True
+
+    def _discard(self, klass: SelectionClass):
+        self.candidates = [candidate for candidate in self.candidates if candidate.class_id != klass.class_id]
+
+    async def _sync_held(self, scheduler: "GrabScheduler"):
+        """
+        从课表核对当前选着的是哪个候选。选课、换班成功时已经直接设置了 held，
+        课表取不到、或者还没反映出刚选上的班级时沿用原来的判断，不会再去选同一门课的第二个班级
+        """
+        klass = self.candidates[0] if self.candidates else None
+        if klass is None:
+            return
+        try:
+            schedule = await scheduler.call(scheduler.schedule_cache.get, *selection_term(klass.sector))
+        except Exception as e:
+            log.warning("刷新课表失败：%r", e)
+            return
+        held = next((candidate for candidate in self.candidates if schedule.has_class(candidate.class_id)), None)
+        if held is None and self.held is not None:
+            log.warning("课表中还没有 %s %s，沿用原来的判断", self.held.name, self.held.class_name)
+            return
+        self.held = held
+
+
+class GrabScheduler:
+    """
+    统一的抢课调度器：一个后台线程跑 asyncio 事件循环，持有所有待执行的选课/换班任务，
+    阻塞请求交给大小为 concurrency 的线程池执行。
+    无论目标班级有多少，线程数都固定为 1 + concurrency
+    """
+
+    def __init__(self, concurrency: int = 4, on_finish: Optional[Callable[[SelectionClass], None]] = None,
+                 poll_interval: float = 1, request_budget: float = 5):
+        self.concurrency = concurrency
+        self.on_finish = on_finish
+        self.cli = None
+        # 设置后，开放前提交的选课任务会等到开放时刻集中抢课
+        self.burst: Optional[BurstPlan] = None
+        # key -> 正在运行的任务；被取消但还在临界区里收尾的任务放在 retiring，同一 key 的新任务等它结束再开始
+        self.jobs: Dict[str, GrabJob] = dict()
+        self.retiring: Dict[str, GrabJob] = dict()
+        self._ids = itertools.count(1)
+        # 设置后，任务的提交、每次选课/退课尝试、结束和取消都记到任务日志里
+        self.journal: Optional[JobJournal] = None
+        # 设置后，会话失效重新登录期间暂停发请求
+        self.session: Optional[SessionMonitor] = None
+        # 每次换班中两个班级都没选上的时长（秒）
+        self.switch_gaps: Deque[float] = deque(maxlen=1000)
+        self.loop = asyncio.new_event_loop()
+        # 同一账号所有请求共用的限流器，每秒最多 request_budget 个请求
+        self.limiter = TokenBucket(request_budget)
+        self.poller = CapacityPoller(self, interval=poll_interval)
+        self.schedule_cache = ScheduleCache(self._fetch_schedule, ttl=poll_interval * 5)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="grab")
+        self._thread = Thread(target=self.loop.run_forever, name="grab-scheduler", daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+
+    def submit(self, key: str, job: GrabJob, replace: bool = False) -> int:
+        """
+        线程安全：可在 GUI 线程中直接调用。返回任务 id。
+        key 上已有任务时默认不提交；replace=True 时取消旧任务、换成这个任务（例如候选班级变了），
+        任务日志里只记新的提交，已尝试的次数接着算
+        """
+        job.key, job.id = key, next(self._ids)
+        if self.journal is not None:
+            spec = job.spec()
+            if spec is not None:
+                self.journal.submit(key, spec)
+        if replace:
+            self.loop.call_soon_threadsafe(self._cancel, key)
+        self.loop.call_soon_threadsafe(self._spawn, job)
+        return job.id
+
+    def cancel(self, key: str, job_id: Optional[int] = None):
+        """
+        线程安全。取消 key 上的任务；给出 job_id 时只在正在运行的正是这个任务时取消。
+        与 submit 经同一个队列按顺序执行，刚提交、还没开始运行的任务也能取消
+        """
+        # 用户取消的任务重启后不再恢复；退出时 shutdown 取消的任务不记录，下次启动会恢复
+        if self.journal is not None and job_id is None:
+            self.journal.cancel(key)
+        self.loop.call_soon_threadsafe(self._cancel, key, job_id)
+
+    def cancel_all(self):
+        """线程安全：取消所有任务（包括刚提交、还没开始运行的），例如切换分区时"""
+        self.loop.call_soon_threadsafe(self._cancel_jobs)
+
+    def pending(self) -> List[str]:
+        return list(self.jobs)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """阻塞到已提交的任务全部结束，超时返回 False。不能在调度线程里调用"""
+        future = asyncio.run_coroutine_threadsafe(self._join(), self.loop)
+        try:
+            future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            return False
+        return True
+
+    def shutdown(self, timeout: float = 3):
+        """
+        取消所有任务并停止事件循环。正在换班的任务最多再等 timeout 秒完成临界区，之后强制结束；
+        线程池里还没开始的请求直接丢弃，已经发出的请求不等待
+        """
+        if self._thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self._cancel_all(timeout), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def call(self, func: Callable, *args, **kwargs):
+        return await self.loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def request(self, func: Callable, *args, limiter: Optional[TokenBucket] = None, **kwargs):
+        """
+        会向服务器发请求的调用，先等正在进行的重新登录结束，再从限流器取令牌。
+        limiter 默认是账号共用的限流器，集中抢课用计划自己的预算
+        """
+        if self.session is not None:
+            await self.session.settled()
+        await (limiter or self.limiter).acquire()
+        return await self.call(func, *args, **kwargs)
+
+    async def measured(self, metric: str, job: Optional[GrabJob], func: Callable, *args,
+                       limiter: Optional[TokenBucket] = None):
+        """
+        同 request，并把 func 本身的耗时按任务和结果记到 metric 直方图，每次尝试的结果记到任务日志。
+        这里发的是选课、退课这类改变状态的请求，在任务的临界区中执行，发出后不会被取消打断、丢掉结果
+        """
+        def call():
+            result = "ok"
+            try:
+                with METRICS.timer(metric, job=job.key if job is not None else None):
+                    return func(*args)
+            except Exception as e:
+                result = type(e).__name__
+                raise
+            finally:
+                if self.journal is not None and job is not None and job.key is not None:
+                    self.journal.attempt(job.key, metric.removesuffix("_seconds"), result)
+
+        if job is None:
+            return await self.request(call, limiter=limiter)
+        with job.critical():
+            return await self.request(call, limiter=limiter)
+
+    def request_blocking(self, func: Callable, *args, **kwargs):
+        """request 的阻塞版本，给 GUI 后台任务这类不在事件循环里的调用方：等重新登录结束、取令牌后直接调用"""
+        if self.session is not None:
+            self.session.settled_blocking()
+        self.limiter.acquire_blocking()
+        return func(*args, **kwargs)
+
+    def _fetch_schedule(self, year: int, term: int):
+        # 课表缓存可能在 GUI 的后台任务里被读取
+        with METRICS.timer("schedule_fetch_seconds"):
+            return self.request_blocking(self.cli.schedule, year, term)
+
+    def _spawn(self, job: GrabJob):
+        if job.key in self.jobs:
+            log.info("任务 %s 已在运行", job.key)
+            return
+        self.jobs[job.key] = job
+        job.task = self.loop.create_task(self._run(job.key, job))
+
+    def _cancel(self, key: str, job_id: Optional[int] = None):
+        job = self.jobs.get(key)
+        if job is None or (job_id is not None and job.id != job_id):
+            return
+        del self.jobs[key]
+        self.retiring[key] = job
+        log.debug("取消任务 %s#%d", key, job.id)
+        job.cancel()
+
+    def _cancel_jobs(self):
+        for key in list(self.jobs):
+            if self.journal is not None:
+                self.journal.cancel(key)
+            self._cancel(key)
+
+    async def _join(self):
+        # submit 和本协程都经 call_soon_threadsafe 排队，先提交的任务此时已在 jobs 里
+        while self.jobs:
+            await asyncio.wait([job.task for job in self.jobs.values()])
+
+    async def _cancel_all(self, timeout: float):
+        for key in list(self.jobs):
+            self._cancel(key)
+        retiring = [job.task for job in self.retiring.values()]
+        if retiring:
+            _, pending = await asyncio.wait(retiring, timeout=timeout)
+            if pending:
+                log.warning("%d 个任务未能在 %.0f 秒内结束，强制停止", len(pending), timeout)
+        # 剩下的任务和轮询器等一律直接取消
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, key: str, job: GrabJob):
+        previous = self.retiring.get(key)
+        try:
+            if previous is not None:
+                # 同一门课的旧任务还在换班，等它收尾，免得两个任务同时操作这门课
+                await asyncio.wait([previous.task])
+            result = await job.run(self)
+        except asyncio.CancelledError:
+            return
+        except Exception:
+            log.exception("任务 %s 异常退出", key)
+            result = None
+        finally:
+            if self.jobs.get(key) is job:
+                del self.jobs[key]
+            if self.retiring.get(key) is job:
+                del self.retiring[key]
+        METRICS.inc("jobs_finished_total", result="seated" if result is not None else "failed")
+        # 被取消的任务在临界区里选上时仍然通知 on_finish，但不再写任务日志，免得把同一门课新提交的任务标成已结束
+        if self.journal is not None and not job.cancelled:
+            self.journal.finish(key, "seated" if result is not None else "failed",
+                                result.class_id if result is not None else None)
+        if result is not None and self.on_finish is not None:
+            self.on_finish(result)
@@ -0,0 +1,118 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pysjtu.models import SelectionClass
+
+from timetable import ScheduleTimetable, lesson_times, timetable_of
+
+# pysjtu 的 weekday 用 0 表示星期日
+WEEKDAYS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "日": 0, "天": 0}
+WEEKDAY_PATTERN = re.compile(r"^(?:周|星期)([一二三四五六日天0-7])$")
+PERIOD_PATTERN = re.compile(r"^第(\d+)节$")
+
+
+def parse_query(query: str) -> Tuple[List[str], Optional[int], Optional[int]]:
+    """
+    把搜索框内容拆成关键词和时间条件，例如 "高数 周三 第3节"
+    返回 (关键词列表, 星期, 节次)
+    """
+    keywords, weekday, period = [], None, None
+    for token in query.lower().split():
+        match = WEEKDAY_PATTERN.match(token)
+        if match:
+            day = match.group(1)
+            weekday = int(day) % 7 if day.isdigit() else WEEKDAYS[day]
+            continue
+        match = PERIOD_PATTERN.match(token)
+        if match:
+            period = int(match.group(1))
+            continue
+        keywords.append(token)
+    return keywords, weekday, period
+
+
+class SectorIndex:
+    """
+    分区班级的内存索引，在分区加载时建立一次：
+    课程名、班级名、教师、课程号的单字/双字倒排表，按星期、节次的时间索引，
+    以及每个班级的时间位掩码，用于过滤与课表冲突的班级
+    """
+
+    def __init__(self, classes: List[SelectionClass], token=None):
+        self.classes = list(classes)
+        self.texts: List[str] = []
+        self.grams: Dict[str, Set[int]] = dict()
+        self.weekdays: Dict[int, Set[int]] = dict()
+        self.periods: Dict[int, Set[int]] = dict()
+        self.slots: Dict[Tuple[int, int], Set[int]] = dict()
+        self.masks: List[int] = []
+        self._last: Tuple[str, Optional[Set[int]]] = ("", None)
+        for i, klass in enumerate(self.classes):
+            # 教师和时间是懒加载字段，建索引时可能要请求服务器，逐个检查是否已被取消
+            if token is not None:
+                token.raise_if_cancelled()
+            self._add(i, klass)
+
+    def _add(self, i: int, klass: SelectionClass):
+        teachers = " ".join(t[0] for t in klass.teachers) if klass.teachers else ""
+        # 各字段之间用换行分隔，避免跨字段拼出不存在的词
+        text = "\n".join([klass.name, klass.class_name, teachers, klass.course_id]).lower()
+        self.texts.append(text)
+        for j in range(len(text)):
+            for gram in (text[j], text[j:j + 2]):
+                if "\n" not in gram:
+                    self.grams.setdefault(gram, set()).add(i)
+        self.masks.append(timetable_of(klass).mask)
+        for t in lesson_times(klass.time):
+            self.weekdays.setdefault(t.weekday, set()).add(i)
+            for rng in t.time:
+                for period in rng:
+                    self.periods.setdefault(period, set()).add(i)
+                    self.slots.setdefault((t.weekday, period), set()).add(i)
+
+    def _match_keyword(self, keyword: str, candidates: Optional[Set[int]]) -> Set[int]:
+        grams = [keyword] if len(keyword) == 1 else [keyword[j:j + 2] for j in range(len(keyword) - 1)]
+        postings = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+        ids = set(postings[0]) if candidates is None else candidates & postings[0]
+        for posting in postings[1:]:
+            if not ids:
+                break
+            ids &= posting
+        if len(keyword) > 2:
+            # 双字倒排只能保证每个片段都出现，还要核对整个关键词
+            ids = {i for i in ids if keyword in self.texts[i]}
+        return ids
+
+    def free(self, ids: Iterable[int], schedule: ScheduleTimetable) -> List[int]:
+        """去掉与课表冲突的班级，同一门课的已选班级不算冲突"""
+        return [i for i in ids if not self.masks[i] & schedule.busy_mask(self.classes[i].internal_course_id)]
+
+    def search(self, query: str, schedule: Optional[ScheduleTimetable] = None) -> List[SelectionClass]:
+        """schedule 不为空时只返回与课表不冲突的班级"""
+        keywords, weekday, period = parse_query(query)
+        if not keywords and weekday is None and period is None:
+            if schedule is None:
+                return self.classes
+            return [self.classes[i] for i in self.free(range(len(self.classes)), schedule)]
+
+        candidates: Optional[Set[int]] = None
+        if weekday is not None and period is not None:
+            candidates = set(self.slots.get((weekday, period), set()))
+        elif weekday is not None:
+            candidates = set(self.weekdays.get(weekday, set()))
+        elif period is not None:
+            candidates = set(self.periods.get(period, set()))
+
+        key = " ".join(keywords)
+        last_key, last_ids = self._last
+        if candidates is None and last_ids is not None and last_key and key.startswith(last_key):
+            # 边输入边搜索时，新关键词是上一次的延长，只需在上次结果里继续筛选
+            candidates = set(last_ids)
+        for keyword in keywords:
+            candidates = self._match_keyword(keyword, candidates)
+        if weekday is None and period is None:
+            self._last = (key, candidates)
+        ids = sorted(candidates)
+        if schedule is not None:
+            ids = self.free(ids, schedule)
+        return [self.classes[i] for i in ids]
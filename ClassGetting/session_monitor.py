@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Future
+from threading import Event, Lock, Thread
+from typing import Callable, Optional, Tuple
+
+from pysjtu import consts
+from pysjtu.exceptions import SessionException
+from pysjtu.session import Session
+
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+# 刚换过会话后的这段时间里再报告失效，视为用旧 cookie 发出的请求，直接用新会话重试
+RENEW_GRACE = 5
+# 重新登录失败后，这段时间内不再尝试，请求直接失败
+RETRY_BACKOFF = 10
+# 会话失效时教务系统把请求重定向到的登录页
+LOGIN_PAGE = b"/xtgl/login_slogin.html"
+
+
+class ManagedSession(Session):
+    """
+    交给 SessionMonitor 管理的 pysjtu 会话。pysjtu 发现会话过期时会在发请求的线程里各自续期、重新登录，
+    并发的任务会同时登录好几次；设置了 monitor 后改由 monitor 统一处理一次，其他线程等这次的结果再重发
+    """
+    monitor: Optional["SessionMonitor"] = None
+
+    def request(self, method: str, url, *, validate_session: bool = True, auto_renew: bool = True, **kwargs):
+        if self.monitor is None or not validate_session or not auto_renew:
+            return super().request(method, url, validate_session=validate_session, auto_renew=auto_renew, **kwargs)
+        try:
+            return super().request(method, url, auto_renew=False, **kwargs)
+        except SessionException:
+            self.monitor.renew()
+            return super().request(method, url, auto_renew=False, **kwargs)
+
+
+class SessionMonitor:
+    """
+    调度器所有任务共用的会话的健康状态：记录会话的登录时间，超过 max_age 时在后台换上新会话；
+    任何线程发现会话失效时只重新登录一次，登录期间调度器暂停发请求，换上新 cookie 后恢复。
+    standby 为真时在后台保持一个已登录的备用会话，失效时直接换上，任务只停顿复制 cookie 的时间。
+    新会话只用来取 cookie，原会话的连接池和热路径钩子不受影响
+    """
+
+    def __init__(self, session: ManagedSession, login_func: Optional[Callable[[], Session]] = None,
+                 max_age: float = 20 * 60, standby: bool = False,
+                 on_renew: Optional[Callable[[], None]] = None):
+        self.session = session
+        self.login_func = login_func or self._login
+        self.max_age = max_age
+        self.standby = standby
+        self.on_renew = on_renew
+        self.logged_in_at = time.monotonic()
+        self.renewed_at = float("-inf")
+        self.failed_at = float("-inf")
+        self._lock = Lock()
+        self._renewing: Optional[Future] = None
+        # (已登录的备用会话, 登录时刻)
+        self._standby: Optional[Tuple[Session, float]] = None
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        session.monitor = self
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.logged_in_at
+
+    def _login(self) -> Session:
+        return Session(username=self.session._username, password=self.session._password)
+
+    def renew(self):
+        """会话失效时由发请求的线程调用：同一时刻只登录一次，失败时抛出登录的异常"""
+        with self._lock:
+            owner = self._renewing is None
+            if owner:
+                now = time.monotonic()
+                if now - self.renewed_at < RENEW_GRACE:
+                    return
+                if now - self.failed_at < RETRY_BACKOFF:
+                    raise SessionException("重新登录刚失败过，稍后再试")
+                self._renewing = Future()
+            future = self._renewing
+        if owner:
+            self._renew(future)
+        future.result()
+
+    def _renew(self, future: Future):
+        start = time.perf_counter()
+        try:
+            if self._refresh():
+                METRICS.inc("session_renewals_total", reason="token", result="ok")
+                self.renewed_at = time.monotonic()
+            else:
+                fresh = self._take_standby()
+                if fresh is None:
+                    fresh = self.login_func()
+                self._install(fresh, "expired")
+        except Exception as e:
+            log.error("重新登录失败：%r", e)
+            self.failed_at = time.monotonic()
+            METRICS.inc("session_renewals_total", reason="expired", result="failed")
+            future.set_exception(e)
+        else:
+            log.info("会话已失效，重新登录用时 %.0fms", (time.perf_counter() - start) * 1000)
+            future.set_result(None)
+        finally:
+            METRICS.observe("session_pause_seconds", time.perf_counter() - start)
+            with self._lock:
+                self._renewing = None
+
+    def _refresh(self) -> bool:
+        """与 pysjtu 自动续期的第一步相同：jAccount 的令牌还没过期时，访问一次登录入口就能换到新会话，不用输密码"""
+        self.session.get(consts.LOGIN_URL, validate_session=False)
+        return self._valid(self.session)
+
+    @staticmethod
+    def _valid(session: Session) -> bool:
+        return session.get(consts.HOME_URL, validate_session=False).url.raw_path != LOGIN_PAGE
+
+    def _take_standby(self) -> Optional[Session]:
+        """取出备用会话；太旧或者已经失效（多花一个请求检查）时丢掉，返回 None"""
+        with self._lock:
+            standby, self._standby = self._standby, None
+        if standby is None:
+            return None
+        session, logged_in_at = standby
+        if time.monotonic() - logged_in_at <= self.max_age and self._valid(session):
+            return session
+        session._client.close()
+        return None
+
+    def _install(self, fresh: Session, reason: str):
+        # 只换 cookie，保留原会话的连接池、事件钩子和缓存的学号
+        self.session._client.cookies = fresh._client.cookies
+        fresh._client.close()
+        METRICS.observe("session_age_seconds", self.age)
+        METRICS.inc("session_renewals_total", reason=reason, result="ok")
+        self.logged_in_at = self.renewed_at = time.monotonic()
+        if self.on_renew is not None:
+            self.on_renew()
+
+    async def settled(self):
+        """正在重新登录时等它结束（不管成败）。调度器发请求前调用，登录期间不再用失效的会话发请求"""
+        future = self._renewing
+        if future is not None:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                pass
+
+    def settled_blocking(self):
+        """同 settled，给在工作线程里发请求的地方用（例如课表缓存的拉取）"""
+        future = self._renewing
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass
+
+    def start(self, interval: float = 30):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._loop, args=(interval,), name="session-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            standby, self._standby = self._standby, None
+        if standby is not None:
+            standby[0]._client.close()
+
+    def _loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.check()
+            except Exception as e:
+                log.warning("后台登录失败：%r", e)
+
+    def check(self):
+        """会话快到 max_age 时提前换上新会话，不暂停任务；需要时补上备用会话"""
+        if self.age > self.max_age and self._renewing is None:
+            age = self.age
+            fresh = self._take_standby() or self.login_func()
+            with self._lock:
+                if self._renewing is None:
+                    self._install(fresh, "age")
+                    log.info("会话已登录 %.0f 分钟，换上了新会话", age / 60)
+                    fresh = None
+            if fresh is not None:
+                fresh._client.close()
+        if self.standby:
+            with self._lock:
+                stale = self._standby is None or time.monotonic() - self._standby[1] > self.max_age / 2
+            if stale:
+                fresh = self.login_func()
+                with self._lock:
+                    old, self._standby = self._standby, (fresh, time.monotonic())
+                if old is not None:
+                    old[0]._client.close()
@@ -0,0 +1,135 @@
+import logging
+from threading import Event
+from typing import Callable, Dict, Optional
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+log = logging.getLogger(__name__)
+
+
+class TaskCancelled(Exception):
+    """任务已被取消（例如快速切换分区时旧的加载任务）"""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    progress = pyqtSignal(str)
+    done = pyqtSignal()
+
+
+class Task(QRunnable):
+    """
+    在线程池里执行 fn(task)。fn 可以调用 task.progress() 汇报进度、
+    task.token.raise_if_cancelled() 在步骤之间响应取消；结果通过 Qt 信号回到 GUI 线程
+    """
+
+    def __init__(self, fn: Callable[["Task"], object]):
+        super().__init__()
+        self.fn = fn
+        self.token = CancelToken()
+        self.signals = TaskSignals()
+        self.setAutoDelete(False)
+
+    def progress(self, text: str):
+        if not self.token.cancelled:
+            self.signals.progress.emit(text)
+
+    def cancel(self):
+        self.token.cancel()
+
+    def run(self):
+        try:
+            result = self.fn(self)
+            if not self.token.cancelled:
+                self._emit(self.signals.finished, result)
+        except TaskCancelled:
+            pass
+        except Exception as e:
+            if not self.token.cancelled:
+                self._emit(self.signals.failed, e)
+        finally:
+            self._emit(self.signals.done)
+
+    @staticmethod
+    def _emit(signal, *args):
+        try:
+            signal.emit(*args)
+        except RuntimeError:
+            # 退出时超过等待时间仍在执行的任务，结束时信号对象可能已被 Qt 销毁
+            pass
+
+
+class TaskRunner(QObject):
+    """
+    登录、分区加载、班级列表、课表等阻塞请求统一交给这里执行，GUI 线程只处理回调。
+    同一 group 里只保留最新的任务，新任务提交时旧任务被取消、结果被丢弃
+    """
+    progress = pyqtSignal(str)
+
+    def __init__(self, max_threads: int = 4, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.groups: Dict[str, Task] = dict()
+        self.running = set()
+
+    def run(self, fn: Callable[[Task], object], on_done: Optional[Callable[[object], None]] = None,
+            on_error: Optional[Callable[[Exception], None]] = None, group: Optional[str] = None) -> Task:
+        task = Task(fn)
+        if group is not None:
+            self.cancel(group)
+            self.groups[group] = task
+        task.signals.progress.connect(self.progress)
+        task.signals.finished.connect(lambda result: self._finish(task, group, on_done, result))
+        task.signals.failed.connect(lambda e: self._finish(task, group, on_error or self.report, e))
+        # 任务结束前保持引用，避免线程池还在执行时被回收
+        task.signals.done.connect(lambda: self.running.discard(task))
+        self.running.add(task)
+        self.pool.start(task)
+        return task
+
+    def cancel(self, group: str):
+        task = self.groups.pop(group, None)
+        if task is not None:
+            task.cancel()
+
+    def cancel_all(self):
+        for group in list(self.groups):
+            self.cancel(group)
+        for task in self.running:
+            task.cancel()
+
+    def shutdown(self, timeout: float = 3) -> bool:
+        """退出时取消所有任务，最多等 timeout 秒让它们结束；超时返回 False，剩下的任务结果会被丢弃"""
+        self.cancel_all()
+        done = self.pool.waitForDone(int(timeout * 1000))
+        if not done:
+            log.warning("仍有后台任务未结束，不再等待")
+        return done
+
+    @staticmethod
+    def report(e: Exception):
+        log.error("后台任务失败：%r", e)
+
+    def _finish(self, task: Task, group: Optional[str], callback, value):
+        if group is not None and self.groups.get(group) is task:
+            del self.groups[group]
+        if not task.token.cancelled and callback is not None:
+            callback(value)
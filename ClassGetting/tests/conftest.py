@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# 模块都平铺在 ClassGetting/ 下，按脚本方式互相导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timetable  # noqa: E402
+from fake_server import FakeSelectionServer, create_client  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clear_timetables():
+    # 班级时间表按 class_id 缓存在进程里，各测试的模拟服务会复用同样的 class_id
+    timetable._timetables.clear()
+
+
+@pytest.fixture
+def server():
+    server = FakeSelectionServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def cli(server):
+    return create_client(server)
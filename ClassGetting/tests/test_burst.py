@@ -0,0 +1,64 @@
+import time
+
+from burst import BurstPlan, ClockSync
+from scheduler import GrabScheduler, SelectJob
+
+
+def test_clock_sync_error_bounds_the_real_offset(server, cli):
+    server.clock_offset, server.latency = 1.37, 0.01
+    sync = ClockSync(lambda: cli._session._client.head("/").headers["Date"])
+    sync.sync()
+    assert sync.samples > 1
+    # 服务器在处理完请求后才生成 Date，真实偏差比往返中点的估计小，差值不超过单程耗时
+    assert abs(sync.offset - server.clock_offset) <= sync.error + sync.rtt / 2 + 0.01
+    assert sync.error < 0.05
+
+
+def test_burst_lands_after_opening(server, cli):
+    server.clock_offset, server.latency = -2.21, 0.02
+    # 一直满员，集中发送的请求全部落空
+    server.add_class("full", planned=0)
+    klass = cli.course_selection_sectors[0].classes[0]
+    sync = ClockSync(lambda: cli._session._client.head("/").headers["Date"])
+    sync.sync()
+    server.open_at = server.now() + 1
+    # 只看集中发送的请求，不做之后的退避重试
+    plan = BurstPlan.from_sync(server.open_at, sync, backoff=1, max_backoff=0)
+
+    scheduler = GrabScheduler(concurrency=4, request_budget=100)
+    scheduler.cli, scheduler.burst = cli, plan
+    scheduler.start()
+    scheduler.submit("full", SelectJob(klass))
+    deadline = time.monotonic() + 10
+    while len(server.register_log) < plan.count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    scheduler.shutdown()
+
+    landed = [t - server.open_at for t, _, _ in server.register_log]
+    assert len(landed) == plan.count
+    assert sum(t >= 0 for t in landed) == len(landed)
+    assert min(landed) < 0.1
+
+
+def test_bursts_of_several_jobs_do_not_queue_on_the_shared_budget(server, cli):
+    server.add_class("a", planned=0)
+    server.add_class("b", planned=0)
+    classes = cli.course_selection_sectors[0].classes
+    server.open_at = server.now() + 1
+    plan = BurstPlan(server.open_at, backoff=1, max_backoff=0)
+
+    # 账号共用的限流器每秒只有 1 个请求
+    scheduler = GrabScheduler(concurrency=4, request_budget=1)
+    scheduler.cli, scheduler.burst = cli, plan
+    scheduler.start()
+    for klass in classes:
+        scheduler.submit(klass.class_id, SelectJob(klass))
+    deadline = time.monotonic() + 10
+    while len(server.register_log) < plan.count * 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    scheduler.shutdown()
+
+    landed = [t - server.open_at for t, _, _ in server.register_log]
+    assert len(landed) == plan.count * 2
+    # 两个任务的集中请求都在 count * spacing 的窗口里发完
+    assert max(landed) < plan.count * plan.spacing + 0.3
@@ -0,0 +1,41 @@
+import pytest
+
+from capacity import MIN_SPAN, CapacityHistory, CapacityRecorder
+
+
+def test_history_wraps_around():
+    history = CapacityHistory(size=4)
+    for t in range(6):
+        history.append(float(t), 30 - t, 30)
+    assert [sample[0] for sample in history.samples()] == [2, 3, 4, 5]
+    assert history.samples(since=4) == [(4, 26, 30), (5, 25, 30)]
+    # 退课记录同样只保留最近 size 条
+    assert list(history.drops) == [(2, 1), (3, 1), (4, 1), (5, 1)]
+
+
+def test_drop_rate_needs_enough_observation():
+    recorder = CapacityRecorder()
+    now = recorder.now()
+    recorder.record("a", 30, 30, t=now - MIN_SPAN / 2)
+    assert recorder.drop_rate("a") is None
+    assert recorder.drop_rate("unknown") is None
+
+
+def test_drop_rate_counts_drops_in_the_window():
+    recorder = CapacityRecorder()
+    now = recorder.now()
+    recorder.record("a", 30, 30, t=now - 100)
+    recorder.record("a", 27, 30, t=now - 90)
+    recorder.record("a", 30, 30, t=now - 50)
+    recorder.record("a", 29, 30, t=now - 10)
+    assert recorder.drop_rate("a") == pytest.approx(4 / 100, rel=0.01)
+    # 只看最近 60 秒
+    assert recorder.drop_rate("a", window=60) == pytest.approx(1 / 60, rel=0.01)
+
+
+def test_sparkline_marks_free_seats():
+    recorder = CapacityRecorder()
+    for registered in (30, 30, 28, 30):
+        recorder.record("a", registered, 30)
+    assert recorder.sparkline("a", width=4) == "▁▁█▁"
+    assert recorder.sparkline("unknown") == ""
@@ -0,0 +1,21 @@
+from pysjtu import consts
+
+from catalog import CatalogCache
+from fake_server import _path, create_client
+
+
+def test_register_id_is_not_cached_and_loads_lazily(server, cli, tmp_path):
+    server.add_class("a", planned=30, registered=10)
+    sectors = cli.course_selection_sectors
+    cache = CatalogCache(1, directory=str(tmp_path))
+    cache.save_sectors(sectors)
+    cache.save_classes(sectors[0], sectors[0].classes)
+
+    # 重启后从缓存恢复
+    restored = CatalogCache(1, directory=str(tmp_path)).load(create_client(server))
+    klass = restored.classes["通识课"][0]
+    assert (klass.class_id, klass.students_planned, klass.students_registered) == ("a", 30, 10)
+    before = len(server.request_log)
+    assert klass.register_id == "a"
+    # register_id 是第一次用到时向服务器取的
+    assert _path(consts.SELECTION_QUERY_CLASSES) in [path for _, path, _ in server.request_log[before:]]
@@ -0,0 +1,22 @@
+import time
+
+import pytest
+
+from engine import AccountSession, JobSpec
+from fake_server import create_client
+
+
+def test_second_job_for_the_same_course_is_rejected(server):
+    server.add_class("a1", planned=30, registered=30, course_id="MA001")
+    server.add_class("a2", planned=30, registered=30, course_id="MA001", weekday=3)
+    session = AccountSession("alice", "", login_func=lambda *args: create_client(server))
+    session.login(hot_path=False)
+    try:
+        session.submit(JobSpec("alice", "通识课", "a1"))
+        # 任务按分区和课程区分，同一门课的另一个班级不能再单独提交
+        with pytest.raises(ValueError):
+            session.submit(JobSpec("alice", "通识课", "a2"))
+        time.sleep(0.1)
+        assert session.scheduler.pending() == ["通识课-kMA001"]
+    finally:
+        session.stop()
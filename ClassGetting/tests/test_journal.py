@@ -0,0 +1,127 @@
+import time
+from types import SimpleNamespace
+
+from journal import JobJournal, _decode
+from scheduler import GrabScheduler, GroupJob, SelectJob
+
+SPEC = {"mode": "group", "sector": "通识课", "class_ids": ["b0", "b1"], "upgrade": True}
+
+
+def lines(path):
+    with open(path, "rb") as f:
+        return f.readlines()
+
+
+def test_replay_keeps_pending_jobs_with_their_attempts(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.jsonl"))
+    journal.submit("PE001", SPEC)
+    journal.submit("MA001", {"mode": "select", "sector": "通识课", "class_ids": ["m0"]})
+    journal.submit("EN001", {"mode": "select", "sector": "通识课", "class_ids": ["e0"]})
+    journal.attempt("PE001", "register", "FullCapacityException")
+    journal.attempt("PE001", "register", "FullCapacityException")
+    journal.attempt("PE001", "drop", "ok")
+    journal.finish("MA001", "seated", "m0")
+    journal.cancel("EN001")
+    journal.close()
+
+    pending = JobJournal(journal.path).replay()
+    assert list(pending) == ["PE001"]
+    assert pending["PE001"]["spec"] == SPEC
+    assert pending["PE001"]["attempts"] == 3
+    assert pending["PE001"]["results"] == {"FullCapacityException": 2, "ok": 1}
+
+
+def test_resubmit_keeps_attempts_but_cancel_resets(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.jsonl"))
+    journal.submit("PE001", SPEC)
+    journal.attempt("PE001", "register", "FullCapacityException")
+    # 候选班级变化时同一个 key 重新提交
+    journal.submit("PE001", dict(SPEC, class_ids=["b1"]))
+    journal.attempt("PE001", "register", "FullCapacityException")
+    journal.close()
+    pending = JobJournal(journal.path).replay()
+    assert pending["PE001"]["attempts"] == 2
+    assert pending["PE001"]["spec"]["class_ids"] == ["b1"]
+
+    journal.cancel("PE001")
+    journal.submit("PE001", SPEC)
+    journal.close()
+    assert JobJournal(journal.path).replay()["PE001"]["attempts"] == 0
+
+
+def test_compaction_survives_another_replay(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.jsonl"))
+    journal.submit("PE001", SPEC)
+    for _ in range(5):
+        journal.attempt("PE001", "register", "FullCapacityException")
+    journal.submit("MA001", {"mode": "select", "sector": "通识课", "class_ids": ["m0"]})
+    journal.finish("MA001", "seated", "m0")
+    journal.close()
+
+    first = JobJournal(journal.path).replay()
+    # 压缩后每个未结束的任务只剩一行
+    assert len(lines(journal.path)) == 1
+    compacted = JobJournal(journal.path)
+    compacted.attempt("PE001", "register", "ok")
+    compacted.close()
+    second = JobJournal(journal.path).replay()
+    assert second["PE001"]["spec"] == first["PE001"]["spec"] == SPEC
+    assert second["PE001"]["attempts"] == 6
+    assert second["PE001"]["results"] == {"FullCapacityException": 5, "ok": 1}
+
+
+def test_corrupted_tail_is_skipped(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.jsonl"))
+    journal.submit("PE001", SPEC)
+    journal.attempt("PE001", "register", "FullCapacityException")
+    journal.finish("PE001", "seated", "b0")
+    journal.close()
+    data = lines(journal.path)
+    # 最后一条（结束）写坏了一个字节：CRC 不符，整行跳过，任务仍然未结束
+    data[-1] = data[-1].replace(b"seated", b"seatex")
+    # 另外还有一行只写了一半
+    data.append(b"0badc0de {\"event\":\"sub")
+    with open(journal.path, "wb") as f:
+        f.writelines(data)
+    assert _decode(data[-2]) is None
+
+    pending = JobJournal(journal.path).replay()
+    assert pending["PE001"]["attempts"] == 1
+    # 压缩时损坏的行被丢掉
+    assert all(_decode(line) is not None for line in lines(journal.path))
+
+
+def test_replaced_job_keeps_its_attempts_in_the_journal(server, cli, tmp_path):
+    for i in range(2):
+        server.add_class(f"b{i}", planned=30, registered=30, course_id="PE001", weekday=i + 1)
+    b0, b1 = cli.course_selection_sectors[0].classes
+    journal = JobJournal(str(tmp_path / "jobs.jsonl"))
+    scheduler = GrabScheduler(request_budget=100)
+    scheduler.cli, scheduler.journal = cli, journal
+    scheduler.start()
+    try:
+        scheduler.submit("PE001", GroupJob([b0, b1], upgrade=True))
+        journal.attempt("PE001", "register", "FullCapacityException")
+        # 去掉一个候选：替换任务，不记取消
+        scheduler.submit("PE001", SelectJob(b1), replace=True)
+        time.sleep(0.2)
+        assert scheduler.pending() == ["PE001"]
+    finally:
+        scheduler.shutdown()
+        journal.close()
+    events = [_decode(line)["event"] for line in lines(journal.path)]
+    assert "cancel" not in events
+    pending = JobJournal(journal.path).replay()
+    assert pending["PE001"]["attempts"] == 1
+    assert pending["PE001"]["spec"]["class_ids"] == ["b1"]
+
+
+def test_jobs_without_a_sector_are_not_journaled(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.jsonl"))
+    scheduler = GrabScheduler()
+    scheduler.journal = journal
+    course = SimpleNamespace(name="class-0", class_id="class-0", register_id="class-0")
+    scheduler.submit("class-0", SelectJob(course))
+    scheduler.shutdown()
+    journal.close()
+    assert JobJournal(journal.path).replay() == {}
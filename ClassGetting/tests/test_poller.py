@@ -0,0 +1,154 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from pysjtu import consts
+
+from fake_server import _path
+from poller import CapacityPoller, fresh_classes
+from ratelimit import AdaptiveInterval
+from scheduler import GrabScheduler, SelectJob
+
+
+class StubScheduler:
+    """只提供轮询器用到的部分；拉取班级列表的请求一直挂起，不会产生 tick"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.poller = CapacityPoller(self)
+
+    async def request(self, func, *args, **kwargs):
+        await asyncio.Event().wait()
+
+
+def full_class(class_id="full"):
+    return SimpleNamespace(class_id=class_id, sector=SimpleNamespace(name="通识课"))
+
+
+async def waiting(scheduler, job, klass):
+    """让 job 开始等待 klass 的余量，返回等待中的任务"""
+    task = asyncio.ensure_future(job.wait_for_seat(scheduler, klass))
+    await asyncio.sleep(0)
+    assert scheduler.poller.intervals
+    return task
+
+
+def test_adaptive_interval_follows_seat_changes():
+    pacing = AdaptiveInterval(fast=0.5, base=1, slow=5, moving=10, quiet=60)
+    pacing.started = 0
+    assert pacing.poll_interval(None, now=30) == 1
+    # 一直满员超过 quiet 秒放慢，余量刚变化过加快，变化过去 moving 秒后回到 base
+    assert pacing.poll_interval(None, now=61) == 5
+    assert pacing.poll_interval(55, now=61) == 0.5
+    assert pacing.poll_interval(40, now=61) == 1
+    assert pacing.poll_interval(40, now=101) == 5
+
+
+def test_waiting_job_interval_is_recomputed_every_tick():
+    async def main():
+        scheduler = StubScheduler(asyncio.get_running_loop())
+        poller, klass = scheduler.poller, full_class()
+        job = SelectJob(klass)
+        job.pacing = AdaptiveInterval(fast=0.5, base=1, slow=5, moving=10, quiet=60)
+        task = await waiting(scheduler, job, klass)
+        assert poller.next_interval() == 1
+        # 等待期间长时间没有变化：下一个 tick 放慢
+        job.pacing.started -= 100
+        assert poller.next_interval() == 5
+        # 等待期间余量变了：下一个 tick 加快
+        poller.last_change[klass.class_id] = time.monotonic()
+        assert poller.next_interval() == 0.5
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert not poller.intervals
+        assert poller.next_interval() == poller.interval
+
+    asyncio.run(main())
+
+
+def test_drop_rate_sets_the_interval():
+    pacing = AdaptiveInterval(fast=0.05, base=1, slow=2, moving=10, quiet=60, target=0.1)
+    pacing.started = 0
+    # 每秒 0.5 次退课：两次轮询之间平均出现 target 个空位
+    assert pacing.poll_interval(None, 0.5, now=30) == pytest.approx(0.2)
+    # 限制在 fast 到 slow 之间，余量刚变化过仍按 fast
+    assert pacing.poll_interval(None, 100, now=30) == 0.05
+    assert pacing.poll_interval(None, 0.001, now=30) == 2
+    assert pacing.poll_interval(25, 0.001, now=30) == 0.05
+    # 观测期间没有退课时不按频率算
+    assert pacing.poll_interval(None, 0, now=30) == 1
+
+
+def test_drop_rate_shortens_the_interval_of_a_waiting_job():
+    async def main():
+        scheduler = StubScheduler(asyncio.get_running_loop())
+        recorder, klass = scheduler.poller.recorder, full_class()
+        # 已经观测了一分钟，其间没有人退课
+        recorder.record("full", 30, 30, t=recorder.now() - 60)
+        job = SelectJob(klass)
+        job.pacing = AdaptiveInterval(fast=0.05, base=1, slow=2, moving=10, quiet=100, target=0.1)
+        task = await waiting(scheduler, job, klass)
+        assert scheduler.poller.next_interval() == 1
+        # 等待期间观测到这一分钟里退了 30 次课：每秒 0.5 次，下一个 tick 缩短到 target / 0.5
+        now = recorder.now()
+        for k in range(30):
+            recorder.record("full", 29, 30, t=now - 59 + k)
+            recorder.record("full", 30, 30, t=now - 58.5 + k)
+        assert scheduler.poller.next_interval() == pytest.approx(0.2, rel=0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_one_request_per_sector_per_tick_wakes_only_classes_with_seats(server, cli):
+    server.add_class("a", planned=30, registered=30)
+    b = server.add_class("b", planned=30, registered=30)
+    server.add_class("d", planned=30, registered=30, sector="体育")
+    classes = {klass.class_id: klass for sector in cli.course_selection_sectors for klass in sector.classes}
+    scheduler = GrabScheduler(request_budget=100)
+    scheduler.cli = cli
+    poller = scheduler.poller
+    ticks = []
+    next_tick = poller.next_interval
+
+    def counted():
+        ticks.append(time.monotonic())
+        return next_tick()
+
+    poller.next_interval = counted
+    before = len(server.request_log)
+    scheduler.start()
+    waiting = {class_id: asyncio.run_coroutine_threadsafe(poller.wait_for_seat(classes[class_id], lambda: 0.05),
+                                                          scheduler.loop)
+               for class_id in ("a", "b", "d")}
+    try:
+        time.sleep(0.5)
+        with server.lock:
+            b.registered -= 1
+        assert waiting["b"].result(2).class_id == "b"
+        time.sleep(0.2)
+        assert not waiting["a"].done() and not waiting["d"].done()
+        for future in waiting.values():
+            future.cancel()
+        time.sleep(0.1)
+    finally:
+        scheduler.shutdown()
+    queries = [form["xkkz_id"] for _, path, form in server.request_log[before:]
+               if path == _path(consts.SELECTION_QUERY_COURSES)]
+    # 每个 tick 每个分区只拉取一次班级列表，同一分区的 a、b 共用
+    assert len(ticks) >= 5
+    for sector in ("通识课", "体育"):
+        assert len(ticks) - 1 <= queries.count(sector) <= len(ticks)
+
+
+def test_fresh_classes_bypasses_the_class_list_cache(server, cli):
+    klass = server.add_class("a", planned=30, registered=10)
+    sector = cli.course_selection_sectors[0]
+    assert sector.classes[0].students_registered == 10
+    with server.lock:
+        klass.registered = 12
+    # pysjtu 缓存了分区的班级列表
+    assert sector.classes[0].students_registered == 10
+    assert fresh_classes(cli, sector)[0].students_registered == 12
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+from ratelimit import AdaptiveInterval, TokenBucket
+
+
+def test_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(rate=10, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    # 预支的令牌按顺序排队：第 4、5 个请求分别等 1、2 个令牌的时间
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(rate=20, capacity=2)
+    bucket.reserve(), bucket.reserve()
+    time.sleep(0.2)
+    # 0.2 秒能补 4 个令牌，但最多存 capacity 个
+    assert [bucket.reserve() for _ in range(2)] == [0, 0]
+    assert bucket.reserve() > 0
+
+
+def test_bucket_limits_concurrent_acquirers():
+    bucket = TokenBucket(rate=50, capacity=1)
+
+    async def main():
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(11)))
+        return time.monotonic() - start
+
+    # 第一个令牌现成，其余 10 个按每秒 50 个补充
+    assert asyncio.run(main()) == pytest.approx(0.2, abs=0.05)
+
+
+def test_interval_follows_capacity_changes():
+    pacing = AdaptiveInterval(fast=0.5, base=1, slow=5, moving=10, quiet=60)
+    now = time.monotonic()
+    assert pacing.poll_interval(None) == 1
+    assert pacing.poll_interval(now - 1) == 0.5
+    assert pacing.poll_interval(now - 30) == 1
+    assert pacing.poll_interval(now - 120) == 5
+    pacing.started -= 120
+    assert pacing.poll_interval(None) == 5
+
+
+def test_interval_from_drop_rate_is_clamped():
+    pacing = AdaptiveInterval(fast=0.5, base=1, slow=5, target=0.1)
+    assert pacing.poll_interval(None, drop_rate=0.05) == 2
+    assert pacing.poll_interval(None, drop_rate=10) == 0.5
+    assert pacing.poll_interval(None, drop_rate=0.001) == 5
+    # 余量刚变过时不看历史频率
+    assert pacing.poll_interval(time.monotonic(), drop_rate=0.001) == 0.5
+
+
+def test_error_backoff_grows_and_resets():
+    pacing = AdaptiveInterval(base=1, max_backoff=8)
+    delays = [pacing.on_error() for _ in range(5)]
+    assert 1 <= delays[0] <= 2
+    assert 4 <= delays[2] <= 8
+    assert delays[4] <= 8
+    pacing.on_success()
+    assert pacing.on_error() <= 2
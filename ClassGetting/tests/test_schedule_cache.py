@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+from schedule_cache import ScheduleCache
+
+
+def counting_fetch(cli, gate: Event = None):
+    calls = []
+
+    def fetch(year, term):
+        calls.append((year, term))
+        if gate is not None:
+            gate.wait(5)
+        return cli.schedule(year, term)
+
+    return fetch, calls
+
+
+def test_hit_within_ttl_and_refetch_after(cli, server):
+    server.add_class("a", planned=2)
+    server.enroll("a")
+    fetch, calls = counting_fetch(cli)
+    cache = ScheduleCache(fetch, ttl=0.2)
+    assert cache.get(2025, 0).has_class("a")
+    assert cache.get(2025, 0).has_class("a")
+    assert len(calls) == 1
+    time.sleep(0.25)
+    cache.get(2025, 0)
+    assert len(calls) == 2
+
+
+def test_terms_are_cached_separately(cli, server):
+    fetch, calls = counting_fetch(cli)
+    cache = ScheduleCache(fetch, ttl=60)
+    cache.get(2025, 0)
+    cache.get(2025, 1)
+    cache.get(2025, 0)
+    assert calls == [(2025, 0), (2025, 1)]
+
+
+def test_concurrent_reads_share_one_fetch(cli, server):
+    server.add_class("a", planned=2)
+    server.enroll("a")
+    gate = Event()
+    fetch, calls = counting_fetch(cli, gate)
+    cache = ScheduleCache(fetch, ttl=60)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(cache.get, 2025, 0) for _ in range(8)]
+        time.sleep(0.1)
+        gate.set()
+        results = [future.result(5) for future in futures]
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_failed_fetch_is_shared_and_not_cached(cli, server):
+    gate = Event()
+    failures = []
+
+    def fetch(year, term):
+        if not failures:
+            failures.append(1)
+            gate.wait(5)
+            raise ConnectionError("boom")
+        return cli.schedule(year, term)
+
+    cache = ScheduleCache(fetch, ttl=60)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(cache.get, 2025, 0)
+        time.sleep(0.05)
+        second = executor.submit(cache.get, 2025, 0)
+        time.sleep(0.05)
+        gate.set()
+        for future in (first, second):
+            assert isinstance(future.exception(5), ConnectionError)
+    assert list(cache.get(2025, 0)) == []
+
+
+def test_invalidate_forces_refetch(cli, server):
+    server.add_class("a", planned=2)
+    fetch, calls = counting_fetch(cli)
+    cache = ScheduleCache(fetch, ttl=60)
+    assert not cache.get(2025, 0).has_class("a")
+    server.enroll("a")
+    assert not cache.get(2025, 0).has_class("a")
+    cache.invalidate()
+    assert cache.get(2025, 0).has_class("a")
+    assert len(calls) == 2
+
+
+def test_fetch_started_before_invalidate_is_not_cached(cli, server):
+    gate = Event()
+    fetch, calls = counting_fetch(cli, gate)
+    cache = ScheduleCache(fetch, ttl=60)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        stale = executor.submit(cache.get, 2025, 0)
+        time.sleep(0.05)
+        # 拉取期间选上了班级
+        server.add_class("a", planned=2)
+        cache.invalidate()
+        gate.set()
+        stale.result(5)
+    cache.get(2025, 0)
+    assert len(calls) == 2
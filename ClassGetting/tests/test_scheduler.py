@@ -0,0 +1,439 @@
+import asyncio
+import time
+from threading import Event
+from types import SimpleNamespace
+
+import pytest
+from pysjtu.exceptions import FullCapacityException, TimeConflictException
+
+from burst import BurstPlan
+from ratelimit import AdaptiveInterval
+from scheduler import GrabJob, GrabScheduler, GroupJob, SelectJob, SwitchJob
+
+
+class StubScheduler:
+    """只提供换班用到的部分，选课、退课请求仍走 GrabScheduler.measured 的临界区"""
+    measured = GrabScheduler.measured
+
+    def __init__(self):
+        self.journal = None
+        self.switch_gaps = []
+        schedule = SimpleNamespace(has_class=lambda class_id: True)
+        self.schedule_cache = SimpleNamespace(get=lambda year, term: schedule, invalidate=lambda: None)
+
+        async def check(klass, max_age):
+            return klass
+
+        self.poller = SimpleNamespace(latest={}, check=check)
+
+    async def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    async def request(self, func, *args, limiter=None, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+def make_class(class_id, calls, register=None, drop=None):
+    def default(action):
+        def call():
+            calls.append(action)
+        return call
+    return SimpleNamespace(class_id=class_id, name="高数", class_name=class_id, sector=None,
+                           register=register or default("register_" + class_id),
+                           drop=drop or default("drop_" + class_id))
+
+
+def switch_classes(calls, new_full=False, drop_delay=0.0):
+    def drop():
+        time.sleep(drop_delay)
+        calls.append("drop_old")
+
+    def register_new():
+        calls.append("register_new")
+        if new_full:
+            raise FullCapacityException("已满")
+
+    return make_class("old", calls, drop=drop), make_class("new", calls, register=register_new)
+
+
+async def cancel_during(job, coro, delay):
+    job.task = asyncio.ensure_future(coro)
+    await asyncio.sleep(delay)
+    job.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await job.task
+
+
+def test_cancel_during_drop_restores_old_class():
+    calls = []
+    old, new = switch_classes(calls, new_full=True, drop_delay=0.1)
+    job = SwitchJob(old, new)
+    job.pacing.on_error = lambda: 0
+    asyncio.run(cancel_during(job, job.attempt(StubScheduler(), new), 0.03))
+    assert calls[0] == "drop_old"
+    assert calls[1:-1] == ["register_new"] * job.register_attempts
+    assert calls[-1] == "register_old"
+
+
+def test_cancel_during_drop_still_registers_new_class():
+    calls = []
+    old, new = switch_classes(calls, drop_delay=0.1)
+    job = SwitchJob(old, new)
+
+    async def main():
+        job.task = asyncio.ensure_future(job.attempt(StubScheduler(), new))
+        await asyncio.sleep(0.03)
+        job.cancel()
+        # 退课已经发出：推迟的取消在切换完成、任务返回后才生效
+        return await asyncio.gather(job.task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert calls == ["drop_old", "register_new"]
+
+
+def test_lost_race_polls_at_the_normal_interval():
+    calls = []
+    old, new = switch_classes(calls, new_full=True)
+    job = SwitchJob(old, new)
+    job.pacing.errors = 3
+    started = time.monotonic()
+    assert asyncio.run(job.attempt(StubScheduler(), new)) is False
+    # 空位被抢走、原班级已选回：不退避，之前累积的出错次数也清零
+    assert time.monotonic() - started < 0.5
+    assert job.pacing.errors == 0
+    assert calls == ["drop_old"] + ["register_new"] * job.register_attempts + ["register_old"]
+
+
+def test_failed_restore_backs_off():
+    calls = []
+
+    def restore_fails():
+        calls.append("register_old")
+        raise ConnectionError("恢复请求失败")
+
+    _, new = switch_classes(calls, new_full=True)
+    old = make_class("old", calls, register=restore_fails)
+    job = SwitchJob(old, new)
+    delays = []
+    on_error = job.pacing.on_error
+    job.pacing.on_error = lambda: delays.append(on_error()) or 0
+    assert asyncio.run(job.attempt(StubScheduler(), new)) is False
+    assert calls.count("register_old") == job.restore_attempts
+    assert len(delays) == 1 and job.pacing.errors == 1
+
+
+def test_time_conflict_rejects_the_switch_without_retrying():
+    calls = []
+
+    def conflict():
+        calls.append("register_new")
+        raise TimeConflictException
+
+    old, _ = switch_classes(calls)
+    new = make_class("new", calls, register=conflict)
+    job = SwitchJob(old, new)
+    job.pacing.on_error = lambda: 0
+    assert asyncio.run(job.attempt(StubScheduler(), new)) is False
+    assert calls == ["drop_old", "register_new", "register_old"]
+    assert isinstance(job.rejected, TimeConflictException)
+
+
+def sector_classes(cli):
+    return {klass.class_id: klass for klass in cli.course_selection_sectors[0].classes}
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def start_scheduler(cli):
+    finished = []
+    scheduler = GrabScheduler(request_budget=100, poll_interval=0.05, on_finish=finished.append)
+    scheduler.cli = cli
+    scheduler.start()
+    return scheduler, finished
+
+
+def add_switch_pair(server):
+    server.add_class("old", planned=30, registered=30, course_id="MA001", weekday=1)
+    new = server.add_class("new", planned=30, registered=30, course_id="MA001", weekday=3)
+    server.enroll("old")
+    return new
+
+
+def test_switch_moves_to_the_new_class_when_a_seat_opens(server, cli):
+    new = add_switch_pair(server)
+    classes = sector_classes(cli)
+    scheduler, finished = start_scheduler(cli)
+    job = SwitchJob(classes["old"], classes["new"])
+    try:
+        scheduler.submit("MA001", job)
+        time.sleep(0.2)
+        assert server.drop_log == []
+        with server.lock:
+            new.registered -= 1
+        assert wait_until(lambda: finished)
+    finally:
+        scheduler.shutdown()
+    assert server.registered == {"new"}
+    assert [class_id for _, class_id in server.drop_log] == ["old"]
+    assert len(job.gaps) == 1 and job.gaps[0] < 1
+
+
+def test_switch_restores_the_old_class_when_the_seat_is_taken(server, cli):
+    new = add_switch_pair(server)
+    classes = sector_classes(cli)
+    drop = server.drop
+
+    def drop_then_fill(class_id):
+        # 退课的同时别人抢走了新班级的空位
+        result = drop(class_id)
+        with server.lock:
+            new.registered = new.planned
+        return result
+
+    server.drop = drop_then_fill
+    scheduler, finished = start_scheduler(cli)
+    job = SwitchJob(classes["old"], classes["new"])
+    try:
+        scheduler.submit("MA001", job)
+        time.sleep(0.2)
+        with server.lock:
+            new.registered -= 1
+        assert wait_until(lambda: len(server.drop_log) == 1 and server.registered)
+        time.sleep(0.2)
+    finally:
+        scheduler.shutdown()
+    assert server.registered == {"old"}
+    assert [class_id for _, class_id, flag in server.register_log] == ["new"] * job.register_attempts + ["old"]
+    assert not finished
+    assert len(job.gaps) == 1
+
+
+def test_switch_without_the_old_class_just_registers(server, cli):
+    server.add_class("old", planned=30, registered=30, course_id="MA001", weekday=1)
+    server.add_class("new", planned=30, registered=29, course_id="MA001", weekday=3)
+    classes = sector_classes(cli)
+    scheduler, finished = start_scheduler(cli)
+    try:
+        scheduler.submit("MA001", SwitchJob(classes["old"], classes["new"]))
+        assert wait_until(lambda: finished)
+    finally:
+        scheduler.shutdown()
+    assert server.registered == {"new"}
+    assert server.drop_log == []
+
+
+def add_group(server, seats=(0, 0, 0)):
+    return [server.add_class(f"b{i}", planned=30, registered=30 - free, course_id="PE001", weekday=i + 1)
+            for i, free in enumerate(seats)]
+
+
+def fail_schedule_after_register(scheduler, server):
+    """选上班级之后的课表请求全部失败"""
+    fetch = scheduler.schedule_cache.fetch
+
+    def flaky(year, term):
+        if server.register_log:
+            raise ConnectionError("课表请求失败")
+        return fetch(year, term)
+
+    scheduler.schedule_cache.fetch = flaky
+
+
+def test_group_registers_only_the_best_ranked_section_with_space(server, cli):
+    add_group(server, seats=(0, 1, 1))
+    classes = sector_classes(cli)
+    scheduler, finished = start_scheduler(cli)
+    try:
+        scheduler.submit("PE001", GroupJob([classes["b0"], classes["b1"], classes["b2"]]))
+        assert wait_until(lambda: finished)
+    finally:
+        scheduler.shutdown()
+    assert server.registered == {"b1"}
+    assert [class_id for _, class_id, _ in server.register_log] == ["b1"]
+    assert finished[0].class_id == "b1"
+
+
+def test_group_keeps_its_seat_when_the_schedule_cannot_be_read(server, cli):
+    sections = add_group(server)
+    classes = sector_classes(cli)
+    scheduler, finished = start_scheduler(cli)
+    fail_schedule_after_register(scheduler, server)
+    job = GroupJob([classes["b0"], classes["b1"]])
+    try:
+        scheduler.submit("PE001", job)
+        time.sleep(0.2)
+        with server.lock:
+            sections[1].registered -= 1
+        assert wait_until(lambda: server.registered)
+        with server.lock:
+            sections[0].registered -= 1
+        assert wait_until(lambda: finished)
+        time.sleep(0.2)
+    finally:
+        scheduler.shutdown()
+    assert server.registered == {"b1"}
+    assert job.held is job.candidates[1]
+
+
+def test_group_upgrade_switches_to_a_better_section(server, cli):
+    sections = add_group(server)
+    classes = sector_classes(cli)
+    scheduler, finished = start_scheduler(cli)
+    fail_schedule_after_register(scheduler, server)
+    job = GroupJob([classes["b0"], classes["b1"]], upgrade=True)
+    try:
+        scheduler.submit("PE001", job)
+        time.sleep(0.2)
+        with server.lock:
+            sections[1].registered -= 1
+        assert wait_until(lambda: server.registered == {"b1"})
+        assert not finished
+        with server.lock:
+            sections[0].registered -= 1
+        assert wait_until(lambda: finished)
+    finally:
+        scheduler.shutdown()
+    assert server.registered == {"b0"}
+    assert [class_id for _, class_id in server.drop_log] == ["b1"]
+    assert finished[0].class_id == "b0"
+
+
+def polling(job):
+    """任务默认按 1 秒轮询，测试里加快到每个 tick 0.05 秒"""
+    job.pacing = AdaptiveInterval(fast=0.05, base=0.05, slow=0.05)
+    return job
+
+
+def quiet_after(server, settle=0.1, window=0.3):
+    """等已经发出的请求返回后，window 秒内服务器没有再收到请求"""
+    time.sleep(settle)
+    requests = server.requests
+    time.sleep(window)
+    return server.requests == requests
+
+
+def test_cancel_stops_polling_within_a_tick(server, cli):
+    server.add_class("a", planned=30, registered=30)
+    server.add_class("b", planned=30, registered=30)
+    classes = sector_classes(cli)
+    scheduler, finished = start_scheduler(cli)
+    try:
+        scheduler.submit("a", polling(SelectJob(classes["a"])))
+        scheduler.submit("b", polling(SelectJob(classes["b"])))
+        time.sleep(0.2)
+        scheduler.cancel("a")
+        # b 还在等待，轮询继续
+        assert not quiet_after(server)
+        scheduler.cancel("b")
+        assert quiet_after(server)
+        assert scheduler.pending() == []
+    finally:
+        scheduler.shutdown()
+    assert not finished
+
+
+def test_cancel_all_stops_polling_within_a_tick(server, cli):
+    server.add_class("a", planned=30, registered=30)
+    server.add_class("b", planned=30, registered=30)
+    classes = sector_classes(cli)
+    scheduler, finished = start_scheduler(cli)
+    try:
+        scheduler.submit("a", polling(SelectJob(classes["a"])))
+        scheduler.submit("b", polling(SelectJob(classes["b"])))
+        time.sleep(0.2)
+        scheduler.cancel_all()
+        assert quiet_after(server)
+        assert scheduler.pending() == []
+    finally:
+        scheduler.shutdown()
+
+
+def test_shutdown_stops_all_traffic(server, cli):
+    server.add_class("a", planned=30, registered=30)
+    classes = sector_classes(cli)
+    scheduler, finished = start_scheduler(cli)
+    scheduler.submit("a", polling(SelectJob(classes["a"])))
+    time.sleep(0.2)
+    started = time.monotonic()
+    scheduler.shutdown()
+    assert time.monotonic() - started < 1
+    assert not scheduler._thread.is_alive()
+    assert quiet_after(server)
+
+
+def test_replacement_waits_for_the_retiring_switch(server, cli):
+    new = add_switch_pair(server)
+    classes = sector_classes(cli)
+    dropping = Event()
+    drop = server.drop
+
+    def slow_drop(class_id):
+        dropping.set()
+        time.sleep(0.3)
+        return drop(class_id)
+
+    server.drop = slow_drop
+    started = []
+
+    class Probe(GrabJob):
+        async def run(self, scheduler):
+            started.append(time.time())
+            return None
+
+    scheduler, finished = start_scheduler(cli)
+    try:
+        scheduler.submit("MA001", SwitchJob(classes["old"], classes["new"]))
+        time.sleep(0.2)
+        with server.lock:
+            new.registered -= 1
+        assert dropping.wait(5)
+        # 换班正在退课时换成新任务：旧任务在临界区里完成切换，新任务等它结束才开始
+        scheduler.submit("MA001", Probe(), replace=True)
+        assert wait_until(lambda: started)
+    finally:
+        scheduler.shutdown()
+    assert server.registered == {"new"}
+    assert [klass.class_id for klass in finished] == ["new"]
+    assert started[0] >= server.register_log[-1][0]
+
+
+def test_group_submitted_before_opening_keeps_its_candidates(server, cli):
+    add_group(server, seats=(5, 5))
+    classes = sector_classes(cli)
+    server.open_at = server.now() + 1
+    scheduler, finished = start_scheduler(cli)
+    job = polling(GroupJob([classes["b0"], classes["b1"]]))
+    job.pacing.base = 0.2
+    try:
+        scheduler.submit("PE001", job)
+        assert wait_until(lambda: finished, timeout=10)
+    finally:
+        scheduler.shutdown()
+    # 开放前的请求被拒绝只是退避重试，候选都还在，开放后选上排名第一的
+    rejected = [t for t, _, flag in server.register_log if flag == "0"]
+    assert rejected and max(rejected) < server.open_at
+    assert [klass.class_id for klass in job.candidates] == ["b0", "b1"]
+    assert server.registered == {"b0"}
+    assert finished[0].class_id == "b0"
+
+
+def test_group_bursts_at_the_opening_time(server, cli):
+    add_group(server, seats=(5, 5))
+    classes = sector_classes(cli)
+    server.open_at = server.now() + 1
+    scheduler, finished = start_scheduler(cli)
+    scheduler.burst = BurstPlan(server.open_at)
+    try:
+        scheduler.submit("PE001", GroupJob([classes["b0"], classes["b1"]]))
+        assert wait_until(lambda: finished)
+    finally:
+        scheduler.shutdown()
+    # 开放前不发选课请求，到点向排名第一的候选集中发送
+    assert all(t >= server.open_at for t, _, _ in server.register_log)
+    assert {class_id for _, class_id, _ in server.register_log} == {"b0"}
+    assert server.registered == {"b0"}
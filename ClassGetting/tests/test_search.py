@@ -0,0 +1,90 @@
+import pytest
+
+from search import SectorIndex, parse_query
+from timetable import ScheduleTimetable
+
+
+@pytest.fixture
+def index(cli, server):
+    server.add_class("math-1", planned=30, name="高等数学", course_id="MA001", teacher="张老师", weekday=1,
+                     periods=(1, 2))
+    server.add_class("math-2", planned=30, name="高等数学", course_id="MA001", teacher="王老师", weekday=3,
+                     periods=(3, 4))
+    server.add_class("ds-1", planned=30, name="数据结构", course_id="CS201", teacher="李老师", weekday=3,
+                     periods=(1, 2))
+    server.add_class("pe-1", planned=30, name="体育", course_id="PE001", teacher="张老师", weekday=5,
+                     periods=(7, 8))
+    return SectorIndex(cli.course_selection_sectors[0].classes)
+
+
+def ids(classes):
+    return sorted(klass.class_id for klass in classes)
+
+
+def test_parse_query():
+    assert parse_query("高数 周三 第3节") == (["高数"], 3, 3)
+    assert parse_query("星期日 体育") == (["体育"], 0, None)
+    assert parse_query("周7") == ([], 0, None)
+
+
+def test_empty_query_returns_everything(index):
+    assert ids(index.search("")) == ["ds-1", "math-1", "math-2", "pe-1"]
+
+
+def test_single_and_bigram_keywords(index):
+    assert ids(index.search("数")) == ["ds-1", "math-1", "math-2"]
+    assert ids(index.search("数学")) == ["math-1", "math-2"]
+    assert ids(index.search("ma001")) == ["math-1", "math-2"]
+    assert ids(index.search("张老师")) == ["math-1", "pe-1"]
+
+
+def test_long_keyword_is_checked_as_a_whole(index):
+    # “数据”“据结”“结构”都在，但“数学结构”不是连续出现的
+    assert ids(index.search("数据结构")) == ["ds-1"]
+    assert index.search("数学结构") == []
+
+
+def test_keywords_do_not_match_across_fields(index):
+    # 课程名“体育”和班级名里的课程号之间有分隔，不会拼出“育(”
+    assert index.search("育(") == []
+
+
+def test_multiple_keywords_intersect(index):
+    assert ids(index.search("高等 王老师")) == ["math-2"]
+
+
+def test_time_filters(index):
+    assert ids(index.search("周三")) == ["ds-1", "math-2"]
+    assert ids(index.search("第7节")) == ["pe-1"]
+    assert ids(index.search("周三 第1节")) == ["ds-1"]
+    assert ids(index.search("数学 周三")) == ["math-2"]
+
+
+def test_prefix_search_narrows_the_last_result(index):
+    assert ids(index.search("高")) == ["math-1", "math-2"]
+    # 只在上次的结果里继续筛选：把上次结果改小，延长关键词时不会再找回 math-2
+    index._last = ("高", {0})
+    assert ids(index.search("高等")) == [index.classes[0].class_id]
+    # 不是上次关键词的延长时重新查倒排表
+    assert ids(index.search("等")) == ["math-1", "math-2"]
+
+
+def test_prefix_cache_is_not_reused_after_time_filter(index):
+    index.search("数")
+    assert ids(index.search("数 周一")) == ["math-1"]
+    assert ids(index.search("数据")) == ["ds-1"]
+
+
+def test_schedule_filter_hides_conflicts(cli, server):
+    server.add_class("ds-1", planned=30, name="数据结构", course_id="CS201", weekday=3, periods=(1, 2))
+    server.add_class("ds-2", planned=30, name="数据结构", course_id="CS201", weekday=3, periods=(1, 2))
+    server.add_class("en-1", planned=30, name="大学英语", course_id="EN001", weekday=3, periods=(2, 3))
+    server.add_class("en-2", planned=30, name="大学英语", course_id="EN001", weekday=3, periods=(3, 4))
+    index = SectorIndex(cli.course_selection_sectors[0].classes)
+    # 已选的数据结构在星期三第 1-2 节
+    server.enroll("ds-1")
+    schedule = ScheduleTimetable(cli.schedule(2025, 0))
+    # 同一门课的其他班级不算冲突
+    assert ids(index.search("", schedule)) == ["ds-1", "ds-2", "en-2"]
+    assert ids(index.search("英语", schedule)) == ["en-2"]
+    assert ids(index.search("英语")) == ["en-1", "en-2"]
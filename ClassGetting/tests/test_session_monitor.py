@@ -0,0 +1,41 @@
+import time
+from threading import Thread
+
+import pysjtu
+from pysjtu import consts
+
+from scheduler import GrabScheduler
+from session_monitor import ManagedSession, SessionMonitor
+
+
+def test_schedule_fetch_waits_for_a_running_relogin(server):
+    server.add_class("a", planned=30)
+    server.enroll("a")
+    session = ManagedSession(base_url=server.url)
+    redirected = []
+    session._client.event_hooks["response"].append(
+        lambda response: response.status_code == 302 and redirected.append(response.request.url.path))
+    cli = pysjtu.Client(session)
+    cli.schedule(2025, 0)
+
+    def login() -> pysjtu.Session:
+        time.sleep(0.3)
+        fresh = pysjtu.Session(base_url=server.url)
+        fresh.get(consts.HOME_URL, validate_session=False)
+        return fresh
+
+    monitor = SessionMonitor(session, login_func=login)
+    scheduler = GrabScheduler()
+    scheduler.cli, scheduler.session = cli, monitor
+    server.expire_sessions()
+    renewal = Thread(target=monitor.renew)
+    renewal.start()
+    while monitor._renewing is None:
+        time.sleep(0.005)
+    logins = server.logins
+    # 重新登录期间读课表：等新会话装好再发，不用失效的 cookie 白发一次
+    schedule = scheduler._fetch_schedule(2025, 0)
+    renewal.join()
+    assert [course.class_id for course in schedule] == ["a"]
+    assert server.logins == logins + 1
+    assert consts.SCHEDULE_URL.split("?")[0] not in redirected
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+from pysjtu.models.selection import LessonTime
+
+from scheduler import GrabScheduler, SelectJob
+from timetable import PERIODS, WEEK_BITS, ScheduleTimetable, Timetable, format_weeks, slot_mask, timetable_of, \
+    week_mask
+
+
+def test_slot_mask_layout():
+    # 第 3 周星期二第 5 节
+    assert slot_mask(2, [3], [5]) == 1 << (3 * WEEK_BITS + 2 * PERIODS + 4)
+    # 星期日用 0 或 7 表示都一样
+    assert slot_mask(0, [1], [1]) == slot_mask(7, [1], [1])
+    # 周数未知时占满整个学期
+    assert bin(slot_mask(1, None, [1])).count("1") == 24
+
+
+def test_week_mask_and_format():
+    assert format_weeks(week_mask([range(1, 9), 10, range(12, 17)])) == "1-8/10/12-16周"
+    assert format_weeks(week_mask([range(1, 16, 2)])) == "1/3/5/7/9/11/13/15周"
+    assert format_weeks(0) == "未知周"
+
+
+def lesson(weekday, weeks, periods):
+    return Timetable.of_times([LessonTime(weekday=weekday, week=weeks, time=[periods])])
+
+
+def test_overlapping_periods_conflict():
+    assert lesson(1, [range(1, 17)], range(1, 3)).mask & lesson(1, [range(1, 17)], range(2, 4)).mask
+    assert not lesson(1, [range(1, 17)], range(1, 3)).mask & lesson(1, [range(1, 17)], range(3, 5)).mask
+    assert not lesson(1, [range(1, 17)], range(1, 3)).mask & lesson(2, [range(1, 17)], range(1, 3)).mask
+
+
+def test_odd_and_even_weeks_do_not_conflict():
+    odd = lesson(3, [range(1, 17, 2)], range(5, 7))
+    even = lesson(3, [range(2, 17, 2)], range(5, 7))
+    assert not odd.mask & even.mask
+    assert odd.mask & lesson(3, [range(9, 10)], range(6, 7)).mask
+    assert odd.text == "星期三 第5-6节（1/3/5/7/9/11/13/15周）"
+
+
+def test_timetable_of_selection_class(server, cli):
+    server.add_class("tt-1", planned=30, weekday=5, periods=(3, 4), weeks="1-8周")
+    klass = cli.course_selection_sectors[0].classes[0]
+    timetable = timetable_of(klass)
+    assert timetable.mask == slot_mask(5, [range(1, 9)], range(3, 5))
+    assert timetable.text == "星期五 第3-4节（1-8周）"
+    assert timetable_of(klass) is timetable
+
+
+def test_schedule_conflicts_skip_the_same_course(server, cli):
+    server.add_class("math-1", planned=30, course_id="MA001", weekday=1, periods=(1, 2))
+    server.add_class("math-2", planned=30, course_id="MA001", weekday=1, periods=(1, 2))
+    server.add_class("en-1", planned=30, course_id="EN001", weekday=1, periods=(2, 3))
+    server.add_class("pe-1", planned=30, course_id="PE001", weekday=1, periods=(7, 8))
+    server.enroll("math-1")
+    schedule = ScheduleTimetable(cli.schedule(2025, 0))
+    classes = {klass.class_id: klass for klass in cli.course_selection_sectors[0].classes}
+    assert schedule.conflicts(timetable_of(classes["math-2"]).mask, "kMA001") == []
+    assert schedule.conflicts(timetable_of(classes["en-1"]).mask, "kEN001") == ["math-1"]
+    assert schedule.conflicts(timetable_of(classes["pe-1"]).mask, "kPE001") == []
+    # 不给课程时同一门课也算冲突
+    assert schedule.conflicts(timetable_of(classes["math-2"]).mask) == ["math-1"]
+
+
+def test_schedule_skips_courses_without_times():
+    course = SimpleNamespace(course_id="X", class_id="x", day=None, week=None, time=None)
+    assert ScheduleTimetable([course]).mask == 0
+
+
+def test_conflicting_job_sends_no_request(server, cli):
+    server.add_class("math-1", planned=30, course_id="MA001", weekday=1, periods=(1, 2))
+    server.add_class("en-1", planned=30, course_id="EN001", weekday=1, periods=(2, 3))
+    server.enroll("math-1")
+    classes = {klass.class_id: klass for klass in cli.course_selection_sectors[0].classes}
+    finished = []
+    scheduler = GrabScheduler(request_budget=100, on_finish=finished.append)
+    scheduler.cli = cli
+    scheduler.start()
+    try:
+        scheduler.submit("EN001", SelectJob(classes["en-1"]))
+        assert scheduler.join(5)
+    finally:
+        scheduler.shutdown()
+    assert server.register_log == []
+    assert finished == []
@@ -0,0 +1,146 @@
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+# 一学期最多的周数、一天最多的节次，超出的部分不参与冲突判断
+WEEKS = 24
+PERIODS = 16
+# 位掩码布局：第 w 周星期 d 第 p 节对应第 (w * 7 + d) * PERIODS + (p - 1) 位
+WEEK_BITS = 7 * PERIODS
+# 下标为 pysjtu 的 weekday，0 是星期日；课表的 day 用 7 表示星期日，统一按 7 取模
+DAY_NAMES = ("日", "一", "二", "三", "四", "五", "六")
+
+
+def week_numbers(week) -> Iterable[int]:
+    # week 是 pysjtu 解析出的 range 或 int 的列表，单双周是步长为 2 的 range
+    for w in week or []:
+        if isinstance(w, range):
+            yield from w
+        else:
+            yield w
+
+
+def week_mask(week) -> int:
+    mask = 0
+    for n in week_numbers(week):
+        mask |= 1 << n
+    return mask
+
+
+def format_weeks(mask: int) -> str:
+    """把周的位掩码合并成 "1-8/10/12-16周" 这样的文字"""
+    if not mask:
+        return "未知周"
+    parts = []
+    while mask:
+        start = (mask & -mask).bit_length() - 1
+        # 从最低位开始的一段连续的 1
+        run = ((mask >> start) + 1) & ~(mask >> start)
+        end = start + run.bit_length() - 2
+        parts.append(f"{start}" if start == end else f"{start}-{end}")
+        mask &= ~(((1 << (end - start + 1)) - 1) << start)
+    return "/".join(parts) + "周"
+
+
+def slot_mask(weekday: int, week, periods: Iterable[int]) -> int:
+    """某个星期几、某些周、某些节次占用的位。周数未知时按整个学期处理"""
+    day = 0
+    for period in periods:
+        if 1 <= period <= PERIODS:
+            day |= 1 << (period - 1)
+    day <<= (weekday % 7) * PERIODS
+    weeks = [w for w in set(week_numbers(week)) if 0 <= w <= WEEKS] or range(1, WEEKS + 1)
+    mask = 0
+    for w in weeks:
+        mask |= day << (w * WEEK_BITS)
+    return mask
+
+
+def lesson_times(time_field) -> list:
+    # time 可能是 LessonTime 或 List[LessonTime]
+    if not time_field:
+        return []
+    return time_field if isinstance(time_field, list) else [time_field]
+
+
+def format_times(time_field) -> str:
+    times = lesson_times(time_field)
+    if not times:
+        return "未知"
+    result = []
+    for t in times:
+        weekday = DAY_NAMES[t.weekday % 7] if isinstance(t.weekday, int) else str(t.weekday)
+        weeks = format_weeks(week_mask(t.week))
+        for rng in t.time:
+            # Python range 的 stop 是开区间
+            result.append(f"星期{weekday} 第{rng.start}-{rng.stop - 1}节（{weeks}）")
+    return "; ".join(result)
+
+
+class Timetable:
+    """一个班级占用的 周×星期×节次 位掩码和格式化好的上课时间，两个班级冲突即掩码相与不为 0"""
+    __slots__ = ("mask", "text")
+
+    def __init__(self, mask: int, text: str):
+        self.mask = mask
+        self.text = text
+
+    @classmethod
+    def of_times(cls, time_field) -> "Timetable":
+        mask = 0
+        for t in lesson_times(time_field):
+            mask |= slot_mask(t.weekday, t.week, (period for rng in t.time for period in rng))
+        return cls(mask, format_times(time_field))
+
+
+# class_id -> Timetable，上课时间在一个选课轮次内不变，每个班级只计算一次
+_timetables: Dict[str, Timetable] = dict()
+_lock = Lock()
+
+
+def timetable_of(klass) -> Timetable:
+    """班级的时间表。time 是懒加载字段，第一次调用可能请求服务器，不要在 GUI 线程或事件循环里调用"""
+    timetable = _timetables.get(klass.class_id)
+    if timetable is None:
+        timetable = Timetable.of_times(klass.time)
+        with _lock:
+            timetable = _timetables.setdefault(klass.class_id, timetable)
+    return timetable
+
+
+class ScheduleTimetable:
+    """
+    课表中已选班级的位掩码。同一门课的其他班级不算冲突（选上的是它自己，或者换班时会先退掉），
+    所以按课程分别记录，另外保存总的掩码，绝大多数不冲突的情况只需一次与运算
+    """
+
+    def __init__(self, courses: Iterable):
+        # course_id -> class_id -> 掩码；课表中同一个班级每个上课时段各占一条
+        self.by_course: Dict[str, Dict[str, int]] = dict()
+        self.mask = 0
+        for course in courses:
+            if course.day is None or course.time is None:
+                continue
+            mask = slot_mask(course.day, course.week, course.time)
+            classes = self.by_course.setdefault(course.course_id, dict())
+            classes[course.class_id] = classes.get(course.class_id, 0) | mask
+            self.mask |= mask
+        self._busy: Dict[Optional[str], int] = {None: self.mask}
+
+    def busy_mask(self, course_id: Optional[str] = None) -> int:
+        """除 course_id 这门课以外的已选班级占用的位"""
+        busy = self._busy.get(course_id)
+        if busy is None:
+            busy = 0
+            for other, classes in self.by_course.items():
+                if other != course_id:
+                    for mask in classes.values():
+                        busy |= mask
+            self._busy[course_id] = busy
+        return busy
+
+    def conflicts(self, mask: int, course_id: Optional[str] = None) -> List[str]:
+        """与 mask 冲突的已选班级的 class_id，不包括 course_id 这门课的班级"""
+        if not mask & self.busy_mask(course_id):
+            return []
+        return [class_id for other, classes in self.by_course.items() if other != course_id
+                for class_id, class_mask in classes.items() if class_mask & mask]
@@ -1,89 +1,111 @@
-from typing import List
-import json
-import os
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Set
 import base64
 
 from PyQt5 import QtWidgets
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QMainWindow, QLabel, QComboBox, QLineEdit, QListWidget, QListWidgetItem
-from pysjtu.models import SelectionClass
-
-ACCOUNTS_FILE = "accounts.json"
-
-def load_accounts():
-    if os.path.exists(ACCOUNTS_FILE):
-        with open(ACCOUNTS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
-
-def save_account(username, password):
-    accounts = load_accounts()
-    # 简单去重
-    accounts = [acc for acc in accounts if acc["username"] != username]
-    accounts.insert(0, {"username": username, "password": password})
-    with open(ACCOUNTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(accounts, f, ensure_ascii=False, indent=2)
-
-def get_password(username):
-    accounts = load_accounts()
-    for acc in accounts:
-        if acc["username"] == username:
-            return acc["password"]
-    return ""
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QMainWindow, QLabel, QComboBox, QLineEdit, QListWidget, QListWidgetItem, QListView, \
+    QCheckBox, QPushButton, QTableWidget, QTableWidgetItem
+
+from accounts import load_accounts, save_account, get_password
+from timetable import format_times, timetable_of
+
+if TYPE_CHECKING:
+    # 登录窗口要尽快显示，本模块运行时只依赖 PyQt5，pysjtu 由 app 在后台导入
+    from pysjtu.models import SelectionClass
+
+
+# 已选列表项中保存当前显示的余量走势，更新时替换掉
+SPARKLINE_ROLE = Qt.UserRole + 1
+
 
 def lesson_time_to_str(time_field):
     # time_field 可能是 LessonTime 或 List[LessonTime]
-    if not time_field:
-        return "未知"
-    if isinstance(time_field, list):
-        times = time_field
-    else:
-        times = [time_field]
-    weekday_map = {1: "一", 2: "二", 3: "三", 4: "四", 5: "五", 6: "六", 7: "日"}
-    result = []
-    for t in times:
-        weekday = weekday_map.get(t.weekday, str(t.weekday))
-        # 处理周数
-        week_str = "未知周"
-        if hasattr(t, "week") and t.week:
-            week_parts = []
-            # 支持 range 或 int
-            for w in t.week:
-                if isinstance(w, range):
-                    week_parts.append(f"{w.start}-{w.stop-1}周")
-                else:
-                    week_parts.append(f"{w}周")
-            # 合并连续周为区间，不连续周用 /
-            # 先把所有周数展开为列表
-            week_nums = []
-            for w in t.week:
-                if isinstance(w, range):
-                    week_nums.extend(list(w))
-                else:
-                    week_nums.append(w)
-            week_nums = sorted(set(week_nums))
-            # 合并连续区间
-            ranges = []
-            start = prev = week_nums[0]
-            for num in week_nums[1:]:
-                if num == prev + 1:
-                    prev = num
-                else:
-                    if start == prev:
-                        ranges.append(f"{start}")
-                    else:
-                        ranges.append(f"{start}-{prev}")
-                    start = prev = num
-            if start == prev:
-                ranges.append(f"{start}")
-            else:
-                ranges.append(f"{start}-{prev}")
-            week_str = "/".join(ranges) + "周"
-        for rng in t.time:
-            start = rng.start
-            end = rng.stop - 1  # Python range 的 stop 是开区间
-            result.append(f"星期{weekday} 第{start}-{end}节（{week_str}）")
-    return "; ".join(result)
+    return format_times(time_field)
+
+
+def remaining_capacity(klass: SelectionClass) -> int:
+    return klass.students_planned - klass.students_registered
+
+
+class ResultListModel(QAbstractListModel):
+    """
+    搜索结果模型：只在视图请求某一行时才格式化该行，
+    格式化好的课程名/教师/时间按 class_id 缓存，容量每次显示时现取。
+    按余量排序时另外保留搜索返回的原始顺序，取消排序时恢复
+    """
+    check_changed = pyqtSignal(object, bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.results: List[SelectionClass] = []
+        self.source: List[SelectionClass] = []
+        self.checked: Set[str] = set()
+        self._text_cache: Dict[str, str] = dict()
+
+    def set_results(self, results: List[SelectionClass]):
+        self.beginResetModel()
+        self.source = list(results)
+        self.results = list(results)
+        self.endResetModel()
+
+    def row_text(self, klass: SelectionClass) -> str:
+        text = self._text_cache.get(klass.class_id)
+        if text is None:
+            teachers = ', '.join([t[0] for t in klass.teachers]) if klass.teachers else '未知'
+            text = f"{klass.name} | 教师: {teachers} | 时间: {timetable_of(klass).text}"
+            self._text_cache[klass.class_id] = text
+        return f"{text} | 容量：{klass.students_registered}/{klass.students_planned}"
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.results)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        klass = self.results[index.row()]
+        if role == Qt.DisplayRole:
+            return self.row_text(klass)
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if klass.class_id in self.checked else Qt.Unchecked
+        if role == Qt.UserRole:
+            return klass
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or not index.isValid():
+            return False
+        klass = self.results[index.row()]
+        checked = value == Qt.Checked
+        if checked == (klass.class_id in self.checked):
+            return False
+        if checked:
+            self.checked.add(klass.class_id)
+        else:
+            self.checked.discard(klass.class_id)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        self.check_changed.emit(klass, checked)
+        return True
+
+    def capacity_changed(self):
+        """已选人数在后台刷新后调用，只需重绘，静态文本缓存仍然有效"""
+        if self.results:
+            self.dataChanged.emit(self.index(0), self.index(len(self.results) - 1), [Qt.DisplayRole])
+
+    def sort(self, column=0, order=Qt.DescendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self.results.sort(key=remaining_capacity, reverse=order == Qt.DescendingOrder)
+        self.layoutChanged.emit()
+
+    def restore_order(self):
+        self.layoutAboutToBeChanged.emit()
+        self.results = list(self.source)
+        self.layoutChanged.emit()
+
 
 class CourseSelectionWindow(QMainWindow):
     def __init__(self):
@@ -112,8 +134,17 @@ class CourseSelectionWindow(QMainWindow):
         # 添加课程搜索结果列表
         result_label = QLabel('搜索结果：', self)
         result_label.setGeometry(50, 100, 80, 20)
-        self.result_list = QListWidget(self)
+        self.sort_checkbox = QCheckBox('按余量排序', self)
+        self.sort_checkbox.setGeometry(300, 100, 100, 20)
+        # 勾选后不显示与当前课表时间冲突的班级
+        self.conflict_checkbox = QCheckBox('隐藏冲突', self)
+        self.conflict_checkbox.setGeometry(200, 100, 90, 20)
+        self.result_model = ResultListModel(self)
+        self.result_list = QListView(self)
+        self.result_list.setModel(self.result_model)
         self.result_list.setGeometry(50, 130, 350, 400)
+        # 行高一致时视图只需为可见行取数据
+        self.result_list.setUniformItemSizes(True)
 
         # 添加已选课程列表
         selected_label = QLabel('已选课程：', self)
@@ -121,18 +152,44 @@ class CourseSelectionWindow(QMainWindow):
         self.selected_list = QListWidget(self)
         self.selected_list.setGeometry(450, 130, 300, 400)
 
+        # 添加选课开放时间输入框，留空则立即开始抢课
+        open_time_label = QLabel('开放时间：', self)
+        open_time_label.setGeometry(450, 540, 70, 20)
+        self.open_time_edit = QLineEdit(self)
+        self.open_time_edit.setPlaceholderText('如 2025-06-20 12:00:00')
+        self.open_time_edit.setGeometry(520, 540, 230, 20)
+
+        # 添加统计按钮，打开请求耗时和计数的统计面板
+        self.stats_button = QPushButton('统计', self)
+        self.stats_button.setGeometry(50, 540, 80, 22)
+        # 导出轮询记录下来的余量变化
+        self.export_button = QPushButton('导出余量', self)
+        self.export_button.setGeometry(140, 540, 80, 22)
+        # 每 2 秒刷新已选列表中各班级的余量走势
+        self.sparkline_handler = None
+        self.sparkline_timer = QTimer(self)
+        self.sparkline_timer.timeout.connect(self.refresh_sparklines)
+        self.sparkline_timer.start(2000)
+
         # 添加选中框
-        self.result_list.itemClicked.connect(self.on_result_item_clicked)
-        self.result_list.setSelectionMode(QListWidget.MultiSelection)
-        self.result_list.setSelectionBehavior(QListWidget.SelectRows)
+        self.result_model.check_changed.connect(self.on_result_check_changed)
+        self.sort_checkbox.toggled.connect(
+            lambda checked: self.result_model.sort() if checked else self.result_model.restore_order())
+        self.result_list.setSelectionMode(QListView.MultiSelection)
+        self.result_list.setSelectionBehavior(QListView.SelectRows)
         self.result_list.setAlternatingRowColors(True)
-        # self.result_list.setStyleSheet("QListWidget::item:selected{background-color: rgb(200, 200, 200);}")
+        # self.result_list.setStyleSheet("QListView::item:selected{background-color: rgb(200, 200, 200);}")
 
         # 新增：维护 selected_courses
         self.selected_courses = []
 
+    def set_status(self, text: str):
+        self.statusBar().showMessage(text)
+
     def clear_selection(self):
         self.selected_list.clear()
+        self.selected_courses.clear()
+        self.result_model.checked.clear()
 
     def finish_select(self, course: SelectionClass):
         for i in range(self.selected_list.count()):
@@ -140,6 +197,12 @@ class CourseSelectionWindow(QMainWindow):
             if selected_item.data(Qt.UserRole) == course:
                 selected_item.setText(selected_item.text().replace("抢课中...", "已选上"))
 
+    def fail_select(self, course: SelectionClass, reason: str):
+        for i in range(self.selected_list.count()):
+            selected_item = self.selected_list.item(i)
+            if selected_item.data(Qt.UserRole) == course:
+                selected_item.setText(selected_item.text().replace("抢课中...", reason))
+
     def set_on_select_course_handler(self, handler):
         self.on_select_course_handler = handler
 
@@ -150,50 +213,90 @@ class CourseSelectionWindow(QMainWindow):
         self.sector_combobox.currentIndexChanged.connect(lambda: handler(self.sector_combobox.currentText()))
 
     def add_search_handler(self, handler):
-        self.keyword_edit.returnPressed.connect(lambda: handler(self.keyword_edit.text()))
+        # 搜索走本地索引，边输入边刷新结果
+        self.keyword_edit.textChanged.connect(handler)
+
+    def add_conflict_filter_handler(self, handler):
+        self.conflict_checkbox.toggled.connect(handler)
+
+    def add_stats_handler(self, handler):
+        self.stats_button.clicked.connect(handler)
+
+    def add_export_handler(self, handler):
+        self.export_button.clicked.connect(handler)
+
+    def set_sparkline_handler(self, handler):
+        """handler(class_id) 返回该班级的余量走势文字"""
+        self.sparkline_handler = handler
+
+    def refresh_sparklines(self):
+        if self.sparkline_handler is None:
+            return
+        for i in range(self.selected_list.count()):
+            selected_item = self.selected_list.item(i)
+            sparkline = self.sparkline_handler(selected_item.data(Qt.UserRole).class_id)
+            old = selected_item.data(SPARKLINE_ROLE) or ""
+            if sparkline == old:
+                continue
+            text = selected_item.text()[:-len(old) - 1] if old else selected_item.text()
+            selected_item.setText(f"{text} {sparkline}" if sparkline else text)
+            selected_item.setData(SPARKLINE_ROLE, sparkline)
+
+    def add_open_time_handler(self, handler):
+        self.open_time_edit.editingFinished.connect(lambda: handler(self.open_time_edit.text()))
 
     def add_sectors(self, sectors: List[str]):
+        # 添加时不触发切换分区，由调用方加载第一个分区
+        self.sector_combobox.blockSignals(True)
         self.sector_combobox.addItems(sectors)
+        self.sector_combobox.blockSignals(False)
+
+    def clear_sectors(self):
+        # 清空时不触发切换分区
+        self.sector_combobox.blockSignals(True)
+        self.sector_combobox.clear()
+        self.sector_combobox.blockSignals(False)
 
     def set_search_results(self, results: List[SelectionClass]):
-        print(results)
-        self.result_list.clear()
-        for result in results:
-            self.add_search_result(result)
-
-    def add_search_result(self, result: SelectionClass):
-        teachers = ', '.join([t[0] for t in result.teachers]) if hasattr(result, 'teachers') and result.teachers else '未知'
-        time_info = lesson_time_to_str(result.time)
-        text = f"{result.name} | 教师: {teachers} | 时间: {time_info} | 容量：{result.students_registered}/{result.students_planned}"
-        item = QListWidgetItem(text, self.result_list)
-        item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
-        item.setCheckState(Qt.Unchecked)
-        item.setData(Qt.UserRole, result)
-
-    def on_result_item_clicked(self, item):
+        self.result_model.set_results(results)
+        if self.sort_checkbox.isChecked():
+            self.result_model.sort()
+
+    def refresh_capacity(self):
+        self.result_model.capacity_changed()
+        if self.sort_checkbox.isChecked():
+            self.result_model.sort()
+
+    def on_result_check_changed(self, course: SelectionClass, checked: bool):
         # 处理选中结果
-        if item.checkState() == Qt.Checked:
-            self.add_selected_item(item)
+        if checked:
+            self.add_selected_item(course)
         else:
-            self.remove_selected_item(item)
+            self.remove_selected_item(course)
+
+    def add_selected_item(self, course: SelectionClass):
+        self._add_item(course)
+        if self.on_select_course_handler is not None:
+            self.on_select_course_handler(course)
+
+    def restore_selected_item(self, course: SelectionClass):
+        """恢复上次未结束的任务：勾选并加入已选列表，不触发选课回调"""
+        self.result_model.checked.add(course.class_id)
+        self._add_item(course)
 
-    def add_selected_item(self, item):
-        course: SelectionClass = item.data(Qt.UserRole)
+    def _add_item(self, course: SelectionClass):
         selected_text = f"{course.name} 状态：抢课中..."
         selected_item = QListWidgetItem(selected_text, self.selected_list)
         selected_item.setData(Qt.UserRole, course)
         # 新增：维护 selected_courses
         if course not in self.selected_courses:
             self.selected_courses.append(course)
-        if self.on_select_course_handler is not None:
-            self.on_select_course_handler(course)
 
-    def remove_selected_item(self, item):
-        course: SelectionClass = item.data(Qt.UserRole)
+    def remove_selected_item(self, course: SelectionClass):
         # 从已选列表中移除选中的课程
         for i in range(self.selected_list.count()):
             selected_item = self.selected_list.item(i)
-            if selected_item.data(Qt.UserRole) == item.data(Qt.UserRole):
+            if selected_item.data(Qt.UserRole).class_id == course.class_id:
                 self.selected_list.takeItem(i)
                 if course in self.selected_courses:
                     self.selected_courses.remove(course)
@@ -202,6 +305,45 @@ class CourseSelectionWindow(QMainWindow):
                 break
 
 
+class StatsPanel(QtWidgets.QDialog):
+    """统计面板：每秒从 metrics.summary() 刷新各项请求的次数和耗时"""
+    COLUMNS = ['指标', '标签', '次数', 'p50(ms)', 'p99(ms)']
+
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.setWindowTitle('统计')
+        self.resize(640, 400)
+        self.table = QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.table)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        rows = self.metrics.summary()
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            labels = ' '.join(f"{k}={v}" for k, v in row['labels'].items())
+            values = [row['name'], labels, str(int(row['count']))]
+            if 'p50' in row:
+                values += [f"{row['p50'] * 1000:.1f}", f"{row['p99'] * 1000:.1f}"]
+            else:
+                values += ['', '']
+            for j, value in enumerate(values):
+                self.table.setItem(i, j, QTableWidgetItem(value))
+
+
 class LoginDialog(QtWidgets.QDialog):
     def __init__(self, parent=None):
         super(LoginDialog, self).__init__(parent)